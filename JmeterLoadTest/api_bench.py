@@ -0,0 +1,254 @@
+import argparse
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from importlib import metadata
+
+from loadgen import run_load
+
+# The directory of the factorial API, started with its serve.py
+API_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "website_back_API", "API_Flask")
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+
+def free_port():
+    """
+    Return a TCP port that is free on the loopback interface.
+    """
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def process_tree(pid):
+    """
+    Return the pids of a process and of all its descendants, from /proc.
+    """
+    children = {}
+    for name in os.listdir("/proc"):
+        if not name.isdigit():
+            continue
+        try:
+            with open("/proc/{}/stat".format(name)) as f:
+                # The command name (2nd field) may contain spaces: the fields after it follow the last ")"
+                fields = f.read().rpartition(")")[2].split()
+        except OSError:
+            continue
+        children.setdefault(int(fields[1]), []).append(int(name))
+    tree = [pid]
+    for parent in tree:
+        tree.extend(children.get(parent, []))
+    return tree
+
+
+def cpu_seconds(pids):
+    """
+    Return the CPU time (user and system) of processes and of their waited children, in seconds.
+    """
+    total = 0
+    for pid in pids:
+        try:
+            with open("/proc/{}/stat".format(pid)) as f:
+                fields = f.read().rpartition(")")[2].split()
+        except OSError:
+            continue
+        # utime, stime, cutime and cstime are the fields 14 to 17 of /proc/<pid>/stat
+        total += sum(int(value) for value in fields[11:15])
+    return total / CLOCK_TICKS
+
+
+def rss_bytes(pids):
+    """
+    Return the resident memory of processes, in bytes.
+    """
+    total = 0
+    for pid in pids:
+        try:
+            with open("/proc/{}/statm".format(pid)) as f:
+                total += int(f.read().split()[1]) * PAGE_SIZE
+        except OSError:
+            continue
+    return total
+
+
+class ServerMonitor:
+    """
+    Sample the resident memory of a server process tree in a background thread, keeping its peak.
+
+    Parameters:
+        pid (int): The pid of the server.
+        interval (float): The time between two samples, in seconds.
+    """
+
+    def __init__(self, pid, interval=0.1):
+        self.pid = pid
+        self.interval = interval
+        self.peak_rss = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="monitor-{}".format(pid), daemon=True)
+
+    def _run(self):
+        while not self.stopped.is_set():
+            self.peak_rss = max(self.peak_rss, rss_bytes(process_tree(self.pid)))
+            self.stopped.wait(self.interval)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.thread.join()
+
+
+def start_server(mode, port, env, timeout=30):
+    """
+    Start the factorial API in a serving mode with serve.py and wait until it answers /healthz.
+
+    Returns:
+        subprocess.Popen: The server process.
+    """
+    server = subprocess.Popen(
+        [sys.executable, "serve.py", "--mode", mode, "--host", "127.0.0.1", "--port", str(port)],
+        cwd=API_DIRECTORY, env=dict(os.environ, **env), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True,
+    )
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError("The {} server exited with code {}".format(mode, server.returncode))
+        try:
+            with urllib.request.urlopen("http://127.0.0.1:{}/healthz".format(port), timeout=1) as response:
+                if response.status == 200:
+                    return server
+        except OSError:
+            time.sleep(0.2)
+    stop_server(server)
+    raise RuntimeError("The {} server did not answer within {} s".format(mode, timeout))
+
+
+def stop_server(server):
+    """
+    Stop a server and all its workers.
+    """
+    try:
+        os.killpg(server.pid, 15)
+        server.wait(10)
+    except ProcessLookupError:
+        pass
+    except subprocess.TimeoutExpired:
+        os.killpg(server.pid, 9)
+        server.wait()
+
+
+def environment(args, env):
+    """
+    Return the metadata of the machine and of the software the benchmark ran with.
+    """
+    cpu_model = None
+    try:
+        with open("/proc/cpuinfo") as f:
+            cpu_model = next((line.split(":", 1)[1].strip() for line in f if line.startswith("model name")), None)
+    except OSError:
+        pass
+    versions = {}
+    for package in ("flask", "gunicorn", "uvicorn", "numpy"):
+        try:
+            versions[package] = metadata.version(package)
+        except metadata.PackageNotFoundError:
+            versions[package] = None
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=API_DIRECTORY, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "host": platform.node(), "platform": platform.platform(),
+        "python": platform.python_version(), "cpu_model": cpu_model, "cpu_count": os.cpu_count(),
+        "packages": versions, "commit": commit, "server_env": env, "arguments": vars(args),
+    }
+
+
+def bench_level(port, mode, numbers, concurrency, duration, warmup, processes, pid):
+    """
+    Measure one load level against a running server: warm up, then keep concurrency requests in flight for the duration.
+
+    Returns:
+        dict: The throughput, the latency percentiles, the errors, the CPU seconds per request and the peak memory of the server.
+    """
+    url = "http://127.0.0.1:{}/factorial?mode={}".format(port, mode)
+    connections = max(concurrency // processes, 1)
+    if warmup:
+        run_load(None, url, processes, connections, min_number=numbers[0], max_number=numbers[1], duration=warmup)
+    pids = process_tree(pid)
+    cpu_before = cpu_seconds(pids)
+    with ServerMonitor(pid) as monitor:
+        summary = run_load(None, url, processes, connections, min_number=numbers[0], max_number=numbers[1], duration=duration)
+    # Workers started during the level are counted too
+    cpu = cpu_seconds(process_tree(pid)) - cpu_before
+    latency = summary["service_time"]
+    p50, p99, p999 = latency.percentiles([50, 99, 99.9])
+    return {
+        "requests": latency.total, "errors": summary["errors"], "throughput": latency.total / duration,
+        "p50_ms": p50 / 1000, "p99_ms": p99 / 1000, "p999_ms": p999 / 1000,
+        "cpu_seconds_per_request": cpu / latency.total if latency.total else None, "peak_rss_mib": monitor.peak_rss / 2 ** 20,
+    }
+
+
+def main():
+    """
+    Main function to benchmark the factorial API locally in each serving mode.
+    """
+    # Define the command-line arguments
+    parser = argparse.ArgumentParser(description="Benchmark the factorial API locally in each serving mode")
+    parser.add_argument("--server_modes", type=str, nargs="+", default=["dev", "prefork", "async"], choices=["dev", "prefork", "async"], help="The serving modes of serve.py")
+    parser.add_argument("--n_ranges", type=str, nargs="+", default=["1-1555", "1555-5000"], help="The ranges of the factorial arguments, as min-max")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32], help="The numbers of requests in flight")
+    parser.add_argument("--payloads", type=str, nargs="+", default=["full", "compact"], choices=["full", "stream", "compact"], help="The response modes of the API (all the digits, streamed digits or a summary of them), which set the payload size")
+    parser.add_argument("--duration", type=float, default=10, help="The duration of a load level, in seconds")
+    parser.add_argument("--warmup", type=float, default=2, help="The warm-up time before each load level, in seconds")
+    parser.add_argument("--processes", type=int, default=1, help="The number of load generator processes")
+    parser.add_argument("--cpu_request", type=int, default=96, help="The CPU request emulated for the server (CPU_REQUEST_MILLICORES, which sets the number of workers)")
+    parser.add_argument("--env", type=str, nargs="*", default=[], help="More environment variables of the server, as NAME=VALUE")
+    parser.add_argument("--output", type=str, default="api_bench.json", help="The output file")
+    args = parser.parse_args()
+
+    env = dict(item.split("=", 1) for item in args.env)
+    env.setdefault("CPU_REQUEST_MILLICORES", str(args.cpu_request))
+    results = []
+    print("{:>8} {:>10} {:>8} {:>5} {:>10} {:>9} {:>9} {:>9} {:>7} {:>12} {:>9}".format("server", "n", "payload", "conc", "req/s", "p50 ms", "p99 ms", "p999 ms", "errors", "cpu ms/req", "rss MiB"))
+    for mode in args.server_modes:
+        port = free_port()
+        server = start_server(mode, port, env)
+        try:
+            for n_range in args.n_ranges:
+                numbers = tuple(int(value) for value in n_range.split("-"))
+                for payload in args.payloads:
+                    for concurrency in args.concurrency:
+                        result = bench_level(port, payload, numbers, concurrency, args.duration, args.warmup, args.processes, server.pid)
+                        result = dict({"server_mode": mode, "n_range": n_range, "payload": payload, "concurrency": concurrency}, **result)
+                        results.append(result)
+                        cpu = result["cpu_seconds_per_request"]
+                        print("{:>8} {:>10} {:>8} {:>5} {:>10.1f} {:>9.2f} {:>9.2f} {:>9.2f} {:>7} {:>12} {:>9.1f}".format(
+                            mode, n_range, payload, concurrency, result["throughput"], result["p50_ms"], result["p99_ms"], result["p999_ms"],
+                            result["errors"], "-" if cpu is None else "{:.3f}".format(cpu * 1000), result["peak_rss_mib"]), flush=True)
+        finally:
+            stop_server(server)
+
+    with open(args.output, "w") as f:
+        json.dump({"environment": environment(args, env), "results": results}, f, indent=1)
+    print("Wrote {} results to {}".format(len(results), args.output))
+    # The CPU request that sustains a rate is the CPU time per request times the rate
+    print("CPU request for 100 requests/s (millicores): " + ", ".join(
+        "{} {} {}: {:.0f}".format(r["server_mode"], r["n_range"], r["payload"], r["cpu_seconds_per_request"] * 100 * 1000)
+        for r in results if r["concurrency"] == max(args.concurrency) and r["cpu_seconds_per_request"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,514 @@
+import argparse
+import asyncio
+import csv
+import json
+import multiprocessing
+import os
+import random
+import socket
+import time
+from urllib.parse import urlsplit
+
+import numpy as np
+import pandas as pd
+
+# The columns of the JMeter CSV results, read by jmeter_ingest.py and draw_metrics.py
+RESULTS_COLUMNS = [
+    "timeStamp", "elapsed", "label", "responseCode", "responseMessage", "threadName", "dataType", "success",
+    "failureMessage", "bytes", "sentBytes", "grpThreads", "allThreads", "URL", "Latency", "IdleTime", "Connect",
+]
+
+# The label of the factorial requests in the JMeter plans
+LABEL = "HTTP Request API"
+
+
+class LatencyHistogram:
+    """
+    A latency histogram with a bounded relative error, in the layout of HdrHistogram.
+
+    Values (integers, e.g. microseconds) below 2 * sub_buckets are counted
+    exactly; above, each power of 2 is split in sub_buckets linear buckets,
+    so a value is known within 1 / sub_buckets of itself. Histograms with
+    the same precision merge by adding their counts, e.g. across processes.
+
+    Parameters:
+        significant_digits (int): The number of significant decimal digits kept (1 to 4).
+    """
+
+    def __init__(self, significant_digits=2):
+        self.significant_digits = significant_digits
+        # The smallest power of 2 that holds 2 * 10**digits values, halved
+        self.sub_bucket_bits = (2 * 10 ** significant_digits - 1).bit_length() - 1
+        self.sub_buckets = 1 << self.sub_bucket_bits
+        self.counts = [0] * (2 * self.sub_buckets)
+        self.total = 0
+        self.sum = 0
+        self.min = None
+        self.max = None
+
+    def index_of(self, value):
+        """
+        Return the bucket of a non-negative integer value.
+        """
+        shift = value.bit_length() - self.sub_bucket_bits - 1
+        if shift <= 0:
+            return value
+        return (shift + 1) * self.sub_buckets + (value >> shift) - self.sub_buckets
+
+    def value_of(self, index):
+        """
+        Return the middle of the values of a bucket.
+        """
+        if index < 2 * self.sub_buckets:
+            return float(index)
+        shift = index // self.sub_buckets - 1
+        lowest = (index % self.sub_buckets + self.sub_buckets) << shift
+        return lowest + ((1 << shift) - 1) / 2
+
+    def record(self, value):
+        """
+        Count a value (negative values count as 0).
+        """
+        value = max(int(value), 0)
+        index = self.index_of(value)
+        if index >= len(self.counts):
+            self.counts.extend([0] * (index + 1 - len(self.counts)))
+        self.counts[index] += 1
+        self.total += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def merge(self, other):
+        """
+        Add the counts of another histogram of the same precision.
+        """
+        if other.significant_digits != self.significant_digits:
+            raise ValueError("Cannot merge histograms of {} and {} significant digits".format(self.significant_digits, other.significant_digits))
+        if len(other.counts) > len(self.counts):
+            self.counts.extend([0] * (len(other.counts) - len(self.counts)))
+        for index, count in enumerate(other.counts):
+            self.counts[index] += count
+        self.total += other.total
+        self.sum += other.sum
+        for name, pick in (("min", min), ("max", max)):
+            values = [v for v in (getattr(self, name), getattr(other, name)) if v is not None]
+            setattr(self, name, pick(values) if values else None)
+        return self
+
+    def percentiles(self, percents):
+        """
+        Return the values at percentiles (0 to 100), within the precision of the histogram (NaN if empty).
+        """
+        if not self.total:
+            return [float("nan")] * len(percents)
+        cumulative = np.cumsum(self.counts)
+        indices = np.searchsorted(cumulative, np.ceil(np.asarray(percents, dtype=np.float64) / 100 * self.total).clip(1, self.total))
+        return [min(max(self.value_of(int(index)), self.min), self.max) for index in indices]
+
+    def to_dict(self):
+        """
+        Return the histogram as a JSON serializable dictionary (the non-zero buckets only).
+        """
+        return {
+            "significant_digits": self.significant_digits, "total": self.total, "sum": self.sum, "min": self.min, "max": self.max,
+            "buckets": [[index, count] for index, count in enumerate(self.counts) if count],
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Return the histogram of a dictionary returned by to_dict.
+        """
+        histogram = cls(data["significant_digits"])
+        for index, count in data["buckets"]:
+            if index >= len(histogram.counts):
+                histogram.counts.extend([0] * (index + 1 - len(histogram.counts)))
+            histogram.counts[index] = count
+        histogram.total, histogram.sum, histogram.min, histogram.max = data["total"], data["sum"], data["min"], data["max"]
+        return histogram
+
+
+def arrival_times(rates, step, poisson=False, seed=None):
+    """
+    Return the start offsets of the requests of an open-loop schedule.
+
+    The schedule is a piecewise constant request rate. The k-th request starts
+    when the expected number of requests reaches k (or, with poisson, the sum of
+    k exponential draws), found by inverting the cumulative rate.
+
+    Parameters:
+        rates (array): The request rate (requests per second) of each step.
+        step (float): The length of a step, in seconds.
+        poisson (bool): Whether the arrivals are a Poisson process instead of evenly spaced.
+        seed (int): The seed of the Poisson draws.
+
+    Returns:
+        numpy.ndarray: The start offsets, in seconds, in ascending order.
+    """
+    rates = np.asarray(rates, dtype=np.float64)
+    edges = np.arange(len(rates) + 1) * step
+    expected = np.concatenate([[0.0], np.cumsum(rates * step)])
+    if expected[-1] <= 0:
+        return np.empty(0)
+    if poisson:
+        draws = np.random.default_rng(seed).exponential(size=int(expected[-1] * 1.2) + 100)
+        targets = np.cumsum(draws)
+        targets = targets[targets < expected[-1]]
+    else:
+        targets = np.arange(0.0, expected[-1], 1.0)
+    # The step of each target is the last one starting at or below it, which skips the steps without requests
+    index = np.searchsorted(expected, targets, side="right") - 1
+    return edges[index] + (targets - expected[index]) / rates[index]
+
+
+def schedule_rates(args):
+    """
+    Return the rates of every step of the schedule of the command-line arguments, and the step length.
+    """
+    step = args.step_time
+    if args.schedule == "constant":
+        return [args.rate] * max(int(round(args.duration / step)), 1), step
+    if args.schedule == "ramp":
+        steps = max(int(round(args.duration / step)), 1)
+        # The rate of each step is the ramp rate at its middle
+        return list(args.rate + (args.end_rate - args.rate) * (np.arange(steps) + 0.5) / steps), step
+    if args.schedule == "step":
+        return list(args.rates), step
+    raise ValueError("Unknown schedule: {}".format(args.schedule))
+
+
+def replay_times(path, speedup=1.0, max_requests=None):
+    """
+    Return the start offsets of the requests replaying a trace written by timestampsDelaysFromTXT.py.
+
+    Parameters:
+        path (str): The trace, with a "delays" column (or end_timestamp, sorted).
+        speedup (float): The factor by which the trace is accelerated.
+        max_requests (int): The number of requests replayed, all of them if None.
+
+    Returns:
+        numpy.ndarray: The start offsets, in seconds.
+    """
+    columns = pd.read_csv(path, nrows=0).columns
+    if "delays" in columns:
+        times = np.cumsum(pd.read_csv(path, usecols=["delays"], nrows=max_requests)["delays"].to_numpy(dtype=np.float64))
+    else:
+        times = pd.read_csv(path, usecols=["end_timestamp"], nrows=max_requests)["end_timestamp"].to_numpy(dtype=np.float64)
+    return (times - times[0]) / speedup if len(times) else times
+
+
+class HttpConnection:
+    """
+    A keep-alive HTTP/1.1 client connection, on asyncio streams.
+    """
+
+    def __init__(self, host, port, timeout):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.reader = None
+        self.writer = None
+
+    async def connect(self):
+        """
+        Open the connection if needed, returning the time spent connecting, in seconds.
+        """
+        if self.writer is not None:
+            return 0.0
+        start = time.perf_counter()
+        self.reader, self.writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), self.timeout)
+        sock = self.writer.get_extra_info("socket")
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return time.perf_counter() - start
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+    async def request(self, data):
+        """
+        Send a request (the bytes of the whole message) and read its response.
+
+        Returns:
+            tuple: The status code, the reason, the body size, and the perf_counter time of the first byte of the response.
+        """
+        self.writer.write(data)
+        status_line = await asyncio.wait_for(self.reader.readline(), self.timeout)
+        first_byte = time.perf_counter()
+        if not status_line:
+            raise ConnectionResetError("Connection closed by the server")
+        parts = status_line.decode("latin-1").rstrip("\r\n").split(" ", 2)
+        status, reason = int(parts[1]), parts[2] if len(parts) > 2 else ""
+        headers = {}
+        while True:
+            line = await asyncio.wait_for(self.reader.readline(), self.timeout)
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        size = 0
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            while True:
+                chunk_size = int((await asyncio.wait_for(self.reader.readline(), self.timeout)).split(b";")[0], 16)
+                if chunk_size == 0:
+                    # The trailers end with an empty line
+                    while (await asyncio.wait_for(self.reader.readline(), self.timeout)) not in (b"\r\n", b"\n", b""):
+                        pass
+                    break
+                size += len(await asyncio.wait_for(self.reader.readexactly(chunk_size + 2), self.timeout)) - 2
+        elif "content-length" in headers:
+            size = len(await asyncio.wait_for(self.reader.readexactly(int(headers["content-length"])), self.timeout))
+        else:
+            size = len(await asyncio.wait_for(self.reader.read(), self.timeout))
+            headers["connection"] = "close"
+        if headers.get("connection", "").lower() == "close":
+            self.close()
+        return status, reason, size, first_byte
+
+
+class LoadWorker:
+    """
+    Send the requests of an open-loop schedule from one process, over a pool of keep-alive connections.
+
+    Each request is timed from its scheduled start, not from when a
+    connection became free, so the queueing in the generator and the server
+    is part of the recorded latency (no coordinated omission). The time from
+    the actual send is recorded separately as the service time.
+
+    Parameters:
+        url (str): The URL of the factorial API, e.g. http://127.0.0.1:5000/factorial.
+        connections (int): The size of the connection pool.
+        timeout (float): The timeout of a request, in seconds.
+        max_number (int): The factorial arguments are drawn in [min_number, max_number], like the JMeter __Random(0001,1555) bodies.
+        name (str): The name of the worker, written in the threadName column.
+        results (file): The CSV file of the samples, or None.
+        min_number (int): The smallest factorial argument.
+    """
+
+    def __init__(self, url, connections, timeout, max_number, name, results=None, min_number=1):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.path = (parts.path or "/") + ("?" + parts.query if parts.query else "")
+        self.url = url
+        self.timeout = timeout
+        self.max_number = max_number
+        self.min_number = min_number
+        self.name = name
+        self.writer = csv.writer(results) if results is not None else None
+        self.pool = asyncio.LifoQueue()
+        for _ in range(connections):
+            self.pool.put_nowait(HttpConnection(self.host, self.port, timeout))
+        self.connections = connections
+        self.response_time = LatencyHistogram()
+        self.service_time = LatencyHistogram()
+        self.errors = 0
+        self.late = 0
+
+    def message(self, number):
+        body = json.dumps({"number": number}).encode()
+        head = "POST {} HTTP/1.1\r\nHost: {}:{}\r\nContent-Type: application/json\r\nContent-Length: {}\r\n\r\n".format(self.path, self.host, self.port, len(body))
+        return head.encode("latin-1") + body, len(head) + len(body)
+
+    async def send(self, scheduled, wall_start):
+        """
+        Send one request scheduled at a loop time, and record it.
+        """
+        data, sent_bytes = self.message(random.randint(self.min_number, self.max_number))
+        connection = await self.pool.get()
+        sent = time.perf_counter()
+        connect = 0.0
+        try:
+            connect = await connection.connect()
+            status, reason, size, first_byte = await connection.request(data)
+            code, message, success, failure = str(status), reason, 200 <= status < 400, ""
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError) as e:
+            connection.close()
+            size, first_byte = 0, time.perf_counter()
+            code, message, success, failure = "Non HTTP response code: {}".format(type(e).__name__), str(e), False, str(e)
+        finally:
+            self.pool.put_nowait(connection)
+        done = time.perf_counter()
+        # Loop times are perf_counter times
+        elapsed = done - scheduled
+        self.response_time.record(elapsed * 1e6)
+        self.service_time.record((done - sent) * 1e6)
+        if not success:
+            self.errors += 1
+        if self.writer is not None:
+            self.writer.writerow([
+                int((wall_start + scheduled) * 1000), int(round(elapsed * 1000)), LABEL, code, message, self.name, "text",
+                "true" if success else "false", failure, size, sent_bytes, self.connections, self.connections, self.url,
+                int(round((first_byte - scheduled) * 1000)), 0, int(round(connect * 1000)),
+            ])
+
+    async def run(self, offsets, start_at):
+        """
+        Send the requests at their offsets from a wall-clock start time.
+        """
+        await asyncio.sleep(max(start_at - time.time(), 0))
+        base = time.perf_counter()
+        wall_start = time.time() - base
+        tasks = set()
+        for offset in offsets:
+            scheduled = base + offset
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            elif delay < -0.001:
+                # The generator itself is behind schedule: the lateness is recorded in the response time
+                self.late += 1
+            task = asyncio.create_task(self.send(scheduled, wall_start))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.gather(*tasks)
+        while not self.pool.empty():
+            self.pool.get_nowait().close()
+
+    async def run_closed(self, duration, start_at):
+        """
+        Keep one request in flight per connection for a duration from a wall-clock start time (closed loop, to measure the peak throughput).
+        """
+        await asyncio.sleep(max(start_at - time.time(), 0))
+        base = time.perf_counter()
+        wall_start = time.time() - base
+        end = base + duration
+
+        async def client():
+            while time.perf_counter() < end:
+                await self.send(time.perf_counter(), wall_start)
+
+        await asyncio.gather(*(client() for _ in range(self.connections)))
+        while not self.pool.empty():
+            self.pool.get_nowait().close()
+
+
+def run_worker(arguments):
+    """
+    Run a worker process on its share of the schedule (or closed loop if there is none) and return its histograms (for the process pool).
+    """
+    offsets, duration, start_at, url, connections, timeout, numbers, name, results_path = arguments
+    results = open(results_path, "w", newline="") if results_path else None
+    try:
+        worker = LoadWorker(url, connections, timeout, numbers[1], name, results, min_number=numbers[0])
+        asyncio.run(worker.run(offsets, start_at) if offsets is not None else worker.run_closed(duration, start_at))
+    finally:
+        if results is not None:
+            results.close()
+    return worker.response_time.to_dict(), worker.service_time.to_dict(), worker.errors, worker.late
+
+
+def run_load(offsets, url, processes=1, connections=64, timeout=30, max_number=1555, output_dir=None, min_number=1, duration=None):
+    """
+    Run an open-loop load, fanned out over processes (the i-th process sends every processes-th request).
+
+    Without offsets, every connection keeps one request in flight for the
+    duration instead (closed loop), which measures the peak throughput.
+
+    Parameters:
+        offsets (array): The start offsets of the requests, in seconds, or None for a closed loop.
+        url (str): The URL of the factorial API.
+        processes (int): The number of processes.
+        connections (int): The size of the connection pool of each process.
+        timeout (float): The timeout of a request, in seconds.
+        max_number (int): The largest factorial argument.
+        output_dir (str): If given, the samples are written to <output_dir>/results.csv in the JMeter CSV format and the histograms to <output_dir>/histograms.json.
+        min_number (int): The smallest factorial argument.
+        duration (float): The duration of a closed loop, in seconds.
+
+    Returns:
+        dict: The merged response time and service time histograms (in microseconds), the errors and the late sends.
+    """
+    # All the processes start on the same wall-clock time, once they are all up
+    start_at = time.time() + 1.0 + 0.1 * processes
+    parts = [os.path.join(output_dir, "results.part{}.csv".format(i)) if output_dir else None for i in range(processes)]
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    arguments = [(
+        None if offsets is None else offsets[i::processes], duration, start_at, url, connections, timeout, (min_number, max_number), "loadgen {}-1".format(i + 1), parts[i],
+    ) for i in range(processes)]
+    if processes == 1:
+        results = [run_worker(arguments[0])]
+    else:
+        with multiprocessing.Pool(processes) as pool:
+            results = pool.map(run_worker, arguments)
+
+    summary = {"response_time": LatencyHistogram(), "service_time": LatencyHistogram(), "errors": 0, "late": 0}
+    for response_time, service_time, errors, late in results:
+        summary["response_time"].merge(LatencyHistogram.from_dict(response_time))
+        summary["service_time"].merge(LatencyHistogram.from_dict(service_time))
+        summary["errors"] += errors
+        summary["late"] += late
+
+    if output_dir:
+        with open(os.path.join(output_dir, "results.csv"), "w", newline="") as results_file:
+            results_file.write(",".join(RESULTS_COLUMNS) + "\n")
+            for part in parts:
+                with open(part, newline="") as f:
+                    while True:
+                        block = f.read(1 << 20)
+                        if not block:
+                            break
+                        results_file.write(block)
+                os.remove(part)
+        with open(os.path.join(output_dir, "histograms.json"), "w") as f:
+            json.dump({name: summary[name].to_dict() for name in ("response_time", "service_time")}, f)
+    return summary
+
+
+def main():
+    """
+    Main function to load the factorial API with an open-loop schedule or a replayed trace.
+    """
+    # Define the command-line arguments
+    parser = argparse.ArgumentParser(description="Load the factorial API with an open-loop schedule or a replayed trace")
+    parser.add_argument("--url", type=str, default="http://127.0.0.1:5000/factorial", help="The URL of the factorial API")
+    parser.add_argument("--schedule", type=str, default="constant", choices=["constant", "ramp", "step", "replay"], help="The arrival schedule")
+    parser.add_argument("--rate", type=float, default=50, help="The request rate (requests per second), the start rate of a ramp")
+    parser.add_argument("--end_rate", type=float, default=200, help="The end rate of a ramp")
+    parser.add_argument("--rates", type=float, nargs="+", default=[50, 100, 200], help="The rates of the steps of a step schedule")
+    parser.add_argument("--duration", type=float, default=60, help="The duration of a constant or ramp schedule, in seconds")
+    parser.add_argument("--step_time", type=float, default=1, help="The length of a step, in seconds (the rate resolution of a ramp)")
+    parser.add_argument("--poisson", action='store_true', help="Poisson arrivals instead of evenly spaced ones")
+    parser.add_argument("--trace", type=str, help="The trace replayed by the replay schedule, written by timestampsDelaysFromTXT.py")
+    parser.add_argument("--speedup", type=float, default=1, help="The factor by which the replayed trace is accelerated")
+    parser.add_argument("--max_requests", type=int, help="The number of requests replayed, all of them if not given")
+    parser.add_argument("--processes", type=int, default=1, help="The number of sending processes")
+    parser.add_argument("--connections", type=int, default=64, help="The number of keep-alive connections of each process")
+    parser.add_argument("--timeout", type=float, default=30, help="The timeout of a request, in seconds")
+    parser.add_argument("--max_number", type=int, default=1555, help="The largest factorial argument (the bodies are random like the JMeter plans)")
+    parser.add_argument("--output_dir", type=str, help="Write the samples and the histograms to this directory, e.g. REPORT_HTML50_0")
+    parser.add_argument("--seed", type=int, help="The seed of the Poisson arrivals and of the bodies")
+    args = parser.parse_args()
+
+    if args.seed is not None:
+        random.seed(args.seed)
+    if args.schedule == "replay":
+        if not args.trace:
+            parser.error("The replay schedule needs a --trace")
+        offsets = replay_times(args.trace, args.speedup, args.max_requests)
+    else:
+        rates, step = schedule_rates(args)
+        offsets = arrival_times(rates, step, args.poisson, args.seed)
+    duration = offsets[-1] if len(offsets) else 0.0
+    print("Sending {} requests over {:.1f} s from {} processes".format(len(offsets), duration, args.processes), flush=True)
+
+    start = time.time()
+    summary = run_load(offsets, args.url, args.processes, args.connections, args.timeout, args.max_number, args.output_dir)
+    elapsed = time.time() - start
+
+    response_time, service_time = summary["response_time"], summary["service_time"]
+    print("Requests: {}, errors: {}, late sends: {}, offered rate: {:.1f} requests/s".format(response_time.total, summary["errors"], summary["late"], response_time.total / max(duration, 1e-9)))
+    percents = [50, 90, 99, 99.9, 100]
+    print("{:>14} ".format("ms") + " ".join("{:>9}".format("p{:g}".format(p)) for p in percents))
+    for name, histogram in (("response time", response_time), ("service time", service_time)):
+        print("{:>14} ".format(name) + " ".join("{:>9.2f}".format(value / 1000) for value in histogram.percentiles(percents)))
+    print("Done in {:.1f} s".format(elapsed))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,23 +1,247 @@
-import tkinter as tk
-from tkinter import filedialog
-
-root = tk.Tk()
-root.withdraw()
-
-file_path = filedialog.askopenfilename()
-
-with open(file_path, 'r') as original_file, open('modified.txt', 'w') as modified_file:
-    rows = original_file.readlines()[1:]
-    rows = [row.strip().split(',') for row in rows]
-    rows = sorted(rows, key=lambda x: float(x[2]))
-    fieldnames = ["app", "func", "end_timestamp", "duration", "delays"]
-    modified_file.write(','.join(fieldnames)+'\n') #write the new field names to modified file
-    previous_row = None
-    for row in rows:
-        if previous_row:
-            diff = float(row[2]) - float(previous_row)
-            row.append(str(diff))
-        else:
-            row.append("0")
-        previous_row = row[2]
-        modified_file.write(','.join(row)+'\n') #join the row elements by comma and write to the new file
+import argparse
+import glob
+import heapq
+import io
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+# The columns of the traces, and of the output with the delay from the previous invocation
+TRACE_COLUMNS = ["app", "func", "end_timestamp", "duration"]
+FIELDNAMES = TRACE_COLUMNS + ["delays"]
+
+# Rows written at once, and approximate memory used by a parsed row (four Python strings and a float)
+BATCH_ROWS = 200000
+ROW_BYTES = 400
+
+# Bytes read from the start of each file to estimate its number of rows
+SAMPLE_BYTES = 2 ** 20
+
+
+def expand_paths(patterns):
+    """
+    Return the files matched by paths and glob patterns, in order and without duplicates.
+    """
+    paths = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+        if not matches:
+            print("No file matches {}".format(pattern))
+        paths.extend(matches)
+    return list(dict.fromkeys(paths))
+
+
+def estimate_rows(paths):
+    """
+    Estimate the number of rows of trace files from the line lengths at their start.
+    """
+    rows = 0
+    for path in paths:
+        with open(path, "rb") as f:
+            sample = f.read(SAMPLE_BYTES)
+        rows += os.path.getsize(path) * (sample.count(b"\n") + 1) / max(len(sample), 1)
+    return int(rows)
+
+
+def read_trace(path, chunk_rows=None):
+    """
+    Read a trace file (a header line, then app,func,end_timestamp,duration rows), keeping the fields as written.
+
+    Parameters:
+        path (str): The trace file.
+        chunk_rows (int): If given, return an iterator of DataFrames of at most this many rows.
+
+    Returns:
+        DataFrame: The string columns of the trace, with the timestamps parsed in a float "timestamp" column.
+    """
+    chunks = pd.read_csv(path, header=0, names=TRACE_COLUMNS, usecols=range(len(TRACE_COLUMNS)), dtype=str, keep_default_na=False, chunksize=chunk_rows)
+    if chunk_rows is None:
+        return with_timestamps(chunks)
+    return (with_timestamps(chunk) for chunk in chunks)
+
+
+def with_timestamps(trace):
+    """
+    Add the float "timestamp" column parsed from end_timestamp, in one vectorized conversion.
+    """
+    return trace.assign(timestamp=pd.to_numeric(trace["end_timestamp"]).to_numpy(dtype=np.float64))
+
+
+def sort_trace(trace):
+    """
+    Sort a trace by timestamp with a stable argsort (rows with the same timestamp keep their order).
+    """
+    order = np.argsort(trace["timestamp"].to_numpy(), kind="stable")
+    return trace.iloc[order].reset_index(drop=True)
+
+
+def external_sort(paths, chunk_rows, directory=None):
+    """
+    Sort traces larger than the memory budget: sort chunks into temporary run files, then merge the runs.
+
+    Parameters:
+        paths (list): The trace files.
+        chunk_rows (int): The number of rows sorted in memory at once.
+        directory (str): The directory of the temporary files, the system default if None.
+
+    Yields:
+        DataFrame: The sorted rows, in batches of at most BATCH_ROWS rows.
+    """
+    with tempfile.TemporaryDirectory(dir=directory) as temp_dir:
+        runs = []
+        for path in paths:
+            for chunk in read_trace(path, chunk_rows):
+                run = os.path.join(temp_dir, "run{:06d}.csv".format(len(runs)))
+                sort_trace(chunk)[TRACE_COLUMNS].to_csv(run, header=False, index=False)
+                runs.append(run)
+        files = [open(run, newline="") for run in runs]
+        try:
+            # The timestamp of a run line is its third field; merging is stable across runs, as the chunks are in input order
+            merged = heapq.merge(*files, key=lambda line: float(line.split(",", 3)[2]))
+            batch = []
+            for line in merged:
+                batch.append(line)
+                if len(batch) == BATCH_ROWS:
+                    yield with_timestamps(pd.read_csv(io.StringIO("".join(batch)), header=None, names=TRACE_COLUMNS, dtype=str, keep_default_na=False))
+                    batch = []
+            if batch:
+                yield with_timestamps(pd.read_csv(io.StringIO("".join(batch)), header=None, names=TRACE_COLUMNS, dtype=str, keep_default_na=False))
+        finally:
+            for f in files:
+                f.close()
+
+
+class DelayHistograms:
+    """
+    Count the delays between the invocations of each app and function in logarithmic bins.
+
+    Bin 0 holds the zero delays, bin 1 the delays below min_delay, the next
+    decades * bins_per_decade bins the delays from min_delay up, and the
+    last bin the larger delays.
+
+    Parameters:
+        min_delay (float): The lower edge of the first non-zero bin, in the unit of the timestamps.
+        decades (int): The number of decades covered by the bins.
+        bins_per_decade (int): The number of bins per decade.
+    """
+
+    def __init__(self, min_delay=0.001, decades=8, bins_per_decade=10):
+        self.edges = min_delay * 10.0 ** (np.arange(decades * bins_per_decade + 1) / bins_per_decade)
+        # (app, func, bin) -> count
+        self.counts = None
+        # (app, func) -> timestamp of the last invocation seen
+        self.last = None
+
+    def add(self, batch):
+        """
+        Add the invocations of a sorted batch (following the previous batches).
+        """
+        keys = [batch["app"], batch["func"]]
+        groups = batch.groupby(keys, sort=False)["timestamp"]
+        delays = groups.diff()
+        # The first invocation of a function in the batch follows its last one of the previous batches
+        firsts = delays.isna()
+        if firsts.any() and self.last is not None:
+            previous = self.last.reindex(pd.MultiIndex.from_arrays([batch["app"][firsts], batch["func"][firsts]])).to_numpy()
+            delays[firsts] = batch["timestamp"][firsts].to_numpy() - previous
+        self.last = groups.last() if self.last is None else groups.last().combine_first(self.last)
+        kept = delays.notna()
+        values = delays[kept].to_numpy()
+        bins = np.where(values <= 0, 0, np.searchsorted(self.edges, values, side="right") + 1)
+        counts = pd.Series(bins).groupby([batch["app"][kept].to_numpy(), batch["func"][kept].to_numpy(), bins]).size()
+        self.counts = counts if self.counts is None else counts.add(self.counts, fill_value=0).astype(np.int64)
+
+    def to_frame(self):
+        """
+        Return the histograms as a table: app, func, lower and upper edges of the bin, count.
+        """
+        lower = np.concatenate([[0.0, 0.0], self.edges])
+        upper = np.concatenate([[0.0], self.edges, [np.inf]])
+        if self.counts is None:
+            return pd.DataFrame(columns=["app", "func", "delay_from", "delay_to", "count"])
+        frame = self.counts.rename("count").rename_axis(["app", "func", "bin"]).reset_index()
+        frame.insert(3, "delay_from", lower[frame["bin"]])
+        frame.insert(4, "delay_to", upper[frame["bin"]])
+        return frame.drop(columns="bin").sort_values(["app", "func", "delay_from"])
+
+
+def write_delays(batches, output, histograms=None):
+    """
+    Write sorted batches with the delay of every invocation from the previous one (0 for the first), computed with a vectorized diff.
+
+    Parameters:
+        batches (iterable): Sorted DataFrames, each following the previous one.
+        output (str): The output file.
+        histograms (DelayHistograms): If given, the per app and function delays are added to it.
+
+    Returns:
+        int: The number of rows written.
+    """
+    rows = 0
+    previous = None
+    with open(output, "w", newline="") as f:
+        f.write(",".join(FIELDNAMES) + "\n")
+        for batch in batches:
+            if not len(batch):
+                continue
+            timestamps = batch["timestamp"].to_numpy()
+            delays = np.diff(timestamps, prepend=timestamps[0] if previous is None else previous)
+            batch[TRACE_COLUMNS].assign(delays=delays).to_csv(f, header=False, index=False)
+            if histograms is not None:
+                histograms.add(batch)
+            previous = timestamps[-1]
+            rows += len(batch)
+    return rows
+
+
+def ask_path():
+    """
+    Ask for a trace file with a file dialog, for the runs without arguments on a desktop.
+    """
+    import tkinter as tk
+    from tkinter import filedialog
+
+    root = tk.Tk()
+    root.withdraw()
+    return filedialog.askopenfilename()
+
+
+def main():
+    """
+    Main function to sort traces by end timestamp and compute the delays between the invocations.
+    """
+    # Define the command-line arguments
+    parser = argparse.ArgumentParser(description="Sort traces by end timestamp and compute the delays between the invocations")
+    parser.add_argument("paths", type=str, nargs="*", help="The trace files or glob patterns (a file dialog opens if none is given); they are merged into one sorted output")
+    parser.add_argument("--output", type=str, default="modified.txt", help="The output file")
+    parser.add_argument("--histograms", type=str, help="Write the histograms of the delays between the invocations of each app and function to this CSV file")
+    parser.add_argument("--bins_per_decade", type=int, default=10, help="The number of histogram bins per decade of delay")
+    parser.add_argument("--memory_mb", type=float, default=1024, help="The memory budget: larger inputs are sorted with an external merge sort")
+    parser.add_argument("--temp_dir", type=str, help="The directory of the temporary files of the external sort")
+    args = parser.parse_args()
+
+    paths = expand_paths(args.paths) if args.paths else [ask_path()]
+    paths = [path for path in paths if path]
+    if not paths:
+        parser.error("No trace file given")
+
+    memory_bytes = args.memory_mb * 2 ** 20
+    rows = estimate_rows(paths)
+    if rows * ROW_BYTES <= memory_bytes:
+        batches = [sort_trace(pd.concat([read_trace(path) for path in paths], ignore_index=True))]
+    else:
+        print("About {} rows exceed the memory budget, sorting them with an external merge sort".format(rows))
+        batches = external_sort(paths, max(int(memory_bytes // ROW_BYTES), 1), args.temp_dir)
+
+    histograms = DelayHistograms(bins_per_decade=args.bins_per_decade) if args.histograms else None
+    rows = write_delays(batches, args.output, histograms)
+    print("Wrote {} rows to {}".format(rows, args.output))
+    if histograms is not None:
+        histograms.to_frame().to_csv(args.histograms, index=False)
+        print("Wrote the delay histograms to {}".format(args.histograms))
+
+
+if __name__ == "__main__":
+    main()
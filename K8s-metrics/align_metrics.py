@@ -0,0 +1,188 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from jmeter_ingest import load_latencies
+from metrics_store import load_metrics
+
+# The cluster columns joined to the request windows (and the per-cloud columns, when recorded)
+CLUSTER_COLUMNS = ["timestamp", "cpu_usage_avg", "memory_usage_avg", "replicas", "hpa_cpu_threshold"]
+CLOUD_PREFIXES = ("cpu_usage_avg_", "memory_usage_avg_", "pods_")
+
+
+def request_windows(requests, window):
+    """
+    Aggregate the JMeter requests over fixed time windows, with one vectorized groupby.
+
+    Parameters:
+        requests (DataFrame): The requests returned by load_latencies(all_codes=True).
+        window (float): The length of the windows, in seconds.
+
+    Returns:
+        DataFrame: One row per run and window, with its start time (seconds since the epoch), the number of requests,
+            the throughput (requests per second), the error rate and the latency mean and percentiles of the successful requests.
+    """
+    time = requests["timeStamp"].to_numpy() / 1000.0
+    keys = ["hpa_cpu_threshold", "repetition", "time"]
+    requests = pd.DataFrame({
+        "hpa_cpu_threshold": requests["hpa_cpu_threshold"].to_numpy(),
+        "repetition": requests["repetition"].to_numpy(),
+        "time": np.floor(time / window) * window,
+        "errors": ~requests["ok"].to_numpy(dtype=bool),
+        # The latencies of the failed requests are left out of the statistics
+        "Latency": requests["Latency"].where(requests["ok"]).to_numpy(dtype=np.float64),
+    })
+    groups = requests.groupby(keys, sort=True)
+    windows = groups.agg(requests=("errors", "size"), errors=("errors", "sum"), latency_mean=("Latency", "mean"))
+    percentiles = groups["Latency"].quantile([0.5, 0.95, 0.99]).unstack()
+    percentiles.columns = ["latency_p50", "latency_p95", "latency_p99"]
+    windows = windows.join(percentiles)
+    windows["throughput"] = windows["requests"] / window
+    windows["error_rate"] = windows["errors"] / windows["requests"]
+    return windows.reset_index()
+
+
+def estimate_skew(windows, cluster, max_skew, resolution=1.0, min_correlation=0.3):
+    """
+    Estimate the offset between the JMeter clock and the collector clock, by cross-correlation.
+
+    The offset is the one that best lines the throughput up with the CPU usage
+    recorded by the collector: the clock skew plus the reporting delay of the
+    metrics server. Every candidate offset is evaluated at once on a matrix.
+    A weak peak, or a peak at the edge of the search range (within a collector
+    period of max_skew: the true offset may be beyond it), is no evidence of an offset: 0 is returned then, with
+    a warning.
+
+    Parameters:
+        windows (DataFrame): The windows returned by request_windows.
+        cluster (DataFrame): The cluster samples, with timestamp and cpu_usage_avg columns.
+        max_skew (float): The largest offset tried, in seconds, in both directions.
+        resolution (float): The step between the offsets tried, in seconds.
+        min_correlation (float): The lowest peak correlation accepted.
+
+    Returns:
+        float: The offset to add to the JMeter times to get collector times, or 0 if it cannot be estimated.
+    """
+    load = windows.groupby("time")["throughput"].sum()
+    cluster = cluster.dropna(subset=["cpu_usage_avg"]).sort_values("timestamp")
+    if len(load) < 2 or len(cluster) < 2:
+        return 0.0
+    offsets = np.arange(-max_skew, max_skew + resolution / 2, resolution)
+    # The load around each collector sample, for every offset (one row per offset); no load outside of the JMeter runs
+    times = cluster["timestamp"].to_numpy()[None, :] - offsets[:, None]
+    throughput = np.interp(times.ravel(), load.index.to_numpy(), load.to_numpy(), left=0.0, right=0.0).reshape(times.shape)
+    cpu = cluster["cpu_usage_avg"].to_numpy()
+    # Pearson correlation of every row with the CPU usage
+    throughput = throughput - throughput.mean(axis=1, keepdims=True)
+    cpu = cpu - cpu.mean()
+    norms = np.sqrt((throughput ** 2).sum(axis=1) * (cpu ** 2).sum())
+    with np.errstate(invalid="ignore", divide="ignore"):
+        correlation = np.where(norms > 0, throughput @ cpu / norms, -np.inf)
+    if not np.isfinite(correlation).any():
+        return 0.0
+    best = np.argmax(correlation)
+    if correlation[best] < min_correlation:
+        print("Could not estimate the clock offset: the best correlation is {:.2f} (at {:+.1f} s), below {:.2f}; using 0 s".format(
+            correlation[best], offsets[best], min_correlation))
+        return 0.0
+    # Within a collector period of the bound, the peak cannot be told apart from one beyond it
+    period = np.median(np.diff(cluster["timestamp"].to_numpy()))
+    if abs(offsets[best]) >= max_skew - max(period, resolution):
+        print("Could not estimate the clock offset: the best correlation is at the edge of the search range ({:+.1f} s); using 0 s, "
+              "set --skew or a larger --max_skew".format(offsets[best]))
+        return 0.0
+    return float(offsets[best])
+
+
+def align(windows, cluster, skew, tolerance):
+    """
+    Join every request window with the nearest cluster sample, with a sort-merge as-of join.
+
+    Parameters:
+        windows (DataFrame): The windows returned by request_windows.
+        cluster (DataFrame): The cluster samples, with a timestamp column.
+        skew (float): The offset to add to the JMeter times to get collector times, in seconds.
+        tolerance (float): The largest distance to the joined sample, in seconds; farther windows get no cluster values.
+
+    Returns:
+        DataFrame: The windows, with their collector time and the columns of the joined cluster samples.
+    """
+    windows = windows.assign(collector_time=windows["time"] + skew).sort_values("collector_time")
+    cluster = cluster.rename(columns={"hpa_cpu_threshold": "cluster_hpa_cpu_threshold"}).sort_values("timestamp")
+    aligned = pd.merge_asof(windows, cluster, left_on="collector_time", right_on="timestamp", direction="nearest", tolerance=tolerance)
+    return aligned.sort_values(["hpa_cpu_threshold", "repetition", "time"]).reset_index(drop=True)
+
+
+def compact(aligned):
+    """
+    Downcast the aligned dataset to compact types (float32 and the smallest integers).
+    """
+    for name, column in aligned.items():
+        if name in ("time", "collector_time", "timestamp"):
+            continue
+        if pd.api.types.is_float_dtype(column):
+            aligned[name] = column.astype(np.float32)
+        elif pd.api.types.is_integer_dtype(column):
+            aligned[name] = pd.to_numeric(column, downcast="integer")
+    return aligned
+
+
+def main():
+    """
+    Main function to join the JMeter requests with the cluster metrics on time.
+    """
+    # Define the command-line arguments
+    parser = argparse.ArgumentParser(description="Join the JMeter requests with the cluster metrics on time")
+    parser.add_argument("--filename", type=str, default="deployment_metrics.csv", help="The cluster metrics file recorded by k8s_stats.py")
+    parser.add_argument("--store", type=str, help="Load the cluster metrics from this metrics store directory instead of the CSV file")
+    parser.add_argument("--run", type=str, nargs="+", help="The runs to load from the metrics store, all of them if not given")
+    parser.add_argument("--deployment", type=str, help="The deployment to join, as name or namespace/name, when the metrics hold several")
+    parser.add_argument("--jmeter_directory", type=str, default=os.path.join("..", "JmeterLoadTest"), help="The directory of the JMeter reports")
+    parser.add_argument("--workers", type=int, help="The number of processes loading the JMeter reports, the number of CPUs if not given")
+    parser.add_argument("--window", type=float, default=5, help="The length of the request windows, in seconds")
+    parser.add_argument("--skew", type=float, help="The offset to add to the JMeter times to get collector times, in seconds, estimated if not given")
+    parser.add_argument("--max_skew", type=float, default=120, help="The largest offset tried by the estimation, in seconds")
+    parser.add_argument("--min_correlation", type=float, default=0.3, help="The lowest correlation between the throughput and the CPU usage accepted by the estimation, 0 s is used below it")
+    parser.add_argument("--tolerance", type=float, default=30, help="The largest distance between a window and its cluster sample, in seconds")
+    parser.add_argument("--output", type=str, default="aligned_metrics.parquet", help="The output file, Parquet or CSV (by extension)")
+    args = parser.parse_args()
+
+    if args.store:
+        filters = [("run", "in", args.run)] if args.run else None
+        cluster = load_metrics(args.store, "deployment_metrics", filters=filters)
+    else:
+        cluster = pd.read_csv(args.filename)
+    if args.deployment:
+        namespace, _, name = args.deployment.rpartition("/")
+        cluster = cluster[cluster["deployment"] == name]
+        if namespace:
+            cluster = cluster[cluster["namespace"] == namespace]
+    elif "deployment" in cluster.columns and cluster[["namespace", "deployment"]].drop_duplicates().shape[0] > 1:
+        parser.error("The metrics hold several deployments, choose one with --deployment")
+    cluster = cluster[[name for name in cluster.columns if name in CLUSTER_COLUMNS or name.startswith(CLOUD_PREFIXES)]]
+
+    thresholds = sorted(cluster["hpa_cpu_threshold"].dropna().unique().astype(int))
+    requests = load_latencies(args.jmeter_directory, thresholds or None, args.workers, all_codes=True)
+    windows = request_windows(requests, args.window)
+    print("{} requests in {} windows of {} s".format(len(requests), len(windows), args.window))
+
+    skew = args.skew
+    if skew is None:
+        skew = estimate_skew(windows, cluster, args.max_skew, min_correlation=args.min_correlation)
+        print("Estimated offset of the collector clock: {:+.1f} s".format(skew))
+    aligned = compact(align(windows, cluster, skew, args.tolerance))
+    unmatched = aligned["timestamp"].isna().sum()
+    if unmatched:
+        print("{} windows have no cluster sample within {} s".format(unmatched, args.tolerance))
+
+    if args.output.endswith(".csv"):
+        aligned.to_csv(args.output, index=False)
+    else:
+        aligned.to_parquet(args.output, index=False, compression="zstd")
+    print("Wrote {} rows to {}".format(len(aligned), args.output))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+import argparse
+import glob
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from mock_k8s_server import MockCluster, MockServer, start_churn, write_kubeconfig
+
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+
+# Collector -> script and extra arguments
+COLLECTORS = {
+    "stats": ("k8s_stats.py", []),
+    "stats_no_watch": ("k8s_stats.py", ["--no_watch"]),
+    "beta": ("k8s_pod_stats-beta.py", []),
+}
+
+
+def process_cpu(pid):
+    """
+    Return the CPU time (user and system) used so far by a process, in seconds, or None if it is gone.
+    """
+    try:
+        with open("/proc/{}/stat".format(pid)) as f:
+            fields = f.read().rpartition(")")[2].split()
+    except OSError:
+        return None
+    return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+
+
+def collector_command(collector, kubeconfig, deployment, sleep_time, observation_time):
+    """
+    Return the command line of a collector writing its CSV files in the current directory.
+    """
+    script, extra = COLLECTORS[collector]
+    command = [sys.executable, os.path.join(DIRECTORY, script), "--kubeconfig", kubeconfig, "--deployment_name", deployment,
+               "--sleep_time", str(sleep_time), "--observation_time", str(observation_time)] + extra
+    if script == "k8s_stats.py":
+        command += ["--filename", "deployment_metrics.csv", "--pod_filename", "pod_metrics.csv"]
+    return command
+
+
+def run_collector(command, directory):
+    """
+    Run a collector to its end, measuring its CPU time after the first sample (the imports and the watch setup excluded) and its peak memory.
+
+    Returns:
+        dict: The total and steady CPU times (seconds), the peak RSS (MiB) and the exit code.
+    """
+    process = subprocess.Popen(command, cwd=directory, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    started = {}
+
+    def read_output():
+        # The collectors print a line per sample: the CPU time at the first one is the setup cost
+        for line in process.stdout:
+            if "cpu" not in started and line.startswith("Wrote metrics"):
+                started["cpu"] = process_cpu(process.pid)
+                started["time"] = time.time()
+
+    reader = threading.Thread(target=read_output, daemon=True)
+    reader.start()
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    reader.join()
+    cpu = usage.ru_utime + usage.ru_stime
+    return {
+        "exit_code": process.returncode, "cpu_seconds": cpu, "steady_cpu_seconds": cpu - (started.get("cpu") or 0),
+        "first_sample": started.get("time"), "peak_rss_mib": usage.ru_maxrss / 1024,
+    }
+
+
+def sample_counts(collector, directory):
+    """
+    Return the timestamp of every sample of a collector run and the number of pods it recorded.
+    """
+    if COLLECTORS[collector][0] == "k8s_stats.py":
+        samples = pd.read_csv(os.path.join(directory, "deployment_metrics.csv"))["timestamp"]
+        pods = pd.read_csv(os.path.join(directory, "pod_metrics.csv"), usecols=["timestamp"])["timestamp"].value_counts()
+    else:
+        files = glob.glob(os.path.join(directory, "*_metrics.csv"))
+        rows = pd.concat([pd.read_csv(path, usecols=["timestamp"]) for path in files], ignore_index=True) if files else pd.DataFrame({"timestamp": []})
+        pods = rows["timestamp"].value_counts()
+        samples = pd.Series(np.sort(pods.index.to_numpy()))
+    return samples.to_numpy(dtype=np.float64), pods.reindex(samples.to_numpy(), fill_value=0).to_numpy()
+
+
+def bench_level(cluster, server, kubeconfig, collector, deployment, replicas, sleep_time, observation_time):
+    """
+    Scale the mock deployment and run a collector against it.
+
+    Returns:
+        dict: The sample jitter, the API calls per sample, the CPU and memory overhead and the data completeness of the run.
+    """
+    cluster.scale(deployment, replicas)
+    with tempfile.TemporaryDirectory(prefix="collector_bench") as directory:
+        calls_before = server.snapshot()
+        run = run_collector(collector_command(collector, kubeconfig, deployment, sleep_time, observation_time), directory)
+        calls = server.snapshot() - calls_before
+        timestamps, pods = sample_counts(collector, directory)
+
+    samples = len(timestamps)
+    expected = int(observation_time // sleep_time)
+    # The deviation of every period from the sleep time
+    jitter = np.abs(np.diff(timestamps) - sleep_time) * 1000
+    result = {
+        "collector": collector, "replicas": replicas, "samples": samples, "missed_samples": expected - samples,
+        "jitter_mean_ms": float(jitter.mean()) if len(jitter) else None, "jitter_p99_ms": float(np.percentile(jitter, 99)) if len(jitter) else None,
+        "jitter_max_ms": float(jitter.max()) if len(jitter) else None,
+        "api_calls_per_sample": sum(calls.values()) / samples if samples else None,
+        "cpu_ms_per_sample": run["steady_cpu_seconds"] * 1000 / max(samples - 1, 1),
+        "setup_cpu_seconds": run["cpu_seconds"] - run["steady_cpu_seconds"], "peak_rss_mib": run["peak_rss_mib"],
+        "completeness": float(np.minimum(pods / replicas, 1).mean()) if samples else 0.0, "exit_code": run["exit_code"],
+    }
+    result.update({"calls_" + name: count for name, count in sorted(calls.items())})
+    return result
+
+
+def main():
+    """
+    Main function to measure how the collectors scale with the number of pods, against a mock API server.
+    """
+    # Define the command-line arguments
+    parser = argparse.ArgumentParser(description="Measure how the collectors scale with the number of pods, against a mock API server")
+    parser.add_argument("--collectors", type=str, nargs="+", default=list(COLLECTORS), choices=list(COLLECTORS), help="The collectors to run")
+    parser.add_argument("--replicas", type=int, nargs="+", default=[5, 50, 200, 500], help="The replicas of the deployment, one run per value and collector")
+    parser.add_argument("--sleep_time", type=float, default=1, help="The sleep time of the collectors, in seconds")
+    parser.add_argument("--observation_time", type=int, default=30, help="The observation time of a run, in seconds")
+    parser.add_argument("--latency", type=float, default=0, help="The latency of every API response, in seconds")
+    parser.add_argument("--item_latency", type=float, default=0, help="The additional latency per object of an API response, in seconds")
+    parser.add_argument("--churn", type=float, default=0, help="Replace a random pod every this many seconds, 0 for no churn")
+    parser.add_argument("--metrics_delay", type=float, default=0, help="The time before the metrics of a new pod are served, in seconds")
+    parser.add_argument("--pods_per_node", type=int, default=110, help="The number of pods per mock node")
+    parser.add_argument("--output", type=str, default="collector_bench.json", help="The output file")
+    args = parser.parse_args()
+
+    deployment = "factorial-api"
+    cluster = MockCluster("default", [deployment], args.replicas[0], pods_per_node=args.pods_per_node, metrics_delay=args.metrics_delay)
+    server = MockServer(("127.0.0.1", 0), cluster, args.latency, args.item_latency)
+    threading.Thread(target=server.serve_forever, name="mock-server", daemon=True).start()
+    if args.churn:
+        start_churn(cluster, args.churn)
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix="collector_bench") as config_directory:
+        # The collectors read the kubeconfig like against a real cluster
+        kubeconfig = os.path.join(config_directory, "kube_config.yaml")
+        write_kubeconfig(kubeconfig, *server.server_address)
+        columns = ["collector", "replicas", "samples", "missed_samples", "jitter_mean_ms", "jitter_p99_ms", "api_calls_per_sample", "cpu_ms_per_sample", "peak_rss_mib", "completeness"]
+        for collector in args.collectors:
+            for replicas in args.replicas:
+                result = bench_level(cluster, server, kubeconfig, collector, deployment, replicas, args.sleep_time, args.observation_time)
+                results.append(result)
+                print("{} with {} replicas: {} samples, {:.1f} API calls and {:.1f} CPU ms per sample, {:.0%} complete".format(
+                    collector, replicas, result["samples"], result["api_calls_per_sample"] or 0, result["cpu_ms_per_sample"], result["completeness"]), flush=True)
+    server.shutdown()
+    print(pd.DataFrame(results, columns=columns).to_string(index=False))
+
+    with open(args.output, "w") as f:
+        json.dump({"arguments": vars(args), "results": results}, f, indent=1)
+    print("Wrote {} results to {}".format(len(results), args.output))
+
+
+if __name__ == "__main__":
+    main()
@@ -3,86 +3,218 @@ import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 import os
-
-def get_stats(data):
-    """
-    Calculate the median, mean, max, and min of the CPU and memory usage.
+import time
+from matplotlib.animation import FuncAnimation
+
+from jmeter_ingest import LABEL, RESPONSE_CODE, load_latencies
+from latency_sketch import sketch_latencies, sketch_summary
+from live_metrics import LATENCY_PERCENTILES, LiveMetrics
+from metrics_store import load_metrics
+from scaling_analyzer import CPU_REQUEST, analyze
+
+# Summary column -> quantile
+QUANTILES = {"q1": 0.25, "median": 0.5, "q3": 0.75, "p90": 0.90, "p95": 0.95, "p99": 0.99}
+
+# Episode column -> title and y label of the scale-out reaction plots
+SCALING_PLOTS = {
+    "time_to_scale": ("Time to scale (threshold crossed -> replicas increased)", "Seconds"),
+    "time_to_ready": ("Time to ready capacity (threshold crossed -> all the replicas with metrics)", "Seconds"),
+    "time_to_burst": ("Time to burst (threshold crossed -> new pods on burst nodes)", "Seconds"),
+    "overshoot": ("Replicas overshoot (peak - replicas under load)", "Replicas"),
+    "oscillations": ("Oscillations (scale-ups after a scale-down)", "Reversals"),
+}
+
+# Metric -> title, y label, value format, and the vertical offsets of the max, median, mean and min labels (in font sizes)
+PLOTS = {
+    "cpu_usage_avg": ("CPU Usage", "CPU Usage (average in mCores)", "{:.2f}", (0.10, -0.75, 0.75, -0.60)),
+    "memory_usage_avg": ("Memory Usage", "Memory Usage (average in MiB)", "{:.2f}", (0.004, 0.028, -0.048, -0.024)),
+    "Latency": ("HTTP Request API Latency", "Latency (ms)", "{:.0f} ms", (0.34, -0.94, 0.99, -0.99)),
+    "replicas": ("Replicas", "Number of replicas", "{:.0f}", (0.012, -0.012, 0.030, -0.011)),
+}
+
+def summarize(data, metrics, by="hpa_cpu_threshold"):
     """
-    cpu_median = data["cpu_usage_avg"].median()
-    cpu_mean = data["cpu_usage_avg"].mean()
-    cpu_max = data["cpu_usage_avg"].max()
-    cpu_min = data["cpu_usage_avg"].min()
+    Compute the statistics of several metrics for every group, in one pass.
 
-    mem_median = data["memory_usage_avg"].median()
-    mem_mean = data["memory_usage_avg"].mean()
-    mem_max = data["memory_usage_avg"].max()
-    mem_min = data["memory_usage_avg"].min()
+    The values outside [Q1 - 1.5 IQR, Q3 + 1.5 IQR] of their metric and group
+    are counted as outliers and left out of the statistics.
 
-    return [cpu_median, cpu_mean, cpu_max, cpu_min, mem_median, mem_mean, mem_max, mem_min]
+    Parameters:
+        data (DataFrame): The samples, with one column per metric and the group column.
+        metrics (list): The metric columns.
+        by (str): The group column.
 
-def get_replicas_stats(data):
+    Returns:
+        DataFrame: One row per metric and group, with the count, mean, min, max, q1, median, q3, p90, p95, p99, iqr and outliers columns.
     """
-    Calculate the median, mean, max, and min of the replicas.
+    # One row per (group, metric, value), so that a single groupby covers every metric
+    values = data.melt(id_vars=[by], value_vars=metrics, var_name="metric").dropna(subset=["value"])
+    values["value"] = values["value"].astype(np.float64)
+    keys = [values["metric"], values[by]]
+    groups = values.groupby(keys)["value"]
+    q1 = groups.transform("quantile", 0.25)
+    q3 = groups.transform("quantile", 0.75)
+    iqr = q3 - q1
+    inliers = values["value"].between(q1 - 1.5 * iqr, q3 + 1.5 * iqr)
+    kept = values[inliers].groupby(["metric", by])["value"]
+    summary = kept.agg(["count", "mean", "min", "max"])
+    quantiles = kept.quantile(list(QUANTILES.values())).unstack().reindex(columns=list(QUANTILES.values()))
+    quantiles.columns = list(QUANTILES)
+    summary = summary.join(quantiles)
+    summary["iqr"] = summary["q3"] - summary["q1"]
+    summary["outliers"] = (~inliers).groupby(keys).sum()
+    return summary.reset_index()
+
+def get_latency_data(hpa_cpu_thresholds, directory=os.path.join("..", "JmeterLoadTest"), workers=None):
     """
-    replicas_median = data["replicas"].median()
-    replicas_mean = data["replicas"].mean()
-    replicas_max = data["replicas"].max()
-    replicas_min = data["replicas"].min()
-
-    return [replicas_median, replicas_mean, replicas_max, replicas_min]
+    Returns the latencies of the JMeter test results CSV files of the HPA thresholds, with their hpa_cpu_threshold.
+    Every REPORT_HTML{hpa_cpu_threshold}_{i} directory of the JMeter directory is loaded (see jmeter_ingest.py).
+    """
+    # The outliers are removed by summarize, like for the other metrics
+    return load_latencies(directory, hpa_cpu_thresholds, workers)[["Latency", "hpa_cpu_threshold"]]
 
-def get_latency_stats(data):
+def summarize_latency_sketches(hpa_cpu_thresholds, directory=os.path.join("..", "JmeterLoadTest"), workers=None, accuracy=0.01):
     """
-    Calculate the median, mean, max, and min of the latency.
+    Returns the summary rows of the latencies, like summarize, computed from quantile sketches of the JMeter test results.
+    The results files are read in chunks, so the memory used does not grow with the number of requests.
     """
-    latency_median = data["Latency"].median()
-    latency_mean = data["Latency"].mean()
-    latency_max = data["Latency"].max()
-    latency_min = data["Latency"].min()
+    sketches = sketch_latencies(directory, hpa_cpu_thresholds, workers, accuracy)
+    rows = [dict(metric="Latency", hpa_cpu_threshold=threshold, **sketch_summary(sketch, QUANTILES)) for (threshold, label, code), sketch in sorted(sketches.items()) if label == LABEL and code == RESPONSE_CODE]
+    return pd.DataFrame(rows, columns=["metric", "hpa_cpu_threshold", "count", "mean", "min", "max"] + list(QUANTILES) + ["iqr", "outliers"])
 
-    return [latency_median, latency_mean, latency_max, latency_min]
-
-def get_latency_data(hpa_cpu_threshold):
+def draw_metric(ax, summary, metric, thresholds, fontsize):
     """
-    Returns a list of latency values from the JMeter test results CSV file.
-    This code will loop through all the folders with names starting with REPORT_HTML{hpa_cpu_threshold} and ending with a number from 0 to 9 (i.e., REPORT_HTML50_0, REPORT_HTML50_9
+    Draw the boxplots of a metric for every HPA threshold from its summary rows.
+
+    Parameters:
+        ax (Axes): The axes to draw on.
+        summary (DataFrame): The table returned by summarize.
+        metric (str): The metric, a key of PLOTS.
+        thresholds (array): The HPA thresholds, in drawing order.
+        fontsize (int): The font size of the labels.
     """
-    data_list = []
-    for i in range(10):
-        # Create the file name
-        filename = os.path.join("..", "JmeterLoadTest", "REPORT_HTML{}_{}".format(hpa_cpu_threshold, i), "results.csv")
-        
-        try:
-            # Load the data from the CSV file
-            data = pd.read_csv(filename)
-            
-            # Filter the data to include only the "HTTP Request API" rows
-            filtered_data = data[(data["label"] == "HTTP Request API") & (data["responseCode"] == "200")]           
-            data_list.append(filtered_data)
-        except:
-            continue
-        
-    if data_list:
-        data = pd.concat(data_list)
-        
-        # Calculate the IQR of the latency data
-        q1 = data["Latency"].quantile(0.25)
-        q3 = data["Latency"].quantile(0.75)
-        iqr = q3 - q1
-        
-        # Remove any data points that fall outside of the lower and upper bounds
-        lower_bound = q1 - 1.5*iqr
-        upper_bound = q3 + 1.5*iqr
-        data = data[(data["Latency"] >= lower_bound) & (data["Latency"] <= upper_bound)]
-    else:
-        data = pd.DataFrame(columns=["Latency"])
-    
-    # Return the latency data
-    return data
+    title, ylabel, value_format, offsets = PLOTS[metric]
+    rows = summary[summary["metric"] == metric].set_index("hpa_cpu_threshold").reindex(thresholds)
+    positions = [i for i, count in enumerate(rows["count"]) if count > 0]
+    # Boxes from the precomputed statistics; the whiskers end at the extreme values left after the outliers removal
+    stats = [{"med": row.median, "q1": row.q1, "q3": row.q3, "whislo": row.min, "whishi": row.max, "label": ""} for row in rows.iloc[positions].itertuples()]
+    if stats:
+        ax.bxp(stats, positions=positions, widths=0.5, showfliers=False)
+    for i in positions:
+        row = rows.iloc[i]
+        ax.text(i+0.036*fontsize, row["max"]+offsets[0]*fontsize, "max: " + value_format.format(row["max"]), horizontalalignment='center', color='red', fontsize=fontsize)
+        ax.text(i+0.04*fontsize, row["median"]+offsets[1]*fontsize, "median: " + value_format.format(row["median"]), horizontalalignment='center', color='green', fontsize=fontsize)
+        ax.text(i+0.036*fontsize, row["mean"]+offsets[2]*fontsize, "mean: " + value_format.format(row["mean"]), horizontalalignment='center', color='orange', fontsize=fontsize)
+        ax.text(i+0.036*fontsize, row["min"]+offsets[3]*fontsize, "min: " + value_format.format(row["min"]), horizontalalignment='center', color='blue', fontsize=fontsize)
+
+    # Add the line connecting the mean values
+    ax.plot(positions, rows["mean"].iloc[positions], marker='o', color='orange')
 
+    # Set the x-axis labels
+    ax.set_xticks(range(len(thresholds)))
+    ax.set_xticklabels(["hpa_tresh: {}".format(int(x)) for x in thresholds])
 
+    # Set the title and labels of the boxplot
+    ax.set_title(title)
+    ax.set_ylabel(ylabel)
 
+def draw_scaling(episodes, thresholds, filename):
+    """
+    Draw the scale-out reaction of every HPA threshold: one plot per episode measure, one box per threshold.
 
+    Parameters:
+        episodes (DataFrame): The episodes returned by scaling_analyzer.analyze.
+        thresholds (array): The HPA thresholds, in drawing order.
+        filename (str): The output SVG file.
+    """
+    fig, ax = plt.subplots(len(SCALING_PLOTS), 1, figsize=(12, 3 * len(SCALING_PLOTS)))
+    for column_ax, (column, (title, ylabel)) in zip(ax, SCALING_PLOTS.items()):
+        values = [episodes.loc[episodes["hpa_cpu_threshold"] == threshold, column].dropna().to_numpy(dtype=float) for threshold in thresholds]
+        positions = [i for i, threshold_values in enumerate(values) if len(threshold_values)]
+        if positions:
+            column_ax.boxplot([values[i] for i in positions], positions=positions, widths=0.5)
+        # Show every episode, there are few of them
+        for i in positions:
+            column_ax.scatter(np.full(len(values[i]), i), values[i], color='orange', s=10, zorder=3)
+        column_ax.set_xticks(range(len(thresholds)))
+        column_ax.set_xticklabels(["hpa_tresh: {} ({} episodes)".format(int(x), len(v)) for x, v in zip(thresholds, values)])
+        column_ax.set_title(title)
+        column_ax.set_ylabel(ylabel)
+    fig.tight_layout()
+    fig.savefig(filename)
+
+def draw_live(live, cpu_request, fps, output=None):
+    """
+    Draw the CPU, memory, replicas and latency percentiles of a run over time while it goes on, refreshed at a fixed frame rate.
+
+    The statistics are updated with the new rows only (see LiveMetrics), and
+    every frame redraws the bounded time series, so a frame costs the same
+    after hours of run.
+
+    Parameters:
+        live (LiveMetrics): The followed files.
+        cpu_request (float): The CPU request of the pods, in millicores, to draw the CPU usage targeted by the HPA.
+        fps (float): The frames per second.
+        output (str): If given, every frame is also saved to this file, and no window is opened (for headless runs).
+    """
+    fig, ax = plt.subplots(4, 1, figsize=(12, 12), sharex=True)
+    axes = {"cpu_usage_avg": ax[0], "memory_usage_avg": ax[1], "replicas": ax[2], "Latency": ax[3]}
+    ax[-1].set_xlabel("Time (minutes)")
+    for metric, metric_ax in axes.items():
+        metric_ax.set_title(PLOTS[metric][0])
+        metric_ax.set_ylabel(PLOTS[metric][1])
+    lines = {}
+
+    def line(metric_ax, name, **kwargs):
+        # The lines are added as their series appear (e.g. the pods of every cloud)
+        if name not in lines:
+            lines[name], = metric_ax.plot([], [], label=name, **kwargs)
+            metric_ax.legend(loc="upper left", fontsize=7)
+        return lines[name]
+
+    def frame(_=None):
+        if not live.update():
+            return list(lines.values())
+        for metric, points in live.series.items():
+            if points:
+                times, values = zip(*points)
+                line(axes["replicas" if metric.startswith("pods_") else metric], metric).set_data(np.array(times) / 60, values)
+                stats = live.stats.get((metric, live.threshold))
+                if metric in PLOTS and stats is not None:
+                    value_format = PLOTS[metric][2]
+                    axes[metric].set_title("{} (hpa_tresh: {}, mean: {}, min: {}, max: {})".format(
+                        PLOTS[metric][0], "-" if live.threshold is None else "{:g}".format(live.threshold), value_format.format(stats.mean), value_format.format(stats.min), value_format.format(stats.max)))
+        if live.thresholds and live.series["cpu_usage_avg"]:
+            # The usage the HPA targets, a step per change of threshold
+            times, thresholds = zip(*live.thresholds)
+            targets = [np.nan if threshold is None else threshold * cpu_request / 100 for threshold in thresholds]
+            line(axes["cpu_usage_avg"], "HPA target", linestyle="--", color="red", drawstyle="steps-post").set_data(
+                np.array(times + (live.series["cpu_usage_avg"][-1][0],)) / 60, targets + targets[-1:])
+        if live.latency_series:
+            data = np.array(live.latency_series)
+            for i, name in enumerate(LATENCY_PERCENTILES, 1):
+                line(axes["Latency"], name).set_data(data[:, 0] / 60, data[:, i])
+            # The latencies are summarized per threshold once the collector has written one
+            latency_stats = live.latency_stats().get(live.threshold)
+            if live.threshold is not None and latency_stats is not None:
+                requests, p50, p95, p99, errors = latency_stats
+                axes["Latency"].set_title("{} (hpa_tresh: {:g}, {} requests, p50: {:.0f} ms, p99: {:.0f} ms, {} errors)".format(PLOTS["Latency"][0], live.threshold, requests, p50, p99, errors))
+        for metric_ax in ax:
+            metric_ax.relim()
+            metric_ax.autoscale_view()
+        return list(lines.values())
+
+    fig.tight_layout()
+    if output:
+        while True:
+            began = time.monotonic()
+            frame()
+            fig.savefig(output)
+            time.sleep(max(1 / fps - (time.monotonic() - began), 0))
+    # Keep a reference to the animation, or it is garbage collected
+    animation = FuncAnimation(fig, frame, interval=1000 / fps, cache_frame_data=False)
+    plt.show()
+    return animation
 
 def main():
     """
@@ -93,174 +225,83 @@ def main():
     parser.add_argument("--filename", type=str, default="deployment_metrics.csv", help="The input file name")
     parser.add_argument("--latency", action='store_true', help="Draw boxplots of the HTTP Request API latencies")
     parser.add_argument("--replicas", action='store_true', help="Draw boxplots of the HTTP Request API replicas")
+    parser.add_argument("--deployment", type=str, help="The deployment to draw, as name or namespace/name, when the file holds several")
+    parser.add_argument("--store", type=str, help="Load the metrics from this metrics store directory instead of the CSV file")
+    parser.add_argument("--run", type=str, nargs="+", help="The runs to load from the metrics store (or from a CSV file with a run column, like the output of hpa_simulator.py), all of them if not given")
+    parser.add_argument("--jmeter_directory", type=str, default=os.path.join("..", "JmeterLoadTest"), help="The directory of the JMeter reports")
+    parser.add_argument("--workers", type=int, help="The number of processes loading the JMeter reports, the number of CPUs if not given")
+    parser.add_argument("--streaming", action='store_true', help="Compute the latency statistics from quantile sketches of the JMeter reports, in bounded memory")
+    parser.add_argument("--accuracy", type=float, default=0.01, help="The relative accuracy of the latency statistics computed with --streaming or --live")
+    parser.add_argument("--scaling", action='store_true', help="Also draw the scale-out reaction times of every threshold in scaling_reaction.svg")
+    parser.add_argument("--cpu_request", type=float, default=CPU_REQUEST, help="The CPU request of the pods, in millicores, for --scaling and --live")
+    parser.add_argument("--summary", type=str, default="deployment_metrics_summary.csv", help="The output file of the summary statistics")
+    parser.add_argument("--live", action='store_true', help="Follow the file while k8s_stats.py writes it and draw the metrics over time")
+    parser.add_argument("--live_results", type=str, help="Also follow this JMeter results.csv file in --live mode, for the latency percentiles")
+    parser.add_argument("--fps", type=float, default=1, help="The frames per second of --live")
+    parser.add_argument("--window", type=int, default=2000, help="The number of points kept per time series in --live mode")
+    parser.add_argument("--bucket", type=float, default=10, help="The time bucket of the latency percentiles in --live mode, in seconds")
+    parser.add_argument("--live_output", type=str, help="Save every frame of --live to this file instead of opening a window")
     args = parser.parse_args()
 
-    # Load the data from the CSV file
-    data = pd.read_csv(args.filename)
+    if args.live:
+        if args.store:
+            parser.error("--live follows a CSV file, not a metrics store")
+        live = LiveMetrics(args.filename, args.live_results, args.deployment, args.window, args.bucket, args.accuracy)
+        try:
+            draw_live(live, args.cpu_request, args.fps, args.live_output)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            live.close()
+        return
+
+    if args.store:
+        # Read only the drawn columns, and only the partitions of the chosen runs and deployment
+        filters = []
+        if args.run:
+            filters.append(("run", "in", args.run))
+        if args.deployment:
+            filters.append(("deployment", "==", args.deployment.rpartition("/")[2]))
+        # The scale-out analysis also needs the timestamps and the per-cloud pods
+        columns = None if args.scaling else ["namespace", "deployment", "cpu_usage_avg", "memory_usage_avg", "hpa_cpu_threshold", "replicas"]
+        data = load_metrics(args.store, "deployment_metrics", columns=columns, filters=filters or None)
+    else:
+        # Load the data from the CSV file
+        data = pd.read_csv(args.filename)
+        if args.run and "run" in data.columns:
+            data = data[data["run"].isin(args.run)]
+
+    # Keep the rows of one deployment if the file was recorded for several of them
+    if "deployment" in data.columns:
+        deployments = sorted((data["namespace"] + "/" + data["deployment"]).unique())
+        if args.deployment:
+            namespace, _, name = args.deployment.rpartition("/")
+            data = data[data["deployment"] == name]
+            if namespace:
+                data = data[data["namespace"] == namespace]
+        elif len(deployments) > 1:
+            parser.error("The file holds several deployments, choose one with --deployment: {}".format(", ".join(deployments)))
 
     # Get the unique values of the hpa_cpu_threshold and sort it in ascending order
     unique_thresholds = np.sort(data["hpa_cpu_threshold"].unique())
 
     fontsize=7
 
-    # Draw the boxplots of the CPU usage
-    fig, ax = plt.subplots(2 + args.latency + args.replicas, 1, figsize=(12, 12))
-    cpu_thresholds = []
-    cpu_means = []
-    for i, hpa_cpu_threshold in enumerate(unique_thresholds):
-        # Filter the data for the current hpa_cpu_threshold
-        filtered_data = data[data["hpa_cpu_threshold"] == hpa_cpu_threshold]
-
-        # Calculate the interquartile range (IQR) and remove any data points that fall outside of the lower and upper bounds, defined as Q1 - 1.5IQR and Q3 + 1.5IQR, respectively
-        cpu_q75 = filtered_data["cpu_usage_avg"].quantile(0.75)
-        cpu_q25 = filtered_data["cpu_usage_avg"].quantile(0.25)
-        cpu_iqr = cpu_q75 - cpu_q25
-        cpu_min = cpu_q25 - 1.5 * cpu_iqr
-        cpu_max = cpu_q75 + 1.5 * cpu_iqr
-        filtered_data = filtered_data[(filtered_data["cpu_usage_avg"] >= cpu_min) & (filtered_data["cpu_usage_avg"] <= cpu_max)]
-
-
-        # Draw the boxplot of the CPU usage
-        box = filtered_data.boxplot(column="cpu_usage_avg", ax=ax[0], positions=[i], return_type="dict")
-        stats = get_stats(filtered_data)
-        ax[0].text(i+0.036*fontsize, stats[2]+0.10*fontsize, "max: {:.2f}".format(stats[2]), horizontalalignment='center', color='red', fontsize=fontsize)
-        ax[0].text(i+0.04*fontsize, stats[0]-0.75*fontsize, "median: {:.2f}".format(stats[0]), horizontalalignment='center', color='green', fontsize=fontsize)
-        ax[0].text(i+0.036*fontsize, stats[1]+0.75*fontsize, "mean: {:.2f}".format(stats[1]), horizontalalignment='center', color='orange', fontsize=fontsize )
-        ax[0].text(i+0.036*fontsize, stats[3]-0.60*fontsize, "min: {:.2f}".format(stats[3]), horizontalalignment='center', color='blue', fontsize=fontsize)
-
-        # Calculate the mean value for the CPU usage
-        cpu_mean = filtered_data["cpu_usage_avg"].mean()
-        cpu_thresholds.append(i)
-        cpu_means.append(cpu_mean)
-
-    # Add the line connecting the mean values of the CPU usage
-    ax[0].plot(cpu_thresholds, cpu_means, marker='o', color='orange')
-
-    # Set the x-axis labels
-    ax[0].set_xticklabels(unique_thresholds)
-    ax[0].set_xticks(range(len(unique_thresholds)))
-    ax[0].set_xticklabels(["hpa_tresh: {}".format(int(x)) for x in unique_thresholds])
-
-    # Draw the boxplots of the memory usage
-    mem_thresholds = []
-    mem_means = []
-    for i, hpa_cpu_threshold in enumerate(unique_thresholds):
-        # Filter the data for the current hpa_cpu_threshold
-        filtered_data = data[data["hpa_cpu_threshold"] == hpa_cpu_threshold]
-
-        # Calculate the interquartile range (IQR) and remove any data points that fall outside of the lower and upper bounds, defined as Q1 - 1.5IQR and Q3 + 1.5IQR, respectively
-        mem_q75 = filtered_data["memory_usage_avg"].quantile(0.75)
-        mem_q25 = filtered_data["memory_usage_avg"].quantile(0.25)
-        mem_iqr = mem_q75 - mem_q25
-        mem_min = mem_q25 - 1.5 * mem_iqr
-        mem_max = mem_q75 + 1.5 * mem_iqr
-        filtered_data = filtered_data[(filtered_data["memory_usage_avg"] >= mem_min) & (filtered_data["memory_usage_avg"] <= mem_max)]
-
-
-        # Draw the boxplot of the memory usage
-        box = filtered_data.boxplot(column="memory_usage_avg", ax=ax[1], positions=[i], return_type="dict")
-        stats = get_stats(filtered_data)
-        ax[1].text(i+0.036*fontsize, stats[6]+0.004*fontsize, "max: {:.2f}".format(stats[6]), horizontalalignment='center', color='red', fontsize=fontsize)
-        ax[1].text(i+0.04*fontsize, stats[4]+0.028*fontsize, "median: {:.2f}".format(stats[4]), horizontalalignment='center', color='green', fontsize=fontsize)
-        ax[1].text(i+0.036*fontsize, stats[5]-0.048*fontsize, "mean: {:.2f}".format(stats[5]), horizontalalignment='center', color='orange', fontsize=fontsize)
-        ax[1].text(i+0.036*fontsize, stats[7]-0.024*fontsize, "min: {:.2f}".format(stats[7]), horizontalalignment='center', color='blue', fontsize=fontsize)
-
-        # Calculate the mean value for the memory usage
-        mem_mean = filtered_data["memory_usage_avg"].mean()
-        mem_thresholds.append(i)
-        mem_means.append(mem_mean)
-
-    # Add the line connecting the mean values of the memory usage
-    ax[1].plot(mem_thresholds, mem_means, marker='o', color='orange')
-
-    # Set the x-axis labels
-    ax[1].set_xticklabels(unique_thresholds)
-    ax[1].set_xticks(range(len(unique_thresholds)))
-    ax[1].set_xticklabels(["hpa_tresh: {}".format(int(x)) for x in unique_thresholds])
-    # Set the titles of the boxplots
-    ax[0].set_title("CPU Usage")
-    ax[1].set_title("Memory Usage")
-
-    # Add labels to the y-axis of the boxplots
-    ax[0].set_ylabel("CPU Usage (average in mCores)")
-    ax[1].set_ylabel("Memory Usage (average in MB)")
-    
-    if args.latency:
-        # Draw the boxplots of the HTTP Request API latencies
-        latency_ax = ax[2] if args.latency else None
-        latency_thresholds = []
-        latency_means = []
-        for i, hpa_cpu_threshold in enumerate(unique_thresholds):
-            # Get the latency data for the current hpa_cpu_threshold
-            latency_data = get_latency_data(hpa_cpu_threshold)
-            
-            # Draw the boxplot of the latency data
-            box = latency_data.boxplot(column="Latency", ax=latency_ax, positions=[i], return_type="dict")
-            # Add the statistics to the plot
-            latency_stats = get_latency_stats(latency_data)
-            latency_ax.text(i+0.036*fontsize, latency_stats[2]+0.34*fontsize, "max: {:.0f} ms".format(latency_stats[2]), horizontalalignment='center', color='red', fontsize=fontsize)
-            latency_ax.text(i+0.04*fontsize, latency_stats[0]-0.94*fontsize, "median: {:.0f} ms".format(latency_stats[0]), horizontalalignment='center', color='green', fontsize=fontsize)
-            latency_ax.text(i+0.036*fontsize, latency_stats[1]+0.99*fontsize, "mean: {:.0f} ms".format(latency_stats[1]), horizontalalignment='center', color='orange', fontsize=fontsize)
-            latency_ax.text(i+0.036*fontsize, latency_stats[3]-0.99*fontsize, "min: {:.0f} ms".format(latency_stats[3]), horizontalalignment='center', color='blue', fontsize=fontsize)
-
-            # Calculate the mean value for the latency
-            latency_mean = latency_data["Latency"].mean()
-            latency_thresholds.append(i)
-            latency_means.append(latency_mean)
-
-        # Add the line connecting the mean values of the latency
-        latency_ax.plot(latency_thresholds, latency_means, marker='o', color='orange')
-
-        # Set the x-axis labels
-        latency_ax.set_xticklabels(unique_thresholds)
-        latency_ax.set_xticks(range(len(unique_thresholds)))
-        latency_ax.set_xticklabels(["hpa_tresh: {}".format(int(x)) for x in unique_thresholds])
-
-        # Set the title and labels of the latency boxplot
-        latency_ax.set_title("HTTP Request API Latency")
-        latency_ax.set_ylabel("Latency (ms)")
-
-    if args.replicas:
-        # Draw the boxplots of the replicas
-        replicas_ax = ax[3] if args.latency else None
-        replicas_thresholds = []
-        replicas_means = []
-        for i, hpa_cpu_threshold in enumerate(unique_thresholds):
-            # Filter the data for the current hpa_cpu_threshold
-            filtered_data = data[data["hpa_cpu_threshold"] == hpa_cpu_threshold]
-
-            # Calculate the interquartile range (IQR) and remove any data points that fall outside of the lower and upper bounds, defined as Q1 - 1.5IQR and Q3 + 1.5IQR, respectively
-            replicas_q75 = filtered_data["replicas"].quantile(0.75)
-            replicas_q25 = filtered_data["replicas"].quantile(0.25)
-            replicas_iqr = replicas_q75 - replicas_q25
-            replicas_min = replicas_q25 - 1.5 * replicas_iqr
-            replicas_max = replicas_q75 + 1.5 * replicas_iqr
-            filtered_data = filtered_data[(filtered_data["replicas"] >= replicas_min) & (filtered_data["replicas"] <= replicas_max)]
-
-            # Draw the boxplot of the replicas
-            box = filtered_data.boxplot(column="replicas", ax=replicas_ax, positions=[i], return_type="dict")
-            stats = get_replicas_stats(filtered_data)
-            replicas_ax.text(i+0.036*fontsize, stats[2]+0.012*fontsize, "max: {:.0f}".format(stats[2]), horizontalalignment='center', color='red', fontsize=fontsize)
-            replicas_ax.text(i+0.04*fontsize, stats[0]-0.012*fontsize, "median: {:.0f}".format(stats[0]), horizontalalignment='center', color='green', fontsize=fontsize)
-            replicas_ax.text(i+0.036*fontsize, stats[1]+0.030*fontsize, "mean: {:.0f}".format(stats[1]), horizontalalignment='center', color='orange', fontsize=fontsize)
-            replicas_ax.text(i+0.036*fontsize, stats[3]-0.011*fontsize, "min: {:.0f}".format(stats[3]), horizontalalignment='center', color='blue', fontsize=fontsize)
-
-            # Calculate the mean value for the replicas
-            replicas_mean = filtered_data["replicas"].mean()
-            replicas_thresholds.append(i)
-            replicas_means.append(replicas_mean)
-
-        # Add the line connecting the mean values of the replicas
-        replicas_ax.plot(replicas_thresholds, replicas_means, marker='o', color='orange')
-
-        # Set the x-axis labels
-        replicas_ax.set_xticklabels(unique_thresholds)
-        replicas_ax.set_xticks(range(len(unique_thresholds)))
-        replicas_ax.set_xticklabels(["hpa_tresh: {}".format(int(x)) for x in unique_thresholds])
-
-        # Set the title and labels of the replicas boxplot
-        replicas_ax.set_title("Replicas")
-        replicas_ax.set_ylabel("Number of replicas")
+    # Compute every statistic once, then draw from the summary table only
+    metrics = ["cpu_usage_avg", "memory_usage_avg"] + (["replicas"] if args.replicas else [])
+    summary = summarize(data, metrics)
+    if args.latency and args.streaming:
+        summary = pd.concat([summary, summarize_latency_sketches(unique_thresholds, args.jmeter_directory, args.workers, args.accuracy)], ignore_index=True)
+    elif args.latency:
+        summary = pd.concat([summary, summarize(get_latency_data(unique_thresholds, args.jmeter_directory, args.workers), ["Latency"])], ignore_index=True)
+    summary.to_csv(args.summary, index=False)
+    print(summary.to_string(index=False))
+
+    # Draw the boxplots, one row of axes per metric
+    drawn = ["cpu_usage_avg", "memory_usage_avg"] + (["Latency"] if args.latency else []) + (["replicas"] if args.replicas else [])
+    fig, ax = plt.subplots(len(drawn), 1, figsize=(12, 12))
+    for metric_ax, metric in zip(ax, drawn):
+        draw_metric(metric_ax, summary, metric, unique_thresholds, fontsize)
         
     # Set the layout of the subplots
     fig.tight_layout(rect=[0, 0, 1, 0.95])
@@ -268,6 +309,11 @@ def main():
     # Save the figure as a SVG file
     plt.savefig("deployment_metrics_summary.svg")
 
+    if args.scaling:
+        episodes = analyze(data, args.cpu_request)
+        print(episodes.to_string(index=False))
+        draw_scaling(episodes, unique_thresholds, "scaling_reaction.svg")
+
 if __name__ == "__main__":
     main()
 
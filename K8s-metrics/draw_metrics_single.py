@@ -33,7 +33,7 @@ def main():
 
         # Add labels to the y-axis of the boxplots
         ax[0].set_ylabel("CPU Usage (average in mCores)")
-        ax[1].set_ylabel("Memory Usage (average in MB)")
+        ax[1].set_ylabel("Memory Usage (average in MiB)")
         
         # Calculate the median, mean, max, and min values
         cpu_median = filtered_data["cpu_usage_avg"].median()
@@ -0,0 +1,397 @@
+import argparse
+import itertools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from jmeter_ingest import load_results
+from scaling_analyzer import CPU_REQUEST
+
+# The swept parameters of the HPA and of the pods, with their defaults (k8s-www-api-blueprint.yaml, and the Kubernetes defaults otherwise)
+SWEEP_DEFAULTS = {
+    "hpa_cpu_threshold": [50],
+    "tolerance": [0.1],
+    "down_window": [90],
+    "up_window": [0],
+    "start_latency": [20],
+    "min_replicas": [5],
+    "max_replicas": [50],
+}
+
+# The clouds of the simulated pods: the on-prem nodes are filled first (the preferred node affinity of the blueprint), then the burst nodes
+CLOUDS = ["on-prem", "burst"]
+
+
+def demand_from_jmeter(path, step, cpu_per_request):
+    """
+    Return the CPU demand of the requests of a JMeter results.csv file.
+
+    Parameters:
+        path (str): The results.csv file.
+        step (float): The time step of the demand, in seconds.
+        cpu_per_request (float): The CPU time of a request, in millicore-seconds (the CPU ms per request of api_bench.py).
+
+    Returns:
+        tuple: The start time (seconds since the epoch) and the demand of every step, in millicores.
+    """
+    timestamps = load_results(path, all_codes=True)["timeStamp"].to_numpy()
+    if not len(timestamps):
+        raise ValueError("{} holds no API request".format(path))
+    start = timestamps.min() / 1000
+    counts = np.bincount(((timestamps / 1000 - start) // step).astype(np.int64))
+    return start, counts * cpu_per_request / step
+
+
+def demand_from_collector(data, step):
+    """
+    Return the CPU demand recorded by k8s_stats.py for a deployment: the average usage times the pods.
+
+    The recorded usage is bounded by the capacity of the pods that ran, so
+    the demand of saturated periods is underestimated.
+
+    Parameters:
+        data (DataFrame): The deployment metrics of one deployment.
+        step (float): The time step of the demand, in seconds.
+
+    Returns:
+        tuple: The start time (seconds since the epoch) and the demand of every step, in millicores.
+    """
+    data = data.dropna(subset=["timestamp", "cpu_usage_avg"]).sort_values("timestamp")
+    if data.empty:
+        raise ValueError("The deployment metrics hold no usage")
+    pod_columns = [column for column in data.columns if column.startswith("pods_")]
+    pods = data[pod_columns].sum(axis=1, min_count=1) if pod_columns else data["replicas"]
+    totals = (data["cpu_usage_avg"] * pods.fillna(data["replicas"])).to_numpy(dtype=np.float64)
+    timestamps = data["timestamp"].to_numpy(dtype=np.float64)
+    # Hold every sample until the next one
+    grid = timestamps[0] + np.arange(int((timestamps[-1] - timestamps[0]) // step) + 1) * step
+    return timestamps[0], totals[np.searchsorted(timestamps, grid, side="right") - 1]
+
+
+def sweep_parameters(values):
+    """
+    Return every combination of the swept parameters, as one array per parameter.
+
+    Parameters:
+        values (dict): Parameter name -> list of values, for the names of SWEEP_DEFAULTS.
+
+    Returns:
+        dict: Parameter name -> array of the values of every combination.
+    """
+    names = list(SWEEP_DEFAULTS)
+    combinations = np.array(list(itertools.product(*(values[name] for name in names))), dtype=np.float64)
+    return {name: combinations[:, i] for i, name in enumerate(names)}
+
+
+def window_min(history, position, windows):
+    """
+    Return, for every configuration, the minimum of its history over its own window of steps ending at a position.
+
+    Parameters:
+        history (array): The (configurations, steps) history.
+        position (int): The column of the last step of the windows.
+        windows (array): The window of every configuration, in steps (0 for the last step only).
+    """
+    longest = int(windows.max())
+    values = history[:, position - longest:position + 1]
+    ages = np.arange(longest, -1, -1)
+    return np.where(ages <= windows[:, None], values, np.inf).min(axis=1)
+
+
+def simulate(demand, step, parameters, cpu_request=CPU_REQUEST, pod_cpu=250, on_prem_pods=20, burst_pods=30,
+             burst_latency=30, sync_period=15, metrics_resolution=15, scale_up_percent=100, scale_up_pods=4):
+    """
+    Replay a CPU demand through a model of the HPA, for many configurations at once.
+
+    Every step advances all the configurations together, with array operations:
+      - the pods start start_latency seconds after their creation (burst_latency more on the burst
+        nodes); the pods beyond the capacity of the nodes stay pending, and the not ready pods are
+        removed first on scale-down
+      - the demand is shared by the ready pods, each using up to pod_cpu millicores; the rest is queued
+      - the metrics server averages the usage of the pods over windows of metrics_resolution seconds
+      - every sync_period seconds the HPA computes the desired replicas from the last window (with
+        the tolerance band, and the not ready pods counted as idle when scaling up), stabilizes them
+        over the scale-up and scale-down windows, limits the scale-up rate (the larger of
+        scale_up_percent and scale_up_pods per period) and clamps them to the min and max replicas
+
+    Parameters:
+        demand (array): The CPU demand of every step, in millicores.
+        step (float): The time step, in seconds.
+        parameters (dict): Parameter name -> array of the values of every configuration (see SWEEP_DEFAULTS).
+        cpu_request (float): The CPU request of the pods, in millicores.
+        pod_cpu (float): The CPU a pod can use, in millicores.
+        on_prem_pods (int): The number of pods that fit on the on-prem nodes.
+        burst_pods (int): The number of pods that fit on the burst nodes.
+        burst_latency (float): The additional start latency of the pods on the burst nodes, in seconds.
+        sync_period (float): The time between two HPA decisions, in seconds.
+        metrics_resolution (float): The window of the metrics server, in seconds.
+        scale_up_percent (float): The scale-up policy: the replicas can grow by this percentage per sync period...
+        scale_up_pods (int): ...or by this number of pods, whichever is larger.
+
+    Returns:
+        dict: (configurations, steps) arrays of the replicas, the ready pods on the on-prem and the burst nodes,
+            the average usage of the ready pods (millicores) and the queued demand (millicore-seconds).
+    """
+    configurations = len(parameters["hpa_cpu_threshold"])
+    steps = len(demand)
+    threshold = parameters["hpa_cpu_threshold"]
+    tolerance = parameters["tolerance"]
+    min_replicas = parameters["min_replicas"]
+    max_replicas = parameters["max_replicas"]
+    sync_steps = max(int(round(sync_period / step)), 1)
+    resolution_steps = max(int(round(metrics_resolution / step)), 1)
+    on_prem_latency = np.ceil(parameters["start_latency"] / step)
+    burst_latency = on_prem_latency + np.ceil(burst_latency / step)
+    # Stabilization windows in sync periods: the recommendations younger than the window count
+    down_syncs = np.ceil(parameters["down_window"] / sync_period) - 1
+    up_syncs = np.ceil(parameters["up_window"] / sync_period) - 1
+
+    # The replicas are constant between two decisions: the histories hold them per sync period, after a warm-up
+    # at the min replicas as long as the longest start latency
+    warm_up = int(np.ceil(burst_latency.max() / sync_steps)) + 1
+    replicas = min_replicas.copy()
+    on_prem_history = np.empty((configurations, warm_up + steps // sync_steps + 1))
+    burst_history = np.empty_like(on_prem_history)
+    on_prem_history[:, :warm_up] = np.minimum(replicas, on_prem_pods)[:, None]
+    burst_history[:, :warm_up] = np.clip(replicas - on_prem_pods, 0, burst_pods)[:, None]
+    # The recommendations of the HPA, after those of the warm-up (the min replicas)
+    down_syncs = np.maximum(down_syncs, 0)
+    up_syncs = np.maximum(up_syncs, 0)
+    padding = int(max(down_syncs.max(), up_syncs.max()))
+    recommendations = np.empty((configurations, padding + steps // sync_steps + 1))
+    recommendations[:, :padding + 1] = min_replicas[:, None]
+
+    result = {name: np.empty((configurations, steps), dtype=np.float32) for name in ("replicas", "ready_on_prem", "ready_burst", "cpu_usage", "backlog")}
+    backlog = np.zeros(configurations)
+    ready = replicas.copy()
+    for t in range(steps):
+        sync = t // sync_steps
+        if t and not t % sync_steps:
+            # The last complete window of the metrics server
+            window_end = t // resolution_steps * resolution_steps
+            window = result["cpu_usage"][:, max(window_end - resolution_steps, 0):max(window_end, 1)]
+            ratio = window.mean(axis=1) / cpu_request * 100 / threshold
+            # When scaling up, the not ready pods count as idle
+            new_ratio = np.where((ratio > 1) & (ready < replicas), ratio * ready / replicas, ratio)
+            desired = np.ceil(np.round(ratio * ready, 6))
+            keep = (np.abs(1 - new_ratio) <= tolerance) | (ready == 0) | ((ratio > 1) & (new_ratio < 1))
+            keep |= ((new_ratio < 1) & (desired > replicas)) | ((new_ratio > 1) & (desired < replicas))
+            desired = np.where(keep, replicas, desired)
+
+            # Stabilize: scale down to the highest and up to the lowest recommendation of the windows
+            recommendations[:, padding + sync] = desired
+            down = -window_min(-recommendations, padding + sync, down_syncs)
+            up = window_min(recommendations, padding + sync, up_syncs)
+            stabilized = np.minimum(np.maximum(replicas, up), down)
+            limit = np.maximum(np.ceil(replicas * (1 + scale_up_percent / 100)), replicas + scale_up_pods)
+            replicas = np.clip(np.minimum(stabilized, limit), min_replicas, max_replicas)
+        if not t % sync_steps:
+            on_prem_history[:, warm_up + sync] = np.minimum(replicas, on_prem_pods)
+            burst_history[:, warm_up + sync] = np.clip(replicas - on_prem_pods, 0, burst_pods)
+
+        # The pods created latency steps ago or earlier are ready, unless removed since (the not ready pods are removed first):
+        # the ready pods are the fewest replicas since then
+        ready_on_prem = window_min(on_prem_history, warm_up + sync, sync - (t - on_prem_latency) // sync_steps)
+        ready_burst = window_min(burst_history, warm_up + sync, sync - (t - burst_latency) // sync_steps)
+        ready = ready_on_prem + ready_burst
+
+        work = backlog + demand[t] * step
+        served = np.minimum(work, ready * pod_cpu * step)
+        backlog = work - served
+        usage = np.divide(served / step, ready, out=np.zeros(configurations), where=ready > 0)
+
+        result["replicas"][:, t] = replicas
+        result["ready_on_prem"][:, t] = ready_on_prem
+        result["ready_burst"][:, t] = ready_burst
+        result["cpu_usage"][:, t] = usage
+        result["backlog"][:, t] = backlog
+    return result
+
+
+def _simulate_chunk(demand, step, parameters, settings):
+    """
+    Simulate a chunk of the configurations (for the process pool).
+    """
+    return simulate(demand, step, parameters, **settings)
+
+
+def simulate_sweep(demand, step, parameters, settings, workers=None):
+    """
+    Simulate every configuration, split in chunks over processes.
+
+    Parameters:
+        demand (array): The CPU demand of every step, in millicores.
+        step (float): The time step, in seconds.
+        parameters (dict): Parameter name -> array of the values of every configuration.
+        settings (dict): The other keyword arguments of simulate.
+        workers (int): The number of processes, the number of CPUs if None. 1 simulates in this process.
+
+    Returns:
+        dict: The arrays returned by simulate, for all the configurations.
+    """
+    configurations = len(parameters["hpa_cpu_threshold"])
+    chunks = [chunk for chunk in np.array_split(np.arange(configurations), workers or os.cpu_count() or 1) if len(chunk)]
+    if len(chunks) < 2:
+        return simulate(demand, step, parameters, **settings)
+    chunk_parameters = [{name: values[chunk] for name, values in parameters.items()} for chunk in chunks]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(_simulate_chunk, [demand] * len(chunks), [step] * len(chunks), chunk_parameters, [settings] * len(chunks)))
+    return {name: np.concatenate([result[name] for result in results]) for name in results[0]}
+
+
+def run_names(parameters):
+    """
+    Return the name of every configuration, e.g. thr50-tol0.1-down90-up0-start20-min5-max50.
+    """
+    labels = ["thr", "tol", "down", "up", "start", "min", "max"]
+    values = [pd.Series(parameters[name]).map("{:g}".format) for name in SWEEP_DEFAULTS]
+    names = labels[0] + values[0]
+    for label, value in zip(labels[1:], values[1:]):
+        names = names + "-" + label + value
+    return names.to_numpy()
+
+
+def to_deployment_metrics(result, parameters, start, step, sample_time, memory_usage, namespace, deployment):
+    """
+    Sample the simulated configurations in the format of the deployment metrics written by k8s_stats.py, with a run column naming the configuration.
+    """
+    configurations, steps = result["replicas"].shape
+    sampled = np.arange(0, steps, max(int(round(sample_time / step)), 1))
+    count = len(sampled)
+
+    def flat(name):
+        return result[name][:, sampled].ravel().astype(np.float64)
+
+    ready_on_prem, ready_burst = flat("ready_on_prem"), flat("ready_burst")
+    usage = flat("cpu_usage")
+    pods = ready_on_prem + ready_burst
+    data = {
+        "timestamp": np.tile(start + sampled * step, configurations),
+        "namespace": namespace,
+        "deployment": deployment,
+        "cpu_usage_avg": np.where(pods > 0, usage, np.nan),
+        "memory_usage_avg": np.where(pods > 0, memory_usage, np.nan),
+        "hpa_cpu_threshold": np.repeat(parameters["hpa_cpu_threshold"], count).astype(np.int64),
+        "replicas": flat("replicas").astype(np.int64),
+    }
+    # The ready pods share the load evenly, so the per-cloud averages equal the overall ones
+    for cloud, cloud_pods in zip(CLOUDS, (ready_on_prem, ready_burst)):
+        suffix = cloud.replace("-", "_")
+        cpu_column, memory_column, pods_column = "cpu_usage_avg_" + suffix, "memory_usage_avg_" + suffix, "pods_" + suffix
+        data[cpu_column] = np.where(cloud_pods > 0, usage, np.nan)
+        data[memory_column] = np.where(cloud_pods > 0, memory_usage, np.nan)
+        data[pods_column] = cloud_pods.astype(np.int64)
+    data["run"] = np.repeat(run_names(parameters), count)
+    return pd.DataFrame(data)
+
+
+def summarize_runs(result, parameters, step, pod_cpu, cpu_request=CPU_REQUEST):
+    """
+    Summarize every simulated configuration: the cost in replicas and the time the demand was queued.
+
+    Returns:
+        DataFrame: One row per configuration, with its parameters.
+    """
+    replicas = result["replicas"].astype(np.float64)
+    ready = (result["ready_on_prem"] + result["ready_burst"]).astype(np.float64)
+    backlog = result["backlog"].astype(np.float64)
+    summary = pd.DataFrame(parameters)
+    summary.insert(0, "run", run_names(parameters))
+    summary["mean_replicas"] = replicas.mean(axis=1)
+    summary["peak_replicas"] = replicas.max(axis=1)
+    summary["replica_hours"] = replicas.sum(axis=1) * step / 3600
+    summary["peak_burst_pods"] = result["ready_burst"].max(axis=1)
+    summary["burst_time"] = (result["ready_burst"] > 0).sum(axis=1) * step
+    summary["scale_changes"] = (np.diff(replicas, axis=1) != 0).sum(axis=1)
+    # The queued demand, and the time the ready pods need to clear it
+    summary["overload_time"] = (backlog > 0).sum(axis=1) * step
+    summary["max_queue_delay"] = np.divide(backlog, ready * pod_cpu, out=np.full(backlog.shape, np.inf), where=ready > 0).max(axis=1)
+    # The utilization seen by the HPA, relative to the CPU request
+    summary["mean_utilization"] = (result["cpu_usage"].astype(np.float64) * ready).sum(axis=1) / np.maximum(ready.sum(axis=1), 1) / cpu_request * 100
+    return summary
+
+
+def main():
+    """
+    Main function to replay a load trace through a model of the HPA for every combination of the swept parameters.
+    """
+    # Define the command-line arguments
+    parser = argparse.ArgumentParser(description="Replay a load trace through a model of the HPA for every combination of the swept parameters")
+    parser.add_argument("--trace", type=str, required=True, help="The load trace: a JMeter results.csv file or a deployment metrics file of k8s_stats.py")
+    parser.add_argument("--deployment", type=str, help="The deployment of the deployment metrics file to replay, as name or namespace/name, when it holds several")
+    parser.add_argument("--source_threshold", type=int, help="Replay only the rows recorded with this HPA CPU threshold, when the deployment metrics file holds several runs")
+    parser.add_argument("--cpu_per_request", type=float, default=10, help="The CPU time of a request of a JMeter trace, in millicore-seconds (the CPU ms per request of api_bench.py)")
+    # The swept parameters
+    parser.add_argument("--threshold", type=float, nargs="+", default=SWEEP_DEFAULTS["hpa_cpu_threshold"], help="The HPA CPU thresholds, in percent")
+    parser.add_argument("--tolerance", type=float, nargs="+", default=SWEEP_DEFAULTS["tolerance"], help="The tolerance bands of the HPA")
+    parser.add_argument("--down_window", type=float, nargs="+", default=SWEEP_DEFAULTS["down_window"], help="The scale-down stabilization windows, in seconds")
+    parser.add_argument("--up_window", type=float, nargs="+", default=SWEEP_DEFAULTS["up_window"], help="The scale-up stabilization windows, in seconds")
+    parser.add_argument("--start_latency", type=float, nargs="+", default=SWEEP_DEFAULTS["start_latency"], help="The times from the creation of a pod to its readiness, in seconds")
+    parser.add_argument("--min_replicas", type=int, nargs="+", default=SWEEP_DEFAULTS["min_replicas"], help="The min replicas of the HPA")
+    parser.add_argument("--max_replicas", type=int, nargs="+", default=SWEEP_DEFAULTS["max_replicas"], help="The max replicas of the HPA")
+    # The cluster model
+    parser.add_argument("--cpu_request", type=float, default=CPU_REQUEST, help="The CPU request of the pods, in millicores")
+    parser.add_argument("--pod_cpu", type=float, default=250, help="The CPU a pod can use, in millicores")
+    parser.add_argument("--on_prem_pods", type=int, default=20, help="The number of pods that fit on the on-prem nodes")
+    parser.add_argument("--burst_pods", type=int, default=30, help="The number of pods that fit on the burst nodes")
+    parser.add_argument("--burst_latency", type=float, default=30, help="The additional start latency of the pods on the burst nodes, in seconds")
+    parser.add_argument("--sync_period", type=float, default=15, help="The time between two HPA decisions, in seconds")
+    parser.add_argument("--metrics_resolution", type=float, default=15, help="The window of the metrics server, in seconds")
+    parser.add_argument("--scale_up_percent", type=float, default=100, help="The scale-up policy: the percentage of replicas added per sync period (the larger of this and --scale_up_pods applies)")
+    parser.add_argument("--scale_up_pods", type=int, default=4, help="The scale-up policy: the pods added per sync period")
+    parser.add_argument("--memory_usage", type=float, help="The memory usage of a pod, in MiB; the average of the deployment metrics trace, or 96, if not given")
+    # The simulation and the outputs
+    parser.add_argument("--step", type=float, default=1, help="The time step of the simulation, in seconds")
+    parser.add_argument("--sample_time", type=float, default=15, help="The time between two output rows, in seconds, like the --sleep_time of k8s_stats.py")
+    parser.add_argument("--workers", type=int, help="The number of processes, the number of CPUs if not given")
+    parser.add_argument("--output", type=str, default="simulated_metrics.csv", help="The simulated deployment metrics, one run per configuration, for draw_metrics.py")
+    parser.add_argument("--summary", type=str, default="simulated_summary.csv", help="The summary of every configuration")
+    args = parser.parse_args()
+
+    namespace, deployment = "default", "factorial-api"
+    trace_columns = pd.read_csv(args.trace, nrows=0).columns
+    if "timeStamp" in trace_columns:
+        start, demand = demand_from_jmeter(args.trace, args.step, args.cpu_per_request)
+        memory_usage = args.memory_usage or 96
+    else:
+        data = pd.read_csv(args.trace)
+        if args.source_threshold is not None:
+            data = data[data["hpa_cpu_threshold"] == args.source_threshold]
+        if "deployment" in data.columns:
+            if args.deployment:
+                namespace, _, name = args.deployment.rpartition("/")
+                data = data[data["deployment"] == name]
+                if namespace:
+                    data = data[data["namespace"] == namespace]
+            elif data[["namespace", "deployment"]].drop_duplicates().shape[0] > 1:
+                parser.error("The trace holds several deployments, choose one with --deployment")
+            if not data.empty:
+                namespace, deployment = data["namespace"].iloc[0], data["deployment"].iloc[0]
+        start, demand = demand_from_collector(data, args.step)
+        memory_usage = args.memory_usage or data["memory_usage_avg"].mean()
+
+    parameters = sweep_parameters({
+        "hpa_cpu_threshold": args.threshold, "tolerance": args.tolerance, "down_window": args.down_window, "up_window": args.up_window,
+        "start_latency": args.start_latency, "min_replicas": args.min_replicas, "max_replicas": args.max_replicas,
+    })
+    settings = {
+        "cpu_request": args.cpu_request, "pod_cpu": args.pod_cpu, "on_prem_pods": args.on_prem_pods, "burst_pods": args.burst_pods,
+        "burst_latency": args.burst_latency, "sync_period": args.sync_period, "metrics_resolution": args.metrics_resolution,
+        "scale_up_percent": args.scale_up_percent, "scale_up_pods": args.scale_up_pods,
+    }
+    began = time.perf_counter()
+    result = simulate_sweep(demand, args.step, parameters, settings, args.workers)
+    print("Simulated {} configurations over {:.0f} s of load in {:.2f} s".format(len(parameters["hpa_cpu_threshold"]), len(demand) * args.step, time.perf_counter() - began))
+
+    to_deployment_metrics(result, parameters, start, args.step, args.sample_time, memory_usage, namespace, deployment).to_csv(args.output, index=False)
+    summary = summarize_runs(result, parameters, args.step, args.pod_cpu, args.cpu_request)
+    summary.to_csv(args.summary, index=False)
+    print(summary.sort_values(["overload_time", "replica_hours"]).head(20).to_string(index=False))
+    print("Wrote the simulated metrics to {} and the summary to {}".format(args.output, args.summary))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+import argparse
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# REPORT_HTML<hpa_cpu_threshold>_<repetition>: the output directory of a JMeter run
+REPORT_NAME = re.compile(r"^REPORT_HTML(?P<threshold>\d+)_(?P<repetition>\d+)$", re.IGNORECASE)
+
+# The columns of results.csv that are read, with their types (responseCode is not always a number, e.g. "Non HTTP response code: ...")
+RESULTS_DTYPES = {"timeStamp": "int64", "elapsed": "int64", "label": "str", "responseCode": "str", "Latency": "int64"}
+
+# The requests that are kept
+LABEL = "HTTP Request API"
+RESPONSE_CODE = "200"
+
+# Cached files are written next to results.csv
+CACHE_NAME = "results.filtered.parquet"
+
+# Bump when the cached content changes, to invalidate the old caches
+CACHE_VERSION = "2"
+
+
+def find_reports(directory, thresholds=None):
+    """
+    Find the JMeter report directories.
+
+    Parameters:
+        directory (str): The directory holding the REPORT_HTML<threshold>_<repetition> directories.
+        thresholds (list): The HPA CPU thresholds to keep, all of them if None.
+
+    Returns:
+        list: (threshold, repetition, results.csv path) tuples, sorted by threshold and repetition.
+    """
+    reports = []
+    for name in os.listdir(directory):
+        match = REPORT_NAME.match(name)
+        path = os.path.join(directory, name, "results.csv")
+        if match is None or not os.path.isfile(path):
+            continue
+        threshold = int(match["threshold"])
+        if thresholds is None or threshold in thresholds:
+            reports.append((threshold, int(match["repetition"]), path))
+    return sorted(reports)
+
+
+def source_key(path):
+    """
+    Return what identifies the content of a results file for the cache: its modification time, its size and the filter.
+    """
+    stat = os.stat(path)
+    return {"mtime_ns": str(stat.st_mtime_ns), "size": str(stat.st_size), "label": LABEL, "response_code": RESPONSE_CODE, "version": CACHE_VERSION}
+
+
+def read_cache(cache_path, key):
+    """
+    Return the cached rows of a results file, or None if there is no cache or it is stale.
+    """
+    try:
+        metadata = pq.read_schema(cache_path).metadata or {}
+    except (OSError, pa.ArrowInvalid):
+        return None
+    if any(metadata.get(name.encode()) != value.encode() for name, value in key.items()):
+        return None
+    return pq.read_table(cache_path).to_pandas()
+
+
+def write_cache(cache_path, data, key):
+    """
+    Write the filtered rows of a results file with the key of its source, atomically.
+    """
+    table = pa.Table.from_pandas(data, preserve_index=False)
+    table = table.replace_schema_metadata(dict(table.schema.metadata or {}, **key))
+    temp_path = cache_path + ".tmp"
+    pq.write_table(table, temp_path, compression="zstd")
+    os.replace(temp_path, cache_path)
+
+
+def load_results(path, use_cache=True, all_codes=False):
+    """
+    Load the successful "HTTP Request API" rows of a JMeter results.csv file.
+
+    Only the needed columns are parsed. The rows are cached in a Parquet file
+    next to the CSV file, reused as long as the CSV file keeps its
+    modification time and size.
+
+    Parameters:
+        path (str): The results.csv file.
+        use_cache (bool): Whether to read and write the cache.
+        all_codes (bool): Whether to keep the failed "HTTP Request API" rows too, with an "ok" column telling the successful ones.
+
+    Returns:
+        DataFrame: The timeStamp, elapsed and Latency columns of the kept requests.
+    """
+    cache_path = os.path.join(os.path.dirname(path), CACHE_NAME)
+    key = source_key(path)
+    data = read_cache(cache_path, key) if use_cache else None
+    if data is None:
+        data = pd.read_csv(path, usecols=list(RESULTS_DTYPES), dtype=RESULTS_DTYPES)
+        data = data[data["label"] == LABEL]
+        data = pd.DataFrame({
+            "timeStamp": data["timeStamp"].to_numpy(), "elapsed": data["elapsed"].to_numpy(), "Latency": data["Latency"].to_numpy(),
+            "ok": (data["responseCode"] == RESPONSE_CODE).to_numpy(dtype=bool),
+        })
+        if use_cache:
+            try:
+                write_cache(cache_path, data, key)
+            except OSError as e:
+                # A read-only report directory only costs the parsing next time
+                print("Could not cache {}: {}".format(path, e))
+    if all_codes:
+        return data
+    return data.loc[data["ok"], ["timeStamp", "elapsed", "Latency"]].reset_index(drop=True)
+
+
+def _load_report(report, use_cache, all_codes):
+    """
+    Load a report found by find_reports, returning the error instead of raising it (for the process pool).
+    """
+    threshold, repetition, path = report
+    try:
+        return load_results(path, use_cache, all_codes), None
+    except (OSError, ValueError) as e:
+        # Unreadable, empty or malformed files (pandas parser errors are ValueErrors)
+        return None, "Skipping {}: {}".format(path, e)
+
+
+def load_latencies(directory, thresholds=None, workers=None, use_cache=True, all_codes=False):
+    """
+    Load the JMeter results of every report of a directory, in parallel.
+
+    Parameters:
+        directory (str): The directory holding the REPORT_HTML<threshold>_<repetition> directories.
+        thresholds (list): The HPA CPU thresholds to load, all of them if None.
+        workers (int): The number of processes, the number of CPUs if None. 1 loads the files in this process.
+        use_cache (bool): Whether to read and write the Parquet caches.
+        all_codes (bool): Whether to keep the failed requests too, with an "ok" column (see load_results).
+
+    Returns:
+        DataFrame: The timeStamp, elapsed and Latency columns of the kept requests, with their hpa_cpu_threshold and repetition.
+    """
+    if thresholds is not None:
+        thresholds = {int(threshold) for threshold in thresholds}
+    reports = find_reports(directory, thresholds)
+    if workers == 1 or len(reports) < 2:
+        results = [_load_report(report, use_cache, all_codes) for report in reports]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_load_report, reports, [use_cache] * len(reports), [all_codes] * len(reports)))
+
+    frames = []
+    for (threshold, repetition, _), (data, error) in zip(reports, results):
+        if error is not None:
+            print(error)
+            continue
+        frames.append(data.assign(hpa_cpu_threshold=threshold, repetition=repetition))
+    if not frames:
+        columns = ["timeStamp", "elapsed", "Latency"] + (["ok"] if all_codes else []) + ["hpa_cpu_threshold", "repetition"]
+        return pd.DataFrame({name: pd.Series(dtype="bool" if name == "ok" else "int64") for name in columns})
+    return pd.concat(frames, ignore_index=True)
+
+
+def main():
+    """
+    Main function to load the JMeter results, filling the caches, and summarize them.
+    """
+    # Define the command-line arguments
+    parser = argparse.ArgumentParser(description="Load the JMeter results, filling the caches, and summarize them")
+    parser.add_argument("--directory", type=str, default=os.path.join("..", "JmeterLoadTest"), help="The directory of the JMeter reports")
+    parser.add_argument("--threshold", type=int, nargs="+", help="The HPA CPU thresholds to load, all of them if not given")
+    parser.add_argument("--workers", type=int, help="The number of processes, the number of CPUs if not given")
+    parser.add_argument("--no_cache", action='store_true', help="Parse the CSV files without reading or writing the caches")
+    args = parser.parse_args()
+
+    data = load_latencies(args.directory, args.threshold, args.workers, use_cache=not args.no_cache)
+    print(data.groupby(["hpa_cpu_threshold", "repetition"])["Latency"].describe().to_string())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,330 @@
+import threading
+import time
+
+# Import the kubernetes client library
+from kubernetes import client, watch
+from kubernetes.client.rest import ApiException
+
+
+def create_api_client(pool_size=4):
+    """
+    Create one API client whose connection pool is shared by every API object.
+
+    Must be called after config.load_kube_config.
+
+    Parameters:
+        pool_size (int): The maximum number of pooled connections to the API server.
+
+    Returns:
+        ApiClient: The API client.
+    """
+    configuration = client.Configuration.get_default_copy()
+    configuration.connection_pool_maxsize = pool_size
+    return client.ApiClient(configuration)
+
+
+class FixedRateClock:
+    """
+    Schedule samples on a fixed-rate grid (start + k * period).
+
+    Sleeping a fixed time after each sample makes the real period drift by
+    the time spent sampling; waiting for the next grid point does not.
+    Ticks that are already over when a sample ends are skipped and counted.
+    """
+
+    def __init__(self, period):
+        self.period = period
+        self.start = time.monotonic()
+        self.ticks = 0
+        self.missed = 0
+
+    def wait(self):
+        """
+        Sleep until the next tick of the grid.
+        """
+        self.ticks += 1
+        now = time.monotonic()
+        deadline = self.start + self.ticks * self.period
+        if now > deadline:
+            # The sample took longer than a period: skip to the next tick in the future
+            late_ticks = int((now - deadline) // self.period) + 1
+            self.missed += late_ticks
+            self.ticks += late_ticks
+            deadline += late_ticks * self.period
+        time.sleep(deadline - now)
+
+
+class ResourceWatcher:
+    """
+    Keep the latest state of the objects returned by a list function, updated by a watch stream.
+
+    The objects are listed once, then every change is received through a
+    watch in a background thread, so reading them costs no API call.
+    The watch resumes from the last seen resource version and lists again
+    only if the server has expired it.
+    """
+
+    def __init__(self, list_function, on_change=None, name=None, **kwargs):
+        """
+        Parameters:
+            list_function (function): A list_* method of a kubernetes API object.
+            on_change (function): Called with (event_type, object) on every change, if given.
+                event_type is "ADDED", "MODIFIED", "DELETED" or "SYNC" (after a full list).
+                A full list starts with a ("RESET", None) call.
+            name (str): The name of the background thread.
+            **kwargs: The arguments of the list function (namespace, label_selector, field_selector...).
+        """
+        self.list_function = list_function
+        self.on_change = on_change
+        self.kwargs = kwargs
+        self.ready = threading.Event()
+        self._objects = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=name or "watch", daemon=True)
+
+    def start(self, timeout=30):
+        """
+        Start watching and wait for the first list.
+
+        Returns:
+            bool: True if the first list completed within the timeout.
+        """
+        self._thread.start()
+        return self.ready.wait(timeout)
+
+    def stop(self):
+        self._stopped.set()
+
+    @staticmethod
+    def key(obj):
+        return obj.metadata.namespace, obj.metadata.name
+
+    def get(self, namespace, name):
+        """
+        Return the latest state of an object, or None if it does not exist.
+        """
+        with self._lock:
+            return self._objects.get((namespace, name))
+
+    def items(self):
+        """
+        Return a snapshot of all the watched objects.
+        """
+        with self._lock:
+            return list(self._objects.values())
+
+    def _list(self):
+        """
+        List the objects, replace the local state and return the resource version to watch from.
+        """
+        result = self.list_function(**self.kwargs)
+        with self._lock:
+            self._objects = {self.key(obj): obj for obj in result.items}
+        if self.on_change is not None:
+            self.on_change("RESET", None)
+            for obj in result.items:
+                self.on_change("SYNC", obj)
+        self.ready.set()
+        return result.metadata.resource_version
+
+    def _run(self):
+        resource_version = None
+        while not self._stopped.is_set():
+            try:
+                if resource_version is None:
+                    resource_version = self._list()
+                stream = watch.Watch().stream(self.list_function, resource_version=resource_version, timeout_seconds=300, **self.kwargs)
+                for event in stream:
+                    if self._stopped.is_set():
+                        return
+                    obj = event["object"]
+                    with self._lock:
+                        if event["type"] == "DELETED":
+                            self._objects.pop(self.key(obj), None)
+                        else:
+                            self._objects[self.key(obj)] = obj
+                    resource_version = obj.metadata.resource_version
+                    if self.on_change is not None:
+                        self.on_change(event["type"], obj)
+            except ApiException as e:
+                if e.status == 410:
+                    # The resource version is too old: list again
+                    resource_version = None
+                else:
+                    print("Watch error: {}".format(e))
+                    time.sleep(1)
+            except Exception as e:
+                print("Watch error: {}".format(e))
+                resource_version = None
+                time.sleep(1)
+
+
+def selector_matches(selector, labels):
+    """
+    Check if the labels of an object satisfy a label selector.
+
+    Parameters:
+        selector (V1LabelSelector): The selector of a deployment.
+        labels (dict): The labels of a pod.
+
+    Returns:
+        bool: True if the labels match every requirement of the selector.
+    """
+    if selector is None:
+        return False
+    labels = labels or {}
+    for key, value in (selector.match_labels or {}).items():
+        if labels.get(key) != value:
+            return False
+    for requirement in selector.match_expressions or []:
+        present = requirement.key in labels
+        if requirement.operator == "In" and labels.get(requirement.key) not in (requirement.values or []):
+            return False
+        if requirement.operator == "NotIn" and present and labels[requirement.key] in (requirement.values or []):
+            return False
+        if requirement.operator == "Exists" and not present:
+            return False
+        if requirement.operator == "DoesNotExist" and present:
+            return False
+    return True
+
+
+class PodIndex:
+    """
+    Attribute pods to the tracked deployments.
+
+    A pod belongs to a deployment of its namespace if it matches the
+    deployment selector and, when it has one, its owner ReplicaSet is named
+    after the deployment. The index is updated incrementally from the pod and
+    deployment watch events, so attributing a pod metric is a dictionary lookup.
+    """
+
+    def __init__(self, targets):
+        """
+        Parameters:
+            targets (iterable): The (namespace, deployment name) pairs to track.
+        """
+        self.targets = set(targets)
+        self._selectors = {}
+        # (namespace, pod name) -> (labels, owner ReplicaSet names)
+        self._pods = {}
+        # (namespace, pod name) -> node name
+        self._nodes = {}
+        # (namespace, pod name) -> (namespace, deployment name)
+        self._owners = {}
+        self._lock = threading.Lock()
+
+    def _attribute(self, pod_key):
+        labels, owners = self._pods[pod_key]
+        namespace = pod_key[0]
+        for (target_namespace, deployment_name), selector in self._selectors.items():
+            if target_namespace != namespace or not selector_matches(selector, labels):
+                continue
+            if owners and not any(owner.startswith(deployment_name + "-") for owner in owners):
+                continue
+            self._owners[pod_key] = (target_namespace, deployment_name)
+            return
+        self._owners.pop(pod_key, None)
+
+    def on_deployment(self, event_type, deployment):
+        """
+        Update the index with a deployment event (a ResourceWatcher on_change callback).
+        """
+        if event_type == "RESET":
+            with self._lock:
+                self._selectors = {}
+                self._owners = {}
+            return
+        key = ResourceWatcher.key(deployment)
+        if key not in self.targets:
+            return
+        with self._lock:
+            if event_type == "DELETED":
+                self._selectors.pop(key, None)
+            elif self._selectors.get(key) == deployment.spec.selector:
+                return
+            else:
+                self._selectors[key] = deployment.spec.selector
+            # The selector changed: attribute the pods of the namespace again
+            for pod_key in self._pods:
+                if pod_key[0] == key[0]:
+                    self._attribute(pod_key)
+
+    def on_pod(self, event_type, pod):
+        """
+        Update the index with a pod event (a ResourceWatcher on_change callback).
+        """
+        if event_type == "RESET":
+            with self._lock:
+                self._pods = {}
+                self._owners = {}
+                self._nodes = {}
+            return
+        key = ResourceWatcher.key(pod)
+        with self._lock:
+            if event_type == "DELETED":
+                self._pods.pop(key, None)
+                self._owners.pop(key, None)
+                self._nodes.pop(key, None)
+                return
+            owners = tuple(owner.name for owner in pod.metadata.owner_references or [] if owner.kind == "ReplicaSet")
+            self._pods[key] = (pod.metadata.labels or {}, owners)
+            self._nodes[key] = pod.spec.node_name
+            self._attribute(key)
+
+    def rebuild(self, deployments, pods):
+        """
+        Replace the whole index with listed deployments and pods.
+        """
+        self.on_deployment("RESET", None)
+        self.on_pod("RESET", None)
+        for deployment in deployments:
+            self.on_deployment("SYNC", deployment)
+        for pod in pods:
+            self.on_pod("SYNC", pod)
+
+    def deployment_of(self, namespace, pod_name):
+        """
+        Return the (namespace, deployment name) of a pod, or None if it belongs to no tracked deployment.
+        """
+        return self._owners.get((namespace, pod_name))
+
+    def node_of(self, namespace, pod_name):
+        """
+        Return the name of the node running a pod, or None if it is not scheduled yet.
+        """
+        return self._nodes.get((namespace, pod_name))
+
+
+class LabelCache:
+    """
+    Keep the value of one label of the watched objects, by object name (e.g. the node-type label of the nodes).
+
+    Its on_change method is meant to be the callback of a ResourceWatcher.
+    """
+
+    def __init__(self, label):
+        self.label = label
+        self._values = {}
+
+    def on_change(self, event_type, obj):
+        if event_type == "RESET":
+            self._values = {}
+        elif event_type == "DELETED":
+            self._values.pop(obj.metadata.name, None)
+        else:
+            self._values[obj.metadata.name] = (obj.metadata.labels or {}).get(self.label)
+
+    def rebuild(self, objects):
+        """
+        Replace the cached values with listed objects.
+        """
+        values = {obj.metadata.name: (obj.metadata.labels or {}).get(self.label) for obj in objects}
+        self._values = values
+
+    def get(self, name):
+        """
+        Return the label value of an object, or None if the object or its label is unknown.
+        """
+        return self._values.get(name)
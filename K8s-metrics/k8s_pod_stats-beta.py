@@ -6,54 +6,34 @@ import os
 # Import the kubernetes client library
 from kubernetes import client, config
 
-def get_pod_metrics(namespace, pod_name):
+from k8s_collector import FixedRateClock, PodIndex, ResourceWatcher, create_api_client
+from k8s_quantity import usage_arrays
+from metrics_store import MetricsStore
+
+def get_pods_metrics(api, namespace):
     """
-    Retrieve the CPU and memory usage for a specific pod.
-    
+    Retrieve the CPU and memory usage of every pod of a namespace with a single API call.
+
     Parameters:
-        namespace (str): The namespace of the pod.
-        pod_name (str): The name of the pod.
-    
+        api (CustomObjectsApi): The API object to use.
+        namespace (str): The namespace of the pods.
+
     Returns:
-        tuple: A tuple containing the CPU usage and memory usage.
+        dict: Pod name -> (CPU usage, memory usage), or None if the call failed.
     """
-    # Create an instance of the CustomObjectsApi
-    api = client.CustomObjectsApi()
-    
     try:
-        # Get the custom resource for the pod
-        resource = api.get_namespaced_custom_object(
-            group="metrics.k8s.io", version="v1beta1", name=pod_name, namespace=namespace, plural="pods"
+        # Get the custom resource for the pods of the namespace
+        resource = api.list_namespaced_custom_object(
+            group="metrics.k8s.io", version="v1beta1", namespace=namespace, plural="pods"
         )
-
-        # Initialize the CPU and memory usage
-        cpu_usage = 0
-        memory_usage = 0
-        
-        # Iterate over the containers in the pod
-        for container in resource["containers"]:
-            # Retrieve CPU usage value
-            cpu_str = container["usage"].get("cpu", 0)
-            # Add the CPU usage of the container to the total
-            if cpu_str.endswith("n"):
-                cpu_usage += float(cpu_str.rstrip("n")) / 1000000
-            else:
-                print(f"Could not parse CPU usage value: {cpu_str}")
-            # Retrieve Memory usage value
-            memory_str = container["usage"].get("memory", 0)
-            # Add the memory usage of the container to the total
-            if memory_str.endswith("Ki"):
-                memory_usage += float(memory_str.rstrip("Ki")) / 1000
-            elif memory_str.endswith("Mi"):
-                memory_usage += float(memory_str.rstrip("Mi"))
-            else:
-                print(f"Could not parse memory usage value: {memory_str}")
-        
-        # Return the CPU and memory usage
-        return cpu_usage, memory_usage
+        # Parse the usages of all the pods at once
+        keys, cpu_usages, memory_usages, errors = usage_arrays(resource["items"])
+        for error in errors:
+            print(f"Could not parse usage value: {error}")
+        return {pod_name: usage for (_, pod_name), usage in zip(keys, zip(cpu_usages.tolist(), memory_usages.tolist()))}
     except Exception as e:
         print(e)
-        return None, None
+        return None
 
 def main():
     """
@@ -64,10 +44,12 @@ def main():
     parser.add_argument("--namespace", type=str, default="default", help="The namespace of the deployment")
     parser.add_argument("--deployment_name", type=str, required=False, help="The name of the deployment")
     parser.add_argument("--kubeconfig", type=str, default="kube_config.yaml", help="The kubernetes cluster configuration file name")
-    parser.add_argument("--sleep_time", type=int, default=15, help="The sleep time between metrics requests")
+    parser.add_argument("--sleep_time", type=float, default=15, help="The time between the starts of two metrics requests, in seconds")
     parser.add_argument("--observation_time", type=int, default=300, help="The time to observe metrics, in seconds")
     parser.add_argument("--append", action='store_true', help="Append to the existing output files")
     parser.add_argument("--all_pods", action='store_true', help="Retrieve metrics for all pods regardless of the deployment")
+    parser.add_argument("--store", type=str, help="Write the metrics to this metrics store directory instead of one CSV file per pod")
+    parser.add_argument("--run", type=str, help="The run id in the metrics store, the start time if not given")
     args = parser.parse_args()
 
     # Retrieve the values of the command-line arguments
@@ -78,49 +60,88 @@ def main():
     observation_time = args.observation_time
     all_pods = args.all_pods
 
+    if deployment_name is None and not all_pods:
+        raise Exception("Either provide a deployment name or use the --all_pods option to get metrics for all pods.")
+
     config.load_kube_config(config_file=kubeconfig)
-    
-    # Create an instance of the CoreV1Api
-    api = client.CoreV1Api()
 
-    # Get all the pods in the namespace
-    pods = api.list_namespaced_pod(namespace).items
+    # Share one pooled API client between all the API objects
+    api_client = create_api_client()
+    custom_api = client.CustomObjectsApi(api_client)
+    core_api = client.CoreV1Api(api_client)
+    apps_api = client.AppsV1Api(api_client)
 
-    # If --all_pods is not specified, filter the pods to include only those belonging to the specified deployment
-    if not all_pods and deployment_name is not None:
-        pods = [pod for pod in pods if pod.metadata.name.startswith(deployment_name)]
-    elif deployment_name is None and not all_pods:
-        raise Exception("Either provide a deployment name or use the --all_pods option to get metrics for all pods.")
+    # Follow the pods with a watch, so that the pods created by a scale-out are sampled from their first metrics
+    index = PodIndex([(namespace, deployment_name)])
+    pod_watcher = ResourceWatcher(core_api.list_namespaced_pod, on_change=index.on_pod, name="watch-pods", namespace=namespace)
+    watchers = [pod_watcher]
+    if not all_pods:
+        # The deployment selector tells which pods belong to the deployment
+        watchers.append(ResourceWatcher(apps_api.list_namespaced_deployment, on_change=index.on_deployment, name="watch-deployment", namespace=namespace, field_selector="metadata.name={}".format(deployment_name)))
+    for watcher in watchers:
+        watcher.start()
 
     # Determine the mode in which to open the files (append or write)
     mode = "a" if args.append else "w"
+    store = MetricsStore(args.store, run=args.run) if args.store else None
+    # Pod name -> (file, writer), each file is opened once for the whole run
+    outputs = {}
 
     # Calculate the number of iterations needed to observe metrics for the specified time
-    iterations = observation_time // sleep_time
-
-    # Loop for the number of iterations, retrieving metrics for each pod and writing them to the file
-    for i in range(iterations):
-        for pod in pods:
-            cpu_usage, memory_usage = get_pod_metrics(namespace, pod.metadata.name)
-            # Check if CPU usage or memory usage is None
-            if cpu_usage is None or memory_usage is None:
-                print(f"Failed to retrieve metrics for pod {pod.metadata.name}, retrying in {sleep_time} seconds")
+    iterations = int(observation_time // sleep_time)
+
+    # Sample on a fixed-rate clock, so that the sweep period does not grow with the number of pods
+    clock = FixedRateClock(sleep_time)
+
+    try:
+        # Loop for the number of iterations, retrieving the metrics of all the pods with one call and writing one row per pod
+        for i in range(iterations):
+            # All the rows of a sweep share the same timestamp
+            timestamp = time.time()
+            metrics = get_pods_metrics(custom_api, namespace)
+            if metrics is None:
+                print(f"Failed to retrieve metrics, retrying in {sleep_time} seconds")
+                clock.wait()
+                continue
+            if all_pods:
+                pod_names = [pod.metadata.name for pod in pod_watcher.items()]
             else:
+                pod_names = [pod.metadata.name for pod in pod_watcher.items() if index.deployment_of(namespace, pod.metadata.name) is not None]
+            rows = {}
+            for pod_name in sorted(pod_names):
+                if pod_name not in metrics:
+                    # A new pod has no metrics until the metrics server scrapes it
+                    print(f"No metrics yet for pod {pod_name}")
+                    continue
+                cpu_usage, memory_usage = metrics[pod_name]
                 # Create a dictionary with the metrics
-                row = {
-                    "timestamp": time.time(),
+                rows[pod_name] = {
+                    "timestamp": timestamp,
                     "cpu_usage": cpu_usage,
                     "memory_usage": memory_usage,
                 }
-                filename = f"{pod.metadata.name}_metrics.csv"
-                with open(filename, mode) as f:
-                    writer = csv.DictWriter(f, fieldnames=row.keys())
-                    if mode == "w":
-                        writer.writeheader()
+            if store is not None:
+                store.append("pod_metrics", [dict(row, namespace=namespace, deployment=deployment_name if index.deployment_of(namespace, pod_name) else None, pod=pod_name) for pod_name, row in rows.items()])
+            else:
+                for pod_name, row in rows.items():
+                    output = outputs.get(pod_name)
+                    if output is None:
+                        output_file = open(f"{pod_name}_metrics.csv", mode, newline="")
+                        output = outputs[pod_name] = (output_file, csv.DictWriter(output_file, fieldnames=row.keys()))
+                        if output_file.tell() == 0:
+                            output[1].writeheader()
                     # Write the metrics to the file
-                    writer.writerow(row)
-                    print(f"Wrote metrics to file for pod {pod.metadata.name}: {row}")
-            time.sleep(sleep_time)
+                    output[1].writerow(row)
+                    output[0].flush()
+            print(f"Wrote metrics for {len(rows)} pods at {timestamp}")
+            clock.wait()
+        if clock.missed:
+            print(f"Skipped {clock.missed} sweeps that took longer than {sleep_time} seconds")
+    finally:
+        if store is not None:
+            store.close()
+        for output_file, _ in outputs.values():
+            output_file.close()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,238 @@
+import re
+from functools import lru_cache
+
+import numpy as np
+
+# <signed number><suffix>, the suffix being a binary SI unit, a decimal SI unit or a decimal exponent
+QUANTITY = re.compile(r"^([+-]?)([0-9]*)(?:\.([0-9]*))?(?:([eE][+-]?[0-9]+)|(Ki|Mi|Gi|Ti|Pi|Ei|[numkMGTPE]))?$")
+
+# Lines of up to 15 digits (exact as float64)
+DIGIT_LINES = re.compile(r"(?:[0-9]{1,15}\n)*[0-9]{1,15}")
+
+# Suffix -> (power of 10, power of 2)
+SUFFIXES = {
+    None: (0, 0),
+    "n": (-9, 0), "u": (-6, 0), "m": (-3, 0),
+    "k": (3, 0), "M": (6, 0), "G": (9, 0), "T": (12, 0), "P": (15, 0), "E": (18, 0),
+    "Ki": (0, 10), "Mi": (0, 20), "Gi": (0, 30), "Ti": (0, 40), "Pi": (0, 50), "Ei": (0, 60),
+}
+
+
+class QuantityError(ValueError):
+    """
+    Raised for strings that are not Kubernetes quantities.
+    """
+
+
+def split_quantity(quantity):
+    """
+    Split a Kubernetes quantity into an integer mantissa and its powers of 10 and 2.
+
+    Parameters:
+        quantity (str): The quantity, e.g. "12345678n", "250m", "1.5Gi", "128974848", "1e3".
+
+    Returns:
+        tuple: (mantissa, power of 10, power of 2), with quantity = mantissa * 10**power10 * 2**power2.
+    """
+    if not isinstance(quantity, str):
+        raise QuantityError("Invalid quantity: {!r}".format(quantity))
+    # Fast path for the forms of the metrics server: digits followed by an optional suffix ("12345678n", "81920Ki")
+    suffix = quantity.lstrip("0123456789")
+    powers = SUFFIXES.get(suffix or None)
+    if powers is not None and len(suffix) < len(quantity):
+        return int(quantity[:len(quantity) - len(suffix)]), powers[0], powers[1]
+    match = QUANTITY.fullmatch(quantity)
+    if match is None or not (match[2] or match[3]):
+        raise QuantityError("Invalid quantity: {!r}".format(quantity))
+    sign, integer, fraction, exponent, suffix = match.groups()
+    fraction = fraction or ""
+    mantissa = int(integer + fraction or "0")
+    power10, power2 = SUFFIXES[suffix]
+    power10 += int(exponent[1:]) if exponent else 0
+    return (-mantissa if sign == "-" else mantissa), power10 - len(fraction), power2
+
+
+@lru_cache(maxsize=None)
+def _power_of_ten(exponent):
+    return 10 ** exponent
+
+
+@lru_cache(maxsize=65536)
+def scaled_quantity(quantity, power10=0, power2=0):
+    """
+    Return a quantity divided by 10**power10 * 2**power2, as a correctly rounded float.
+
+    The result is computed with integers and rounded once, so "1Ki" in units
+    of 2**10 is exactly 1.0 and "100m" in units of 10**-3 exactly 100.0.
+    Results are memoized: metrics responses repeat the same strings.
+
+    Parameters:
+        quantity (str): The quantity.
+        power10 (int): The power of 10 of the unit.
+        power2 (int): The power of 2 of the unit.
+
+    Returns:
+        float: The quantity in the unit.
+    """
+    mantissa, quantity_power10, quantity_power2 = split_quantity(quantity)
+    power10 = quantity_power10 - power10
+    power2 = quantity_power2 - power2
+    if power10 >= 0:
+        numerator, denominator = mantissa * _power_of_ten(power10), 1
+    else:
+        numerator, denominator = mantissa, _power_of_ten(-power10)
+    if power2 >= 0:
+        numerator <<= power2
+    else:
+        denominator <<= -power2
+    # int / int is correctly rounded
+    return numerator / denominator
+
+
+def parse_quantity(quantity):
+    """
+    Return a quantity in its base unit (cores or bytes).
+    """
+    return scaled_quantity(quantity)
+
+
+def cpu_millicores(quantity):
+    """
+    Return a CPU quantity in millicores.
+    """
+    return scaled_quantity(quantity, -3, 0)
+
+
+def memory_mib(quantity):
+    """
+    Return a memory quantity in MiB (2**20 bytes).
+    """
+    return scaled_quantity(quantity, 0, 20)
+
+
+def parse_quantities(quantities, power10=0, power2=0, errors=None):
+    """
+    Convert a list of quantities to an array in a unit, vectorized.
+
+    The quantities of the metrics server form (digits and a suffix) are
+    grouped by suffix and converted by numpy with a single rounding, like
+    scaled_quantity. The other forms go through scaled_quantity.
+
+    Parameters:
+        quantities (list): The quantities.
+        power10 (int): The power of 10 of the unit.
+        power2 (int): The power of 2 of the unit.
+        errors (list): If given, the invalid quantities count as 0 and their error messages are appended to it.
+            Otherwise QuantityError is raised.
+
+    Returns:
+        numpy.ndarray: The float64 values in the unit.
+    """
+    if not quantities:
+        return np.empty(0, dtype=np.float64)
+    values = _parse_uniform(quantities, power10, power2)
+    if values is not None:
+        return values
+    values = np.empty(len(quantities), dtype=np.float64)
+    # suffix -> (indices, digits)
+    groups = {}
+    others = []
+    for i, quantity in enumerate(quantities):
+        last = quantity[-1:] if isinstance(quantity, str) else ""
+        suffix = "" if last.isdigit() else quantity[-2:] if last == "i" else last
+        digits = quantity[:len(quantity) - len(suffix)] if last else ""
+        # Up to 15 digits are exact as float64
+        if digits.isascii() and digits.isdigit() and len(digits) <= 15 and (suffix or None) in SUFFIXES:
+            group = groups.get(suffix)
+            if group is None:
+                group = groups[suffix] = ([], [])
+            group[0].append(i)
+            group[1].append(digits)
+        else:
+            others.append(i)
+    for suffix, (indices, digits) in groups.items():
+        group_power10 = SUFFIXES[suffix or None][0] - power10
+        group_power2 = SUFFIXES[suffix or None][1] - power2
+        if group_power10 and group_power2 or abs(group_power10) > 22:
+            # Two roundings, or a power of 10 that is not exact as float64
+            others.extend(indices)
+            continue
+        values[indices] = _scale(np.array(digits, dtype=np.float64), group_power10, group_power2)
+    for i in others:
+        try:
+            values[i] = scaled_quantity(quantities[i], power10, power2)
+        except QuantityError as e:
+            if errors is None:
+                raise
+            errors.append(str(e))
+            values[i] = 0.0
+    return values
+
+
+def _scale(mantissas, power10, power2):
+    """
+    Multiply exact float64 mantissas by 10**power10 or 2**power2 (not both), with a single rounding.
+    """
+    if power10 > 0:
+        mantissas *= 10.0 ** power10
+    elif power10 < 0:
+        mantissas /= 10.0 ** -power10
+    return np.ldexp(mantissas, power2) if power2 else mantissas
+
+
+def _parse_uniform(quantities, power10, power2):
+    """
+    Convert quantities that are all digits with the same suffix (the usual metrics response) with a few passes over one string.
+
+    Returns:
+        numpy.ndarray: The values, or None if the quantities are not of that form.
+    """
+    if not all(isinstance(quantity, str) for quantity in quantities):
+        return None
+    suffix = quantities[0].lstrip("0123456789")
+    powers = SUFFIXES.get(suffix or None)
+    if powers is None or (powers[0] - power10) and (powers[1] - power2) or abs(powers[0] - power10) > 22:
+        return None
+    text = "\n".join(quantities)
+    if text.count("\n") != len(quantities) - 1:
+        return None
+    if suffix:
+        if text.count(suffix + "\n") != len(quantities) - 1 or not text.endswith(suffix):
+            return None
+        text = text.replace(suffix + "\n", "\n")[:-len(suffix)]
+    if DIGIT_LINES.fullmatch(text) is None:
+        return None
+    return _scale(np.array(text.split("\n"), dtype=np.float64), powers[0] - power10, powers[1] - power2)
+
+
+def usage_arrays(items):
+    """
+    Convert the items of a pod metrics list response to arrays, in one pass.
+
+    The usages of the containers of a pod are summed. Unparsable or missing
+    usages count as 0 and are reported in the errors list.
+
+    Parameters:
+        items (list): The "items" of a metrics.k8s.io pods list.
+
+    Returns:
+        tuple: The (namespace, pod name) keys, the CPU usages in millicores and the memory usages in MiB
+            (two float64 arrays aligned with the keys), and the error messages.
+    """
+    keys = []
+    owners = []
+    cpu_strings = []
+    memory_strings = []
+    for i, pod in enumerate(items):
+        keys.append((pod["metadata"].get("namespace"), pod["metadata"]["name"]))
+        for container in pod["containers"]:
+            usage = container["usage"]
+            owners.append(i)
+            cpu_strings.append(usage.get("cpu", "0"))
+            memory_strings.append(usage.get("memory", "0"))
+    errors = []
+    cpu = parse_quantities(cpu_strings, -3, 0, errors)
+    memory = parse_quantities(memory_strings, 0, 20, errors)
+    # Sum the containers of each pod
+    owners = np.asarray(owners, dtype=np.intp)
+    return keys, np.bincount(owners, weights=cpu, minlength=len(keys)), np.bincount(owners, weights=memory, minlength=len(keys)), errors
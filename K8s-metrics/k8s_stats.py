@@ -2,181 +2,393 @@ import argparse
 import time
 import csv
 import os
+from concurrent.futures import ThreadPoolExecutor
 
 # Import the kubernetes client library
 from kubernetes import client, config
 
-def get_metrics(namespace, deployment_name):
+from k8s_collector import FixedRateClock, LabelCache, PodIndex, ResourceWatcher, create_api_client
+from k8s_quantity import usage_arrays
+from metrics_store import TABLE_COLUMNS, MetricsStore
+
+def parse_targets(deployment_names, default_namespace):
     """
-    Retrieve the average CPU and memory usage for a deployment.
-    
+    Parse the deployments to track.
+
     Parameters:
-        namespace (str): The namespace of the deployment.
-        deployment_name (str): The name of the deployment.
-    
+        deployment_names (list): Deployment names, optionally prefixed by their namespace ("namespace/name").
+        default_namespace (str): The namespace of the names without prefix.
+
     Returns:
-        tuple: A tuple containing the average CPU usage and average memory usage.
+        list: The (namespace, deployment name) pairs, in the given order.
     """
-    # Create an instance of the CustomObjectsApi
-    api = client.CustomObjectsApi()
-    
-    try:
-        # Get the custom resource for pods in the specified namespace
-        resource = api.list_namespaced_custom_object(
-            group="metrics.k8s.io", version="v1beta1", namespace=namespace, plural="pods"
-        )
-        
-        # Initialize the CPU and memory usage
-        cpu_usage = 0
-        memory_usage = 0
-        
-        # Iterate over the pods
-        for pod in resource["items"]:
-            # Check if the pod name starts with the deployment name
-            if pod['metadata']['name'].startswith(deployment_name):
-                # Iterate over the containers in the pod
-                for container in pod["containers"]:
-                    # Retrieve CPU usage value
-                    cpu_str = container["usage"].get("cpu", 0)
-                    # Add the CPU usage of the container to the total
-                    if cpu_str.endswith("n"):
-                        cpu_usage += float(cpu_str.rstrip("n")) / 1000000
-                    else:
-                        print(f"Could not parse CPU usage value: {cpu_str}")
-                    # Retrieve Memory usage value
-                    memory_str = container["usage"].get("memory", 0)
-                    # Add the memory usage of the container to the total
-                    if memory_str.endswith("Ki"):
-                        memory_usage += float(memory_str.rstrip("Ki")) / 1000
-                    elif memory_str.endswith("Mi"):
-                        memory_usage += float(memory_str.rstrip("Mi"))
-                    else:
-                        print(f"Could not parse memory usage value: {memory_str}")
-        
-        # Return the average CPU and memory usage
-        return cpu_usage / len(resource["items"]), memory_usage / len(resource["items"])
-    except Exception as e:
-        print(e)
-        return None, None
+    targets = []
+    for deployment_name in deployment_names:
+        namespace, _, name = deployment_name.rpartition("/")
+        target = (namespace or default_namespace, name)
+        if target not in targets:
+            targets.append(target)
+    return targets
+
+def scoped(namespaced_function, cluster_function, namespaces):
+    """
+    Choose the list function covering the namespaces: the namespaced one for a single namespace, the cluster-wide one otherwise.
 
-def get_hpa_cpu_threshold(namespace, deployment_name):
+    Returns:
+        tuple: The list function and its keyword arguments.
     """
-    Retrieve the CPU utilization threshold for an HPA.
-    
+    if len(namespaces) == 1:
+        return namespaced_function, {"namespace": next(iter(namespaces))}
+    return cluster_function, {}
+
+def list_pod_metrics(api, namespaces):
+    """
+    Retrieve the metrics of all the pods of the namespaces with a single API call.
+
     Parameters:
-        namespace (str): The namespace of the deployment.
-        deployment_name (str): The name of the deployment.
-    
+        api (CustomObjectsApi): The API object to use.
+        namespaces (set): The namespaces of the tracked deployments.
+
     Returns:
-        float: The CPU utilization threshold.
+        list: The pod metrics items, or None if the call failed.
     """
-    # Create an instance of the AutoscalingV2Api
-    api = client.AutoscalingV2Api()
-    
     try:
-        # Get the HorizontalPodAutoscaler for the deployment
-        hpa = api.read_namespaced_horizontal_pod_autoscaler(
-            name=deployment_name, namespace=namespace
-        )
-        #print("hpa:", hpa)  # Debugging line
-        # Get the CPU utilization threshold from the HPA
-        if hpa.spec.metrics and hpa.spec.metrics[0].type == "Resource":
-            hpa_cpu_threshold = hpa.spec.metrics[0].resource.target.average_utilization
+        if len(namespaces) == 1:
+            resource = api.list_namespaced_custom_object(
+                group="metrics.k8s.io", version="v1beta1", namespace=next(iter(namespaces)), plural="pods"
+            )
         else:
-            hpa_cpu_threshold = None
-        
-        #print("hpa_cpu_threshold:", hpa_cpu_threshold)  # Debugging line
-        
-        return hpa_cpu_threshold
+            resource = api.list_cluster_custom_object(group="metrics.k8s.io", version="v1beta1", plural="pods")
+        return [pod for pod in resource["items"] if pod["metadata"]["namespace"] in namespaces]
     except Exception as e:
         print(e)
         return None
 
-def get_replicas(namespace, deployment_name):
+def get_pod_samples(pod_metrics, index, node_types):
+    """
+    Join the metrics of the pods of the tracked deployments with their node and the node type.
+
+    Parameters:
+        pod_metrics (list): The pod metrics items.
+        index (PodIndex): The index attributing the pods to the deployments and the nodes.
+        node_types (LabelCache): The node-type label of the nodes.
+
+    Returns:
+        list: One dictionary per pod, with the namespace, deployment, pod, node, node_type, cpu_usage and memory_usage keys.
+    """
+    # Parse the usages of all the pods at once
+    keys, cpu_usages, memory_usages, errors = usage_arrays(pod_metrics)
+    for error in errors:
+        print("Could not parse usage value: {}".format(error))
+    samples = []
+    for (namespace, pod_name), cpu_usage, memory_usage in zip(keys, cpu_usages.tolist(), memory_usages.tolist()):
+        target = index.deployment_of(namespace, pod_name)
+        if target is None:
+            continue
+        node = index.node_of(namespace, pod_name)
+        samples.append({
+            "namespace": namespace,
+            "deployment": target[1],
+            "pod": pod_name,
+            "node": node,
+            "node_type": node_types.get(node),
+            "cpu_usage": cpu_usage,
+            "memory_usage": memory_usage
+        })
+    return samples
+
+def cloud_columns(clouds):
+    """
+    Return the per-cloud columns of the deployment metrics, e.g. cpu_usage_avg_on_prem.
+    """
+    columns = []
+    for cloud in clouds:
+        suffix = cloud.replace("-", "_")
+        columns += ["cpu_usage_avg_" + suffix, "memory_usage_avg_" + suffix, "pods_" + suffix]
+    return columns
+
+def get_metrics(samples, clouds):
+    """
+    Calculate the average CPU and memory usage of every tracked deployment, overall and per cloud.
+
+    Parameters:
+        samples (list): The pod samples returned by get_pod_samples.
+        clouds (list): The node types to roll up separately (e.g. on-prem and burst).
+
+    Returns:
+        dict: (namespace, deployment name) -> metrics dictionary, for the deployments with at least one pod.
+            The averages of a cloud without pods are None.
+    """
+    # (namespace, deployment name) -> group (None for all the pods, or a cloud) -> [CPU usage, memory usage, pods]
+    totals = {}
+    for sample in samples:
+        groups = totals.setdefault((sample["namespace"], sample["deployment"]), {})
+        for group in (None, sample["node_type"]):
+            if group is not None and group not in clouds:
+                continue
+            total = groups.setdefault(group, [0, 0, 0])
+            total[0] += sample["cpu_usage"]
+            total[1] += sample["memory_usage"]
+            total[2] += 1
+    metrics = {}
+    for target, groups in totals.items():
+        # Average over the pods of the deployment only
+        cpu_usage, memory_usage, pods = groups[None]
+        row = {"cpu_usage_avg": cpu_usage / pods, "memory_usage_avg": memory_usage / pods}
+        for cloud in clouds:
+            suffix = cloud.replace("-", "_")
+            cpu_usage, memory_usage, pods = groups.get(cloud, (0, 0, 0))
+            row["cpu_usage_avg_" + suffix] = cpu_usage / pods if pods else None
+            row["memory_usage_avg_" + suffix] = memory_usage / pods if pods else None
+            row["pods_" + suffix] = pods
+        metrics[target] = row
+    return metrics
+
+def hpa_cpu_threshold_of(hpa):
+    """
+    Return the CPU utilization threshold of an HPA object, or None.
+    """
+    if hpa is not None and hpa.spec.metrics and hpa.spec.metrics[0].type == "Resource":
+        return hpa.spec.metrics[0].resource.target.average_utilization
+    return None
+
+def get_hpa_cpu_thresholds(hpas):
+    """
+    Map the HPAs to the deployments they scale.
+
+    Parameters:
+        hpas (list): The HPA objects.
+
+    Returns:
+        dict: (namespace, deployment name) -> CPU utilization threshold.
+    """
+    thresholds = {}
+    for hpa in hpas:
+        target = hpa.spec.scale_target_ref
+        if target.kind == "Deployment":
+            thresholds[(hpa.metadata.namespace, target.name)] = hpa_cpu_threshold_of(hpa)
+    return thresholds
+
+def get_replicas(deployments):
+    """
+    Return the replicas of the deployments as a (namespace, deployment name) -> replicas dictionary.
+    """
+    return {(deployment.metadata.namespace, deployment.metadata.name): deployment.spec.replicas for deployment in deployments}
+
+def sample_polling(executor, lists, custom_api, index, node_types, namespaces):
     """
-    Retrieve the current replicas number for a deployment.
-    
+    Retrieve the pod metrics, the pods, the deployments, the HPAs and the nodes with five concurrent API calls, whatever the number of deployments.
+
     Parameters:
-        namespace (str): The namespace of the deployment.
-        deployment_name (str): The name of the deployment.
-    
+        executor (ThreadPoolExecutor): The thread pool running the calls.
+        lists (dict): The (list function, keyword arguments) of the pods, the deployments, the HPAs and the nodes.
+        custom_api (CustomObjectsApi): The API object used for the metrics.
+        index (PodIndex): The index attributing the pods to the deployments, rebuilt from the lists.
+        node_types (LabelCache): The node-type label of the nodes, rebuilt from the list.
+        namespaces (set): The namespaces of the tracked deployments.
+
     Returns:
-        int: The current replicas number.
+        tuple: The pod samples, the HPA CPU thresholds and the replicas dictionaries, or None if a call failed.
     """
-    # Create an instance of the AppsV1Api
-    api = client.AppsV1Api()
-    
+    pod_metrics = executor.submit(list_pod_metrics, custom_api, namespaces)
+    results = {name: executor.submit(function, **kwargs) for name, (function, kwargs) in lists.items()}
     try:
-        # Get the deployment
-        deployment = api.read_namespaced_deployment(
-            name=deployment_name, namespace=namespace
-        )
-        # Get the current replicas number from the deployment
-        replicas = deployment.spec.replicas
-        
-        return replicas
+        pods, deployments, hpas, nodes = (results[name].result().items for name in ("pods", "deployments", "hpas", "nodes"))
     except Exception as e:
         print(e)
         return None
+    if pod_metrics.result() is None:
+        return None
+    index.rebuild(deployments, pods)
+    node_types.rebuild(nodes)
+    return get_pod_samples(pod_metrics.result(), index, node_types), get_hpa_cpu_thresholds(hpas), get_replicas(deployments)
+
+def sample_watching(custom_api, index, node_types, deployment_watcher, hpa_watcher, namespaces):
+    """
+    Retrieve the pod metrics with one API call, and everything else from the watch streams.
+
+    Parameters:
+        custom_api (CustomObjectsApi): The API object used for the metrics.
+        index (PodIndex): The index attributing the pods to the deployments and the nodes, fed by the pod watch.
+        node_types (LabelCache): The node-type label of the nodes, fed by the node watch.
+        deployment_watcher (ResourceWatcher): The watcher of the deployments.
+        hpa_watcher (ResourceWatcher): The watcher of the HPAs.
+        namespaces (set): The namespaces of the tracked deployments.
+
+    Returns:
+        tuple: The pod samples, the HPA CPU thresholds and the replicas dictionaries, or None if the call failed.
+    """
+    pod_metrics = list_pod_metrics(custom_api, namespaces)
+    if pod_metrics is None:
+        return None
+    return get_pod_samples(pod_metrics, index, node_types), get_hpa_cpu_thresholds(hpa_watcher.items()), get_replicas(deployment_watcher.items())
+
+def open_csv(filename, headers, append):
+    """
+    Open a CSV output file and write its header if the file is new or truncated.
+
+    When appending to an existing file its header is kept, and the columns it lacks are not written.
+
+    Parameters:
+        filename (str): The output file name.
+        headers (list): The columns to write.
+        append (bool): Append to the existing file instead of truncating it.
+
+    Returns:
+        tuple: The open file and its DictWriter.
+    """
+    if append:
+        try:
+            with open(filename, newline="") as f:
+                previous_headers = next(csv.reader(f), None)
+        except FileNotFoundError:
+            previous_headers = None
+        if previous_headers:
+            missing = [header for header in headers if header not in previous_headers]
+            if missing:
+                print("The existing file {} has no {} columns, they will not be written".format(filename, ", ".join(missing)))
+            headers = previous_headers
+    f = open(filename, "a" if append else "w", newline="")
+    writer = csv.DictWriter(f, fieldnames=headers, extrasaction="ignore")
+    if f.tell() == 0:
+        writer.writeheader()
+    return f, writer
 
 def main():
     """
-    Main function to retrieve metrics for a Kubernetes deployment.
+    Main function to retrieve metrics for Kubernetes deployments.
     """
     # Define the command-line arguments
-    parser = argparse.ArgumentParser(description="Retrieve metrics for a Kubernetes deployment")
-    parser.add_argument("--namespace", type=str, default="default", help="The namespace of the deployment")
-    parser.add_argument("--deployment_name", type=str, required=True, help="The name of the deployment")
+    parser = argparse.ArgumentParser(description="Retrieve metrics for Kubernetes deployments")
+    parser.add_argument("--namespace", type=str, default="default", help="The namespace of the deployments given without namespace")
+    parser.add_argument("--deployment_name", type=str, nargs="+", required=True, help="The names of the deployments, optionally as namespace/name")
     parser.add_argument("--filename", type=str, default="deployment_metrics.csv", help="The output file name")
+    parser.add_argument("--pod_filename", type=str, default="pod_metrics.csv", help="The output file name of the per-pod metrics, empty to disable them")
+    parser.add_argument("--node_label", type=str, default="node-type", help="The node label telling the cloud of a node")
+    parser.add_argument("--clouds", type=str, nargs="+", default=["on-prem", "burst"], help="The values of the node label rolled up separately")
     parser.add_argument("--kubeconfig", type=str, default="kube_config.yaml", help="The kubernetes cluster configuration file name")
-    parser.add_argument("--sleep_time", type=int, default=15, help="The sleep time between metrics requests")
+    parser.add_argument("--sleep_time", type=float, default=15, help="The time between the starts of two metrics requests, in seconds")
     parser.add_argument("--observation_time", type=int, default=300, help="The time to observe metrics, in seconds")
-    parser.add_argument("--append", action='store_true', help="Append to the existing output file")
+    parser.add_argument("--append", action='store_true', help="Append to the existing output files")
+    parser.add_argument("--no_watch", action='store_true', help="List the pods, the deployments, the HPAs and the nodes at every sample instead of watching them")
+    parser.add_argument("--store", type=str, help="Write the metrics to this metrics store directory instead of the CSV files")
+    parser.add_argument("--run", type=str, help="The run id in the metrics store, the start time if not given")
     args = parser.parse_args()
 
     # Retrieve the values of the command-line arguments
-    namespace = args.namespace
-    deployment_name = args.deployment_name
+    targets = parse_targets(args.deployment_name, args.namespace)
+    namespaces = {namespace for namespace, _ in targets}
     filename = args.filename
     kubeconfig = os.path.join(os.path.dirname(os.path.abspath(__file__)), args.kubeconfig)
     sleep_time = args.sleep_time
     observation_time = args.observation_time
+    clouds = args.clouds
 
     config.load_kube_config(config_file=kubeconfig)
 
-    # Define the headers for the output file
-    headers = ["timestamp", "cpu_usage_avg", "memory_usage_avg", "hpa_cpu_threshold", "replicas"]
-    # Determine the mode in which to open the file (append or write)
-    mode = "a" if args.append else "w"
-    with open(filename, mode) as f:
-        writer = csv.DictWriter(f, fieldnames=headers)
-        if mode == "w":
-            writer.writeheader()
-        
+    # Share one pooled API client between all the API objects
+    api_client = create_api_client()
+    custom_api = client.CustomObjectsApi(api_client)
+    autoscaling_api = client.AutoscalingV2Api(api_client)
+    apps_api = client.AppsV1Api(api_client)
+    core_api = client.CoreV1Api(api_client)
+
+    # One list per kind of object, namespaced or cluster-wide, whatever the number of deployments
+    lists = {
+        "pods": scoped(core_api.list_namespaced_pod, core_api.list_pod_for_all_namespaces, namespaces),
+        "deployments": scoped(apps_api.list_namespaced_deployment, apps_api.list_deployment_for_all_namespaces, namespaces),
+        "hpas": scoped(autoscaling_api.list_namespaced_horizontal_pod_autoscaler, autoscaling_api.list_horizontal_pod_autoscaler_for_all_namespaces, namespaces),
+        "nodes": (core_api.list_node, {}),
+    }
+    if len(targets) == 1:
+        # A single deployment can be selected by the server
+        lists["deployments"][1]["field_selector"] = "metadata.name={}".format(targets[0][1])
+    index = PodIndex(targets)
+    node_types = LabelCache(args.node_label)
+
+    if args.no_watch:
+        executor = ThreadPoolExecutor(max_workers=5)
+        sample = lambda: sample_polling(executor, lists, custom_api, index, node_types, namespaces)
+    else:
+        # Pods, deployments, HPAs and nodes change much less often than the metrics: watch them instead of listing them at every sample
+        function, kwargs = lists["deployments"]
+        deployment_watcher = ResourceWatcher(function, on_change=index.on_deployment, name="watch-deployments", **kwargs)
+        function, kwargs = lists["pods"]
+        pod_watcher = ResourceWatcher(function, on_change=index.on_pod, name="watch-pods", **kwargs)
+        function, kwargs = lists["hpas"]
+        hpa_watcher = ResourceWatcher(function, name="watch-hpas", **kwargs)
+        function, kwargs = lists["nodes"]
+        node_watcher = ResourceWatcher(function, on_change=node_types.on_change, name="watch-nodes", **kwargs)
+        for watcher in (deployment_watcher, pod_watcher, hpa_watcher, node_watcher):
+            watcher.start()
+        sample = lambda: sample_watching(custom_api, index, node_types, deployment_watcher, hpa_watcher, namespaces)
+
+    # Define the headers for the output files
+    headers = TABLE_COLUMNS["deployment_metrics"] + cloud_columns(clouds)
+    pod_headers = TABLE_COLUMNS["pod_metrics"]
+    if args.store:
+        store = MetricsStore(args.store, run=args.run)
+        print("Writing metrics to the store {}, run {}".format(args.store, store.run))
+        write_rows = store.append
+    else:
+        store = None
+        f, writer = open_csv(filename, headers, args.append)
+        pod_file, pod_writer = open_csv(args.pod_filename, pod_headers, args.append) if args.pod_filename else (None, None)
+        def write_rows(table, rows):
+            output_file, output_writer = (f, writer) if table == "deployment_metrics" else (pod_file, pod_writer)
+            if output_writer is not None:
+                output_writer.writerows(rows)
+                output_file.flush()
+    try:
         # Calculate the number of iterations needed to observe metrics for the specified time
-        iterations = observation_time // sleep_time
+        iterations = int(observation_time // sleep_time)
 
-        # Loop for the number of iterations, retrieving metrics and writing them to the file
+        # Sample on a fixed-rate clock, so that the time spent sampling does not delay the next sample
+        clock = FixedRateClock(sleep_time)
+
+        # Loop for the number of iterations, retrieving metrics and writing them to the files
         for i in range(iterations):
-            cpu_usage, memory_usage = get_metrics(namespace, deployment_name)
-            hpa_cpu_threshold = get_hpa_cpu_threshold(namespace, deployment_name)
-            replicas = get_replicas(namespace, deployment_name)
-            # Check if CPU usage, memory usage, HPA CPU threshold, or replicas is None
-            if cpu_usage is None or memory_usage is None or hpa_cpu_threshold is None or replicas is None:
+            timestamp = time.time()
+            sampled = sample()
+            if sampled is None:
                 print("Failed to retrieve metrics, retrying in {} seconds".format(sleep_time))
-            else:
+                clock.wait()
+                continue
+            samples, hpa_cpu_thresholds, replicas = sampled
+            write_rows("pod_metrics", [dict(pod_sample, timestamp=timestamp, hpa_cpu_threshold=hpa_cpu_thresholds.get((pod_sample["namespace"], pod_sample["deployment"]))) for pod_sample in samples])
+            metrics = get_metrics(samples, clouds)
+            rows = []
+            for namespace, deployment_name in targets:
+                deployment_metrics = metrics.get((namespace, deployment_name))
+                hpa_cpu_threshold = hpa_cpu_thresholds.get((namespace, deployment_name))
+                deployment_replicas = replicas.get((namespace, deployment_name))
+                # Check if the usage, the HPA CPU threshold, or the replicas is None
+                if deployment_metrics is None or hpa_cpu_threshold is None or deployment_replicas is None:
+                    print("Failed to retrieve metrics for {}/{}, retrying in {} seconds".format(namespace, deployment_name, sleep_time))
+                    continue
                 # Create a dictionary with the metrics
                 row = {
-                    "timestamp": time.time(),
-                    "cpu_usage_avg": cpu_usage,
-                    "memory_usage_avg": memory_usage,
+                    "timestamp": timestamp,
+                    "namespace": namespace,
+                    "deployment": deployment_name,
                     "hpa_cpu_threshold": hpa_cpu_threshold,
-                    "replicas": replicas
+                    "replicas": deployment_replicas
                 }
-                # Write the metrics to the file
-                writer.writerow(row)
+                row.update(deployment_metrics)
+                rows.append(row)
                 print("Wrote metrics to file: {}".format(row))
-            time.sleep(sleep_time)
+            # Write the metrics to the file
+            write_rows("deployment_metrics", rows)
+            clock.wait()
+        if clock.missed:
+            print("Skipped {} samples that took longer than {} seconds".format(clock.missed, sleep_time))
+    finally:
+        if store is not None:
+            store.close()
+        else:
+            f.close()
+            if pod_file is not None:
+                pod_file.close()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,347 @@
+import argparse
+import json
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from jmeter_ingest import RESULTS_DTYPES, find_reports, source_key
+
+# Sketches of a results.csv file are cached next to it
+SKETCH_CACHE_NAME = "results.sketch.json"
+
+# Rows of results.csv parsed at once
+CHUNK_ROWS = 1000000
+
+
+class QuantileSketch:
+    """
+    A mergeable quantile sketch with a bounded relative error (DDSketch).
+
+    The values are counted in logarithmic bins: bin k holds the values in
+    (gamma**(k-1), gamma**k], with gamma = (1 + accuracy) / (1 - accuracy), so
+    any quantile is returned within accuracy times its true value. The bins
+    also form the histogram of the values. Non-positive values are counted
+    in a zero bin. Two sketches with the same accuracy merge exactly.
+
+    Parameters:
+        accuracy (float): The relative accuracy of the quantiles, e.g. 0.01 for 1%.
+    """
+
+    def __init__(self, accuracy=0.01):
+        self.accuracy = accuracy
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self.log_gamma = math.log(self.gamma)
+        # counts[i] is the count of bin offset + i
+        self.offset = 0
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.zero_count = 0
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def _add_bins(self, offset, counts):
+        """
+        Add the counts of the bins from offset on, growing the bin array if needed.
+        """
+        if not len(counts):
+            return
+        if not len(self.counts):
+            self.offset, self.counts = offset, counts.astype(np.int64)
+            return
+        start = min(self.offset, offset)
+        end = max(self.offset + len(self.counts), offset + len(counts))
+        if start != self.offset or end != self.offset + len(self.counts):
+            grown = np.zeros(end - start, dtype=np.int64)
+            grown[self.offset - start:self.offset - start + len(self.counts)] = self.counts
+            self.offset, self.counts = start, grown
+        self.counts[offset - self.offset:offset - self.offset + len(counts)] += counts
+
+    def add(self, values):
+        """
+        Add an array of values.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if not len(values):
+            return
+        self.count += len(values)
+        self.sum += float(values.sum())
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        positive = values[values > 0]
+        self.zero_count += len(values) - len(positive)
+        if len(positive):
+            keys = np.ceil(np.log(positive) / self.log_gamma).astype(np.int64)
+            first = int(keys.min())
+            self._add_bins(first, np.bincount(keys - first))
+
+    def merge(self, other):
+        """
+        Add the values of another sketch of the same accuracy.
+        """
+        if other.accuracy != self.accuracy:
+            raise ValueError("Cannot merge sketches of accuracy {} and {}".format(self.accuracy, other.accuracy))
+        self._add_bins(other.offset, other.counts)
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    def bin_values(self):
+        """
+        Return the representative value of every bin, within accuracy of all the values of the bin.
+        """
+        keys = np.arange(self.offset, self.offset + len(self.counts), dtype=np.float64)
+        return 2 * self.gamma ** keys / (self.gamma + 1)
+
+    def histogram(self):
+        """
+        Return the histogram of the values: the lower edges, the upper edges and the counts of the bins (the zero bin first).
+        """
+        keys = np.arange(self.offset, self.offset + len(self.counts), dtype=np.float64)
+        return np.concatenate([[-math.inf], self.gamma ** (keys - 1)]), np.concatenate([[0.0], self.gamma ** keys]), np.concatenate([[self.zero_count], self.counts])
+
+    def quantiles(self, qs):
+        """
+        Return the quantiles of the values, within the accuracy of the sketch (NaN if empty).
+        """
+        qs = np.asarray(qs, dtype=np.float64)
+        if not self.count:
+            return np.full(qs.shape, np.nan)
+        values = np.concatenate([[0.0], self.bin_values()])
+        cumulative = np.cumsum(np.concatenate([[self.zero_count], self.counts]))
+        # The rank of the quantile, as pandas and numpy (linear interpolation between the closest ranks), rounded to a sample
+        ranks = np.rint(qs * (self.count - 1))
+        return np.clip(values[np.searchsorted(cumulative, ranks, side="right")], self.min, self.max)
+
+    def quantile(self, q):
+        """
+        Return a quantile of the values, within the accuracy of the sketch.
+        """
+        return float(self.quantiles([q])[0])
+
+    def trimmed(self, low, high):
+        """
+        Return a sketch of the values between low and high (bin granularity), e.g. without the outliers.
+        """
+        trimmed = QuantileSketch(self.accuracy)
+        if not self.count:
+            return trimmed
+        values = self.bin_values()
+        kept = (values >= low) & (values <= high) & (self.counts > 0)
+        zero_count = self.zero_count if low <= 0 <= high else 0
+        if not kept.any() and not zero_count:
+            return trimmed
+        indices = np.flatnonzero(kept)
+        if len(indices):
+            trimmed.offset = self.offset + int(indices[0])
+            trimmed.counts = self.counts[indices[0]:indices[-1] + 1] * kept[indices[0]:indices[-1] + 1]
+        trimmed.zero_count = zero_count
+        trimmed.count = int(trimmed.counts.sum()) + zero_count
+        # The sum is estimated from the bin values, like the quantiles
+        trimmed.sum = float((trimmed.counts * trimmed.bin_values()).sum())
+        trimmed.min = self.min if zero_count or not len(indices) else max(self.min, float(values[indices[0]]))
+        trimmed.max = min(self.max, float(values[indices[-1]])) if len(indices) else min(self.max, 0.0)
+        return trimmed
+
+    def to_dict(self):
+        """
+        Return the sketch as a JSON serializable dictionary.
+        """
+        nonzero = np.flatnonzero(self.counts)
+        counts = self.counts[nonzero[0]:nonzero[-1] + 1] if len(nonzero) else self.counts[:0]
+        return {
+            "accuracy": self.accuracy, "offset": self.offset + (int(nonzero[0]) if len(nonzero) else 0), "counts": counts.tolist(),
+            "zero_count": self.zero_count, "count": self.count, "sum": self.sum,
+            "min": self.min if self.count else None, "max": self.max if self.count else None,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Return the sketch of a dictionary returned by to_dict.
+        """
+        sketch = cls(data["accuracy"])
+        sketch.offset = data["offset"]
+        sketch.counts = np.asarray(data["counts"], dtype=np.int64)
+        sketch.zero_count = data["zero_count"]
+        sketch.count = data["count"]
+        sketch.sum = data["sum"]
+        sketch.min = math.inf if data["min"] is None else data["min"]
+        sketch.max = -math.inf if data["max"] is None else data["max"]
+        return sketch
+
+
+def sketch_summary(sketch, quantiles):
+    """
+    Compute the statistics of draw_metrics.summarize from a sketch, within its accuracy.
+
+    The values beyond 1.5 IQR are counted as outliers and left out of the other statistics.
+
+    Parameters:
+        sketch (QuantileSketch): The sketch of the values.
+        quantiles (dict): Summary column -> quantile, like draw_metrics.QUANTILES.
+
+    Returns:
+        dict: The count, mean, min, max, quantiles, iqr and outliers.
+    """
+    q1, q3 = sketch.quantiles([0.25, 0.75])
+    iqr = q3 - q1
+    kept = sketch.trimmed(q1 - 1.5 * iqr, q3 + 1.5 * iqr)
+    summary = {"count": kept.count, "mean": kept.sum / kept.count if kept.count else np.nan, "min": kept.min if kept.count else np.nan, "max": kept.max if kept.count else np.nan}
+    summary.update(zip(quantiles, kept.quantiles(list(quantiles.values())).tolist()))
+    summary["iqr"] = summary["q3"] - summary["q1"]
+    summary["outliers"] = sketch.count - kept.count
+    return summary
+
+
+def sketch_results(path, accuracy=0.01, chunk_rows=CHUNK_ROWS, use_cache=True):
+    """
+    Fold the latencies of a JMeter results.csv file into one sketch per label and response code, reading it in chunks.
+
+    The sketches are cached in a JSON file next to the CSV file, reused as long
+    as the CSV file keeps its modification time and size.
+
+    Parameters:
+        path (str): The results.csv file.
+        accuracy (float): The relative accuracy of the sketches.
+        chunk_rows (int): The number of rows parsed at once, which bounds the memory used.
+        use_cache (bool): Whether to read and write the cache.
+
+    Returns:
+        dict: (label, response code) -> QuantileSketch.
+    """
+    cache_path = os.path.join(os.path.dirname(path), SKETCH_CACHE_NAME)
+    key = dict(source_key(path), accuracy=str(accuracy))
+    if use_cache:
+        try:
+            with open(cache_path) as f:
+                cached = json.load(f)
+            if cached["key"] == key:
+                return {(label, code): QuantileSketch.from_dict(sketch) for label, code, sketch in cached["sketches"]}
+        except (OSError, ValueError, KeyError):
+            pass
+
+    sketches = {}
+    columns = {name: RESULTS_DTYPES[name] for name in ["label", "responseCode", "Latency"]}
+    with pd.read_csv(path, usecols=list(columns), dtype=columns, chunksize=chunk_rows) as chunks:
+        for chunk in chunks:
+            for (label, code), latencies in chunk.groupby(["label", "responseCode"])["Latency"]:
+                sketches.setdefault((label, code), QuantileSketch(accuracy)).add(latencies.to_numpy())
+
+    if use_cache:
+        try:
+            temp_path = cache_path + ".tmp"
+            with open(temp_path, "w") as f:
+                json.dump({"key": key, "sketches": [[label, code, sketch.to_dict()] for (label, code), sketch in sketches.items()]}, f)
+            os.replace(temp_path, cache_path)
+        except OSError as e:
+            print("Could not cache {}: {}".format(path, e))
+    return sketches
+
+
+def _sketch_report(report, accuracy, chunk_rows, use_cache):
+    """
+    Sketch a report found by find_reports, returning the error instead of raising it (for the process pool).
+    """
+    try:
+        return sketch_results(report[2], accuracy, chunk_rows, use_cache), None
+    except (OSError, ValueError) as e:
+        return None, "Skipping {}: {}".format(report[2], e)
+
+
+def sketch_latencies(directory, thresholds=None, workers=None, accuracy=0.01, chunk_rows=CHUNK_ROWS, use_cache=True):
+    """
+    Sketch the JMeter results of every report of a directory, in parallel, merging the repetitions of each threshold.
+
+    Parameters:
+        directory (str): The directory holding the REPORT_HTML<threshold>_<repetition> directories.
+        thresholds (list): The HPA CPU thresholds to load, all of them if None.
+        workers (int): The number of processes, the number of CPUs if None. 1 sketches the files in this process.
+        accuracy (float): The relative accuracy of the sketches.
+        chunk_rows (int): The number of rows parsed at once by a process.
+        use_cache (bool): Whether to read and write the JSON caches.
+
+    Returns:
+        dict: (threshold, label, response code) -> QuantileSketch.
+    """
+    if thresholds is not None:
+        thresholds = {int(threshold) for threshold in thresholds}
+    reports = find_reports(directory, thresholds)
+    arguments = [accuracy] * len(reports), [chunk_rows] * len(reports), [use_cache] * len(reports)
+    if workers == 1 or len(reports) < 2:
+        results = list(map(_sketch_report, reports, *arguments))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_sketch_report, reports, *arguments))
+
+    merged = {}
+    for (threshold, _, _), (sketches, error) in zip(reports, results):
+        if error is not None:
+            print(error)
+            continue
+        for (label, code), sketch in sketches.items():
+            merged.setdefault((threshold, label, code), QuantileSketch(accuracy)).merge(sketch)
+    return merged
+
+
+def save_sketches(path, sketches):
+    """
+    Write sketches returned by sketch_latencies to a JSON file.
+    """
+    with open(path, "w") as f:
+        json.dump([[threshold, label, code, sketch.to_dict()] for (threshold, label, code), sketch in sorted(sketches.items())], f)
+
+
+def load_sketches(paths):
+    """
+    Read JSON files written by save_sketches, merging the sketches of the same threshold, label and response code.
+    """
+    merged = {}
+    for path in paths:
+        with open(path) as f:
+            for threshold, label, code, data in json.load(f):
+                sketch = QuantileSketch.from_dict(data)
+                if (threshold, label, code) in merged:
+                    merged[(threshold, label, code)].merge(sketch)
+                else:
+                    merged[(threshold, label, code)] = sketch
+    return merged
+
+
+def main():
+    """
+    Main function to sketch the JMeter results and print their latency percentiles.
+    """
+    # Define the command-line arguments
+    parser = argparse.ArgumentParser(description="Sketch the JMeter results and print their latency percentiles")
+    parser.add_argument("--directory", type=str, default=os.path.join("..", "JmeterLoadTest"), help="The directory of the JMeter reports")
+    parser.add_argument("--threshold", type=int, nargs="+", help="The HPA CPU thresholds to load, all of them if not given")
+    parser.add_argument("--workers", type=int, help="The number of processes, the number of CPUs if not given")
+    parser.add_argument("--accuracy", type=float, default=0.01, help="The relative accuracy of the percentiles")
+    parser.add_argument("--chunk_rows", type=int, default=CHUNK_ROWS, help="The number of rows of results.csv parsed at once")
+    parser.add_argument("--merge", type=str, nargs="+", help="Merge these sketch files instead of reading the reports")
+    parser.add_argument("--output", type=str, help="Write the sketches to this JSON file")
+    args = parser.parse_args()
+
+    if args.merge:
+        sketches = load_sketches(args.merge)
+    else:
+        sketches = sketch_latencies(args.directory, args.threshold, args.workers, args.accuracy, args.chunk_rows)
+    if args.output:
+        save_sketches(args.output, sketches)
+
+    print("{:>9} {:<30} {:<10} {:>10} {:>8} {:>8} {:>8} {:>8} {:>8}".format("threshold", "label", "code", "count", "p50", "p90", "p95", "p99", "max"))
+    for (threshold, label, code), sketch in sorted(sketches.items()):
+        p50, p90, p95, p99 = sketch.quantiles([0.5, 0.9, 0.95, 0.99])
+        print("{:>9} {:<30} {:<10} {:>10} {:>8.0f} {:>8.0f} {:>8.0f} {:>8.0f} {:>8.0f}".format(threshold, label[:30], code[:10], sketch.count, p50, p90, p95, p99, sketch.max))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+import csv
+import math
+from collections import deque
+
+from jmeter_ingest import LABEL, RESPONSE_CODE
+from latency_sketch import QuantileSketch
+
+# The deployment metrics drawn over time (the pods_<cloud> columns are added when the file has them)
+SERIES_METRICS = ["cpu_usage_avg", "memory_usage_avg", "replicas"]
+
+# The latency percentiles drawn over time
+LATENCY_PERCENTILES = {"p50": 0.50, "p95": 0.95, "p99": 0.99}
+
+
+class CsvTail:
+    """
+    Read the rows appended to a CSV file since the last read, without blocking.
+
+    The file may not exist yet, and its last line may still be being written:
+    it is kept until it ends.
+
+    Parameters:
+        filename (str): The CSV file, with a header line.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.file = None
+        self.header = None
+        self.partial = ""
+
+    def read(self, max_rows=100000):
+        """
+        Return the complete rows appended since the last read, as dictionaries, at most max_rows of them.
+        """
+        if self.file is None:
+            try:
+                self.file = open(self.filename, newline="")
+            except FileNotFoundError:
+                return []
+        lines = []
+        while len(lines) < max_rows:
+            line = self.file.readline()
+            if not line:
+                break
+            if not line.endswith("\n"):
+                self.partial += line
+                break
+            lines.append(self.partial + line)
+            self.partial = ""
+        rows = []
+        for values in csv.reader(lines):
+            if self.header is None:
+                self.header = values
+            else:
+                rows.append(dict(zip(self.header, values)))
+        return rows
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+
+class RunningStats:
+    """
+    The count, mean, variance, min and max of a stream of values, updated in O(1) per value (Welford's algorithm).
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    @property
+    def std(self):
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else 0.0
+
+
+def number(value):
+    """
+    Return a CSV field as a float, or None if it is empty or not a number.
+    """
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return None if math.isnan(value) else value
+
+
+class LiveMetrics:
+    """
+    Follow the deployment metrics written by k8s_stats.py, and optionally a JMeter results.csv, while a run goes on.
+
+    Every new sample costs O(1): it updates the running statistics of its
+    metric and HPA threshold and is appended to a bounded time series. The
+    latencies are added to a quantile sketch per time bucket; when a bucket
+    is over its percentiles are appended to the latency series, and the
+    sketch is merged into the one of the HPA threshold. The memory used is
+    bounded by window (the points kept per series) whatever the run length.
+
+    Parameters:
+        filename (str): The deployment metrics file.
+        results (str): The JMeter results.csv file, or None.
+        deployment (str): The deployment to follow, as name or namespace/name; the first one seen if None.
+        window (int): The number of points kept per time series.
+        bucket (float): The time bucket of the latency percentiles, in seconds.
+        accuracy (float): The relative accuracy of the latency percentiles.
+    """
+
+    def __init__(self, filename, results=None, deployment=None, window=2000, bucket=10, accuracy=0.01):
+        self.metrics_tail = CsvTail(filename)
+        self.results_tail = CsvTail(results) if results else None
+        self.namespace, _, self.deployment = deployment.rpartition("/") if deployment else ("", "", None)
+        self.window = window
+        self.bucket = bucket
+        self.accuracy = accuracy
+        self.start = None
+        self.threshold = None
+        # Metric -> deque of (time, value); (metric, HPA threshold) -> RunningStats
+        self.series = {metric: deque(maxlen=window) for metric in SERIES_METRICS}
+        self.stats = {}
+        # Deque of (time, HPA threshold): the changes of threshold
+        self.thresholds = deque(maxlen=window)
+        # Deque of (time, p50, p95, p99) of the latency buckets
+        self.latency_series = deque(maxlen=window)
+        self.latency = {}
+        self.errors = {}
+        self.bucket_end = None
+        self.bucket_sketch = None
+        self.bucket_values = []
+
+    def _add(self, metric, timestamp, value, threshold):
+        series = self.series.get(metric)
+        if series is None:
+            series = self.series[metric] = deque(maxlen=self.window)
+        series.append((timestamp - self.start, value))
+        stats = self.stats.get((metric, threshold))
+        if stats is None:
+            stats = self.stats[(metric, threshold)] = RunningStats()
+        stats.add(value)
+
+    def _add_sample(self, row):
+        if "deployment" in row:
+            if self.deployment is None:
+                self.namespace, self.deployment = row.get("namespace", ""), row["deployment"]
+                print("Following the deployment {}/{}".format(self.namespace, self.deployment))
+            if row["deployment"] != self.deployment or (self.namespace and row.get("namespace") not in (None, self.namespace)):
+                return
+        timestamp = number(row.get("timestamp"))
+        threshold = number(row.get("hpa_cpu_threshold"))
+        if timestamp is None:
+            return
+        if self.start is None:
+            self.start = timestamp
+        if threshold != self.threshold:
+            if self.threshold is None and threshold is not None:
+                self._attribute_latencies(threshold)
+            self.threshold = threshold
+            self.thresholds.append((timestamp - self.start, threshold))
+        for metric in SERIES_METRICS + [name for name in row if name.startswith("pods_")]:
+            value = number(row.get(metric))
+            if value is not None:
+                self._add(metric, timestamp, value, threshold)
+
+    def _attribute_latencies(self, threshold):
+        """
+        Attribute the latencies and errors recorded before the first HPA threshold was known (the results
+        file followed before the collector wrote a row) to that threshold.
+        """
+        sketch = self.latency.pop(None, None)
+        if sketch is not None:
+            total = self.latency.get(threshold)
+            if total is None:
+                total = self.latency[threshold] = QuantileSketch(self.accuracy)
+            total.merge(sketch)
+        errors = self.errors.pop(None, 0)
+        if errors:
+            self.errors[threshold] = self.errors.get(threshold, 0) + errors
+
+    def _close_bucket(self):
+        sketch = self.bucket_sketch
+        sketch.add(self.bucket_values)
+        self.bucket_values = []
+        if sketch.count:
+            self.latency_series.append((self.bucket_end - self.bucket / 2 - self.start,) + tuple(sketch.quantiles(list(LATENCY_PERCENTILES.values()))))
+            total = self.latency.get(self.threshold)
+            if total is None:
+                total = self.latency[self.threshold] = QuantileSketch(self.accuracy)
+            total.merge(sketch)
+        self.bucket_sketch = QuantileSketch(self.accuracy)
+
+    def _add_request(self, row):
+        if row.get("label") != LABEL:
+            return
+        started = number(row.get("timeStamp"))
+        latency = number(row.get("Latency"))
+        if started is None or latency is None:
+            return
+        if self.start is None:
+            self.start = started / 1000
+        if row.get("responseCode") != RESPONSE_CODE:
+            self.errors[self.threshold] = self.errors.get(self.threshold, 0) + 1
+            return
+        # JMeter writes the requests when they end, so their end times are nearly ordered
+        ended = (started + (number(row.get("elapsed")) or 0)) / 1000
+        if self.bucket_end is None:
+            self.bucket_end = ended + self.bucket
+            self.bucket_sketch = QuantileSketch(self.accuracy)
+        while ended >= self.bucket_end:
+            self._close_bucket()
+            self.bucket_end += self.bucket
+        # The values of a bucket are added to its sketch at once
+        self.bucket_values.append(latency)
+
+    def update(self, max_rows=100000):
+        """
+        Read the rows appended to the followed files and update the statistics.
+
+        Returns:
+            int: The number of rows read.
+        """
+        rows = self.metrics_tail.read(max_rows)
+        for row in rows:
+            self._add_sample(row)
+        count = len(rows)
+        if self.results_tail is not None:
+            requests = self.results_tail.read(max_rows)
+            for row in requests:
+                self._add_request(row)
+            count += len(requests)
+        return count
+
+    def latency_stats(self):
+        """
+        Return the HPA threshold -> (requests, p50, p95, p99, errors) of the latencies of the closed buckets.
+        """
+        stats = {}
+        for threshold, sketch in self.latency.items():
+            stats[threshold] = (sketch.count,) + tuple(sketch.quantiles(list(LATENCY_PERCENTILES.values()))) + (self.errors.get(threshold, 0),)
+        return stats
+
+    def close(self):
+        self.metrics_tail.close()
+        if self.results_tail is not None:
+            self.results_tail.close()
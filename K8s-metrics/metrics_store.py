@@ -0,0 +1,414 @@
+import argparse
+import fcntl
+import json
+import os
+import re
+import time
+import uuid
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+# Columns encoded in the directory names of the compacted files
+PARTITION_SCHEMA = pa.schema([("run", pa.string()), ("deployment", pa.string()), ("hpa_cpu_threshold", pa.int64())])
+PARTITIONING = ds.partitioning(PARTITION_SCHEMA, flavor="hive")
+
+# The columns the collectors write to each table (k8s_stats.py adds the per-cloud columns), returned for an empty table
+TABLE_COLUMNS = {
+    "deployment_metrics": ["timestamp", "namespace", "deployment", "cpu_usage_avg", "memory_usage_avg", "hpa_cpu_threshold", "replicas"],
+    "pod_metrics": ["timestamp", "namespace", "deployment", "pod", "node", "node_type", "cpu_usage", "memory_usage", "hpa_cpu_threshold"],
+}
+
+# <run>-<sequence>.jsonl: a segment of the write log
+SEGMENT_NAME = re.compile(r"^(?P<run>.+)-(?P<seq>\d{6})\.jsonl$")
+# <run>-<sequence>-<i>.parquet: the rows of a compacted segment
+PART_NAME = re.compile(r"^(?P<run>.+)-(?P<seq>\d{6})-\d+\.parquet$")
+# <run>-upto<sequence>.parquet: the rows of every segment of a run up to a sequence number, merged
+MERGED_NAME = re.compile(r"^(?P<run>.+)-upto(?P<seq>\d{6})\.parquet$")
+
+
+def new_run_id():
+    """
+    Return the id of a new collection run: the current time and a random suffix, so that collectors started in the same second get different ids.
+    """
+    return "{}-{}".format(time.strftime("%Y%m%d-%H%M%S"), uuid.uuid4().hex[:6])
+
+
+def try_lock(f):
+    """
+    Take an exclusive lock on an open file without blocking.
+
+    The writer of a segment holds the lock until the segment is compacted, so
+    a file that cannot be locked belongs to a live writer. The lock is released
+    when the file is closed, or when its process dies.
+
+    Returns:
+        bool: True if the lock was taken, False if another open file holds it.
+    """
+    try:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return False
+    return True
+
+
+def read_segment(path):
+    """
+    Return the rows of a write log segment.
+
+    A crash can leave the last line incomplete: lines that are not valid JSON are skipped.
+    """
+    rows = []
+    with open(path) as f:
+        for line in f:
+            try:
+                rows.append(json.loads(line))
+            except ValueError:
+                continue
+    return rows
+
+
+def rows_to_table(rows, run):
+    """
+    Convert rows (dictionaries, possibly with different keys) to an Arrow table with the partition columns.
+
+    Parameters:
+        rows (list): The rows.
+        run (str): The id of the run the rows belong to.
+
+    Returns:
+        pyarrow.Table: The table.
+    """
+    names = list(dict.fromkeys(name for row in rows for name in row))
+    table = pa.table({name: [row.get(name) for row in rows] for name in names})
+    for i, field in enumerate(table.schema):
+        # A metric missing from every row of a segment (e.g. the burst averages without burst pods) is a float like the others
+        if pa.types.is_null(field.type):
+            table = table.set_column(i, pa.field(field.name, pa.float64()), table.column(i).cast(pa.float64()))
+    if "run" not in names:
+        table = table.append_column("run", pa.array([run] * len(table), pa.string()))
+    for field in PARTITION_SCHEMA:
+        if field.name not in table.column_names:
+            table = table.append_column(field, pa.nulls(len(table), field.type))
+        else:
+            table = table.set_column(table.column_names.index(field.name), field, table.column(field.name).cast(field.type))
+    return table
+
+
+def write_parts(table, table_dir, basename_template):
+    """
+    Write a table as zstd compressed Parquet files partitioned by run, deployment and HPA threshold.
+    """
+    ds.write_dataset(
+        table, table_dir, format="parquet", partitioning=PARTITIONING,
+        basename_template=basename_template, existing_data_behavior="overwrite_or_ignore",
+        file_options=ds.ParquetFileFormat().make_write_options(compression="zstd"),
+    )
+
+
+class MetricsStore:
+    """
+    Store of the rows of the metrics collectors: an append-only write log compacted into columnar files.
+
+    Rows are appended to a JSON lines segment of the write log and synced to
+    disk, so a crash loses at most the row being written. Every compact_rows
+    rows or compact_seconds seconds, the segment is compacted into Parquet
+    files under <directory>/<table>/run=.../deployment=.../hpa_cpu_threshold=...
+    and deleted; deleting it is the commit point. When the store is closed,
+    the files of each partition of the run are merged into one.
+
+    The writer holds a lock on its open segments. Opening a store compacts the
+    segments left by crashed writers, but not the segments still locked by
+    another live writer of the same directory.
+    """
+
+    def __init__(self, directory, run=None, compact_rows=10000, compact_seconds=600):
+        """
+        Parameters:
+            directory (str): The directory of the store.
+            run (str): The id of the collection run, a new one if not given.
+            compact_rows (int): The number of rows after which a segment is compacted.
+            compact_seconds (float): The age after which a segment is compacted.
+        """
+        self.directory = directory
+        self.run = run or new_run_id()
+        self.compact_rows = compact_rows
+        self.compact_seconds = compact_seconds
+        # table -> [open file, sequence number, rows, start time]
+        self._segments = {}
+        os.makedirs(directory, exist_ok=True)
+        recover_segments(directory)
+
+    def _log_dir(self, table):
+        return os.path.join(self.directory, "_log", table)
+
+    def _segment_path(self, table, seq):
+        return os.path.join(self._log_dir(table), "{}-{:06d}.jsonl".format(self.run, seq))
+
+    def _next_seq(self, table):
+        """
+        Return the next free sequence number of the run, continuing a previous run with the same id.
+        """
+        seqs = [-1]
+        for filename in os.listdir(self._log_dir(table)):
+            match = SEGMENT_NAME.match(filename)
+            if match and match["run"] == self.run:
+                seqs.append(int(match["seq"]))
+        for _, _, filenames in os.walk(os.path.join(self.directory, table)):
+            for filename in filenames:
+                match = PART_NAME.match(filename) or MERGED_NAME.match(filename)
+                if match and match["run"] == self.run:
+                    seqs.append(int(match["seq"]))
+        return max(seqs) + 1
+
+    def append(self, table, rows):
+        """
+        Append rows to a table and sync them to disk.
+
+        Parameters:
+            table (str): The table name, e.g. "deployment_metrics".
+            rows (list): The rows, as dictionaries of JSON serializable values.
+        """
+        segment = self._segments.get(table)
+        if segment is None:
+            os.makedirs(self._log_dir(table), exist_ok=True)
+            seq = self._next_seq(table)
+            f = open(self._segment_path(table, seq), "a")
+            # Another writer of the same run may have taken the sequence number meanwhile
+            while not try_lock(f) or not os.fstat(f.fileno()).st_nlink:
+                f.close()
+                seq += 1
+                f = open(self._segment_path(table, seq), "a")
+            segment = self._segments[table] = [f, seq, 0, time.monotonic()]
+        f = segment[0]
+        f.write("".join(json.dumps(row) + "\n" for row in rows))
+        f.flush()
+        os.fsync(f.fileno())
+        segment[2] += len(rows)
+        if segment[2] >= self.compact_rows or time.monotonic() - segment[3] >= self.compact_seconds:
+            self.compact(table)
+
+    def compact(self, table):
+        """
+        Compact the current segment of a table into Parquet files.
+        """
+        segment = self._segments.pop(table, None)
+        if segment is None:
+            return
+        # The lock is held until the segment is deleted, so that no other store compacts it too
+        compact_segment(self.directory, table, self._segment_path(table, segment[1]))
+        segment[0].close()
+
+    def close(self):
+        """
+        Compact the pending rows and merge the files of each partition of the run.
+        """
+        for table in list(self._segments):
+            self.compact(table)
+        for table in os.listdir(self.directory):
+            if not table.startswith("_"):
+                merge_run(self.directory, table, self.run)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def compact_segment(directory, table, path):
+    """
+    Compact a write log segment into Parquet files, then delete it.
+
+    Compacting the same segment again overwrites the same files, so a compaction interrupted by a crash can be retried.
+    """
+    match = SEGMENT_NAME.match(os.path.basename(path))
+    rows = read_segment(path)
+    if rows:
+        write_parts(rows_to_table(rows, match["run"]), os.path.join(directory, table), "{}-{}-{{i}}.parquet".format(match["run"], match["seq"]))
+    os.remove(path)
+
+
+def partition_files(directory, table):
+    """
+    Return the live Parquet files of a table, grouped by partition directory.
+
+    The files superseded by a merged file, or whose segment is still in the
+    write log (an interrupted compaction), are left out.
+
+    Returns:
+        dict: Partition directory -> list of (file name, run, sequence number, merged) tuples.
+    """
+    pending = set()
+    log_dir = os.path.join(directory, "_log", table)
+    if os.path.isdir(log_dir):
+        for filename in os.listdir(log_dir):
+            match = SEGMENT_NAME.match(filename)
+            if match:
+                pending.add((match["run"], int(match["seq"])))
+    partitions = {}
+    for dirpath, _, filenames in os.walk(os.path.join(directory, table)):
+        merged = {}
+        parts = []
+        for filename in filenames:
+            match = MERGED_NAME.match(filename)
+            if match:
+                merged[match["run"]] = max(merged.get(match["run"], -1), int(match["seq"]))
+                parts.append((filename, match["run"], int(match["seq"]), True))
+                continue
+            match = PART_NAME.match(filename)
+            if match and (match["run"], int(match["seq"])) not in pending:
+                parts.append((filename, match["run"], int(match["seq"]), False))
+        live = [part for part in parts if part[3] or part[2] > merged.get(part[1], -1)]
+        if live:
+            partitions[dirpath] = live
+    return partitions
+
+
+def merge_run(directory, table, run):
+    """
+    Merge the files of each partition of a run into a single file, so that long runs load with few reads.
+    """
+    for dirpath, parts in partition_files(directory, table).items():
+        parts = [part for part in parts if part[1] == run]
+        if len(parts) < 2:
+            continue
+        tables = [pq.ParquetFile(os.path.join(dirpath, filename)).read() for filename, _, _, _ in parts]
+        merged = pa.concat_tables(tables, promote_options="permissive")
+        temp_path = os.path.join(dirpath, "{}.merging".format(run))
+        # Opened without truncating: another store of the run may be writing it
+        with open(temp_path, "ab") as f:
+            # The lock keeps recover() from deleting the file while it is written
+            if not try_lock(f):
+                continue
+            f.truncate(0)
+            pq.write_table(merged, f, compression="zstd")
+            # The merged file supersedes the files up to the highest sequence number even before they are deleted
+            os.replace(temp_path, os.path.join(dirpath, "{}-upto{:06d}.parquet".format(run, max(part[2] for part in parts))))
+        for filename, _, _, _ in parts:
+            try:
+                os.remove(os.path.join(dirpath, filename))
+            except FileNotFoundError:
+                # recover() dropped it already
+                pass
+
+
+def recover_segments(directory):
+    """
+    Compact the write log segments left by crashed writers.
+
+    The segments locked by a live writer are skipped: only their writer compacts them.
+    """
+    log_root = os.path.join(directory, "_log")
+    for table in os.listdir(log_root) if os.path.isdir(log_root) else []:
+        for filename in sorted(os.listdir(os.path.join(log_root, table))):
+            if not SEGMENT_NAME.match(filename):
+                continue
+            path = os.path.join(log_root, table, filename)
+            try:
+                f = open(path)
+            except FileNotFoundError:
+                continue
+            with f:
+                # A segment deleted since it was listed was compacted by its writer
+                if try_lock(f) and os.fstat(f.fileno()).st_nlink:
+                    compact_segment(directory, table, path)
+
+
+def recover(directory):
+    """
+    Finish the work interrupted by a crash: compact the leftover write log segments and drop the superseded files.
+
+    The files still being written by a live writer (its locked segments, their
+    Parquet files and its locked merges) are left alone.
+    """
+    if not os.path.isdir(directory):
+        return
+    recover_segments(directory)
+    for table in os.listdir(directory):
+        if table.startswith("_"):
+            continue
+        log_dir = os.path.join(directory, "_log", table)
+        pending = {filename[:-len(".jsonl")] for filename in os.listdir(log_dir)} if os.path.isdir(log_dir) else set()
+        partitions = partition_files(directory, table)
+        for dirpath, _, filenames in os.walk(os.path.join(directory, table)):
+            live = {part[0] for part in partitions.get(dirpath, [])}
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                if filename.endswith(".merging"):
+                    with open(path, "rb") as f:
+                        if not try_lock(f):
+                            continue
+                    os.remove(path)
+                elif PART_NAME.match(filename) and filename not in live and filename.rpartition("-")[0] not in pending:
+                    os.remove(path)
+
+
+def load_metrics(directory, table, columns=None, filters=None):
+    """
+    Load a table of the store as a pandas DataFrame, including the rows not compacted yet.
+
+    Only the requested columns are read, and the filters are pushed down to
+    the files: partitions (run, deployment, HPA threshold) that cannot match
+    are not opened, and row groups are skipped from their statistics.
+
+    Parameters:
+        directory (str): The directory of the store.
+        table (str): The table name.
+        columns (list): The columns to load, all of them if not given.
+        filters: A pyarrow expression, or filters in the pyarrow.parquet format, e.g. [("deployment", "==", "factorial-api")].
+
+    Returns:
+        pandas.DataFrame: The rows.
+    """
+    if isinstance(filters, list):
+        filters = pq.filters_to_expression(filters)
+    table_dir = os.path.join(directory, table)
+    files = [os.path.join(dirpath, part[0]) for dirpath, parts in partition_files(directory, table).items() for part in parts]
+    tables = []
+    if files:
+        schema = pa.unify_schemas([pq.read_schema(path) for path in files] + [PARTITION_SCHEMA], promote_options="permissive")
+        dataset = ds.dataset(files, schema=schema, format="parquet", partitioning=PARTITIONING, partition_base_dir=table_dir)
+        tables.append(dataset.to_table(columns=[name for name in columns if name in schema.names] if columns else None, filter=filters))
+    # Rows still in the write log
+    log_dir = os.path.join(directory, "_log", table)
+    if os.path.isdir(log_dir):
+        for filename in sorted(os.listdir(log_dir)):
+            match = SEGMENT_NAME.match(filename)
+            rows = read_segment(os.path.join(log_dir, filename)) if match else None
+            if not rows:
+                continue
+            log_table = rows_to_table(rows, match["run"])
+            if filters is not None:
+                log_table = log_table.filter(filters)
+            if columns:
+                log_table = log_table.select([name for name in columns if name in log_table.column_names])
+            tables.append(log_table)
+    if not tables:
+        names = columns or TABLE_COLUMNS.get(table, []) + ["run"]
+        return pa.table({name: [] for name in names}).to_pandas()
+    return pa.concat_tables(tables, promote_options="permissive").to_pandas()
+
+
+def main():
+    """
+    Main function to finish the compaction of a metrics store and summarize its content.
+    """
+    # Define the command-line arguments
+    parser = argparse.ArgumentParser(description="Compact a metrics store and summarize its content")
+    parser.add_argument("--directory", type=str, default="metrics_store", help="The directory of the store")
+    args = parser.parse_args()
+
+    recover(args.directory)
+    for table in sorted(os.listdir(args.directory)):
+        if table.startswith("_"):
+            continue
+        data = load_metrics(args.directory, table, columns=list(PARTITION_SCHEMA.names))
+        size = sum(os.path.getsize(os.path.join(dirpath, filename)) for dirpath, _, filenames in os.walk(os.path.join(args.directory, table)) for filename in filenames)
+        print("{}: {} rows, {} bytes".format(table, len(data), size))
+        print(data.value_counts(dropna=False).sort_index().to_string())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,431 @@
+import argparse
+import json
+import queue
+import random
+import string
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# The pod-template-hash of the synthetic ReplicaSets
+TEMPLATE_HASH = "5d8f7c9b6"
+
+
+def random_suffix(length):
+    """
+    Return a random lowercase alphanumeric string, like the suffixes of the generated Kubernetes names.
+    """
+    return "".join(random.choice(string.ascii_lowercase + string.digits) for _ in range(length))
+
+
+class MockCluster:
+    """
+    Synthetic cluster state: nodes, deployments with their HPA and pods, and pod metrics.
+
+    Pods fill the on-prem nodes first and overflow to the burst nodes, like
+    the preferred node affinity of the blueprint. Every change is pushed to
+    the open watch streams. A new pod has no metrics for metrics_delay
+    seconds, like a pod the metrics server has not scraped yet.
+
+    Parameters:
+        namespace (str): The namespace of the deployments.
+        deployments (list): The names of the deployments.
+        replicas (int): The initial replicas of every deployment.
+        on_prem_nodes (int): The number of nodes labelled node-type=on-prem.
+        burst_nodes (int): The number of nodes labelled node-type=burst.
+        pods_per_node (int): The number of pods placed on a node before the next one.
+        hpa_cpu_threshold (int): The CPU utilization target of the HPAs.
+        metrics_delay (float): The time before the metrics of a new pod are served, in seconds.
+    """
+
+    def __init__(self, namespace, deployments, replicas, on_prem_nodes=2, burst_nodes=2, pods_per_node=110, hpa_cpu_threshold=50, metrics_delay=0):
+        self.namespace = namespace
+        self.pods_per_node = pods_per_node
+        self.hpa_cpu_threshold = hpa_cpu_threshold
+        self.metrics_delay = metrics_delay
+        self.resource_version = 1
+        self.lock = threading.Lock()
+        # (kind, event queue) of every open watch stream
+        self.watchers = []
+        self.nodes = {}
+        for i in range(on_prem_nodes):
+            self.nodes["onprem{}".format(i)] = self._node("onprem{}".format(i), "on-prem")
+        for i in range(burst_nodes):
+            self.nodes["burst{}".format(i)] = self._node("burst{}".format(i), "burst")
+        self.node_pods = Counter()
+        self.deployments = {}
+        self.hpas = {}
+        self.pods = {}
+        # Pod name -> time its metrics are served from
+        self.metrics_from = {}
+        for name in deployments:
+            self.deployments[name] = self._deployment(name, replicas)
+            self.hpas[name] = self._hpa(name, replicas)
+            for _ in range(replicas):
+                self._add_pod(name, notify=False, ready_at=0)
+
+    def _next_version(self):
+        self.resource_version += 1
+        return str(self.resource_version)
+
+    def _metadata(self, name, namespace=None, labels=None, owner=None):
+        metadata = {"name": name, "uid": random_suffix(12), "resourceVersion": self._next_version(), "creationTimestamp": "2024-01-01T00:00:00Z", "labels": labels or {}}
+        if namespace:
+            metadata["namespace"] = namespace
+        if owner:
+            metadata["ownerReferences"] = [{"apiVersion": "apps/v1", "kind": "ReplicaSet", "name": owner, "uid": random_suffix(12), "controller": True}]
+        return metadata
+
+    def _node(self, name, node_type):
+        return {"apiVersion": "v1", "kind": "Node", "metadata": self._metadata(name, labels={"kubernetes.io/hostname": name, "node-type": node_type})}
+
+    def _deployment(self, name, replicas):
+        return {
+            "apiVersion": "apps/v1", "kind": "Deployment",
+            "metadata": self._metadata(name, self.namespace, {"app": name}),
+            "spec": {
+                "replicas": replicas,
+                "selector": {"matchLabels": {"app": name}},
+                "template": {"metadata": {"labels": {"app": name}}, "spec": {"containers": [{"name": name, "image": "mock"}]}},
+            },
+            "status": {"replicas": replicas, "readyReplicas": replicas},
+        }
+
+    def _hpa(self, name, replicas):
+        return {
+            "apiVersion": "autoscaling/v2", "kind": "HorizontalPodAutoscaler",
+            "metadata": self._metadata(name, self.namespace),
+            "spec": {
+                "scaleTargetRef": {"apiVersion": "apps/v1", "kind": "Deployment", "name": name},
+                "minReplicas": replicas, "maxReplicas": max(replicas, 50),
+                "metrics": [{"type": "Resource", "resource": {"name": "cpu", "target": {"type": "Utilization", "averageUtilization": self.hpa_cpu_threshold}}}],
+            },
+        }
+
+    def _place(self):
+        """
+        Return the first node with room, on-prem nodes first, or a random node when they are all full.
+        """
+        for name in self.nodes:
+            if self.node_pods[name] < self.pods_per_node:
+                return name
+        return random.choice(list(self.nodes))
+
+    def _add_pod(self, deployment, notify=True, ready_at=None):
+        name = "{}-{}-{}".format(deployment, TEMPLATE_HASH, random_suffix(5))
+        node = self._place()
+        pod = {
+            "apiVersion": "v1", "kind": "Pod",
+            "metadata": self._metadata(name, self.namespace, {"app": deployment, "pod-template-hash": TEMPLATE_HASH}, owner="{}-{}".format(deployment, TEMPLATE_HASH)),
+            "spec": {"nodeName": node, "containers": [{"name": deployment, "image": "mock"}]},
+            "status": {"phase": "Running"},
+        }
+        self.pods[name] = pod
+        self.node_pods[node] += 1
+        self.metrics_from[name] = time.monotonic() + self.metrics_delay if ready_at is None else ready_at
+        if notify:
+            self._notify("pods", "ADDED", pod)
+
+    def _remove_pod(self, name):
+        pod = self.pods.pop(name)
+        self.node_pods[pod["spec"]["nodeName"]] -= 1
+        del self.metrics_from[name]
+        pod["metadata"]["resourceVersion"] = self._next_version()
+        self._notify("pods", "DELETED", pod)
+
+    def _notify(self, kind, event_type, obj):
+        for watcher_kind, events in self.watchers:
+            if watcher_kind == kind:
+                events.put({"type": event_type, "object": obj})
+
+    def replicas(self, deployment):
+        """
+        Return the replicas of a deployment.
+        """
+        return self.deployments[deployment]["spec"]["replicas"]
+
+    def scale(self, deployment, replicas):
+        """
+        Change the replicas of a deployment, adding or removing pods.
+        """
+        with self.lock:
+            current = [name for name, pod in self.pods.items() if pod["metadata"]["labels"]["app"] == deployment]
+            for _ in range(replicas - len(current)):
+                self._add_pod(deployment)
+            for name in current[replicas:]:
+                self._remove_pod(name)
+            dep = self.deployments[deployment]
+            dep["spec"]["replicas"] = replicas
+            dep["status"] = {"replicas": replicas, "readyReplicas": replicas}
+            dep["metadata"]["resourceVersion"] = self._next_version()
+            self._notify("deployments", "MODIFIED", dep)
+            hpa = self.hpas[deployment]
+            hpa["spec"]["maxReplicas"] = max(hpa["spec"]["maxReplicas"], replicas)
+            hpa["metadata"]["resourceVersion"] = self._next_version()
+            self._notify("horizontalpodautoscalers", "MODIFIED", hpa)
+
+    def churn_once(self):
+        """
+        Replace a random pod by a new one of the same deployment, keeping the replicas.
+        """
+        with self.lock:
+            if self.pods:
+                name = random.choice(list(self.pods))
+                deployment = self.pods[name]["metadata"]["labels"]["app"]
+                self._remove_pod(name)
+                self._add_pod(deployment)
+
+    def pod_metrics(self, namespace=None):
+        """
+        Return the metrics.k8s.io PodMetricsList of the pods with metrics, with random usages.
+        """
+        now = time.monotonic()
+        with self.lock:
+            pods = [pod for name, pod in self.pods.items() if namespace in (None, pod["metadata"]["namespace"]) and self.metrics_from[name] <= now]
+        items = []
+        for pod in pods:
+            usage = {"cpu": "{}n".format(random.randint(1000000, 90000000)), "memory": "{}Ki".format(random.randint(20000, 90000))}
+            items.append({
+                "metadata": {"name": pod["metadata"]["name"], "namespace": pod["metadata"]["namespace"], "labels": pod["metadata"]["labels"]},
+                "timestamp": "2024-01-01T00:00:00Z", "window": "15s",
+                "containers": [{"name": pod["spec"]["containers"][0]["name"], "usage": usage}],
+            })
+        return {"kind": "PodMetricsList", "apiVersion": "metrics.k8s.io/v1beta1", "metadata": {}, "items": items}
+
+    def collection(self, kind):
+        """
+        Return the objects of a resource kind (its plural name in the API paths), by name.
+        """
+        return {"pods": self.pods, "deployments": self.deployments, "horizontalpodautoscalers": self.hpas, "nodes": self.nodes}[kind]
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    """
+    Serve the read-only endpoints used by the collectors: lists, gets and watches of the core and apps objects, and the metrics.k8s.io pod metrics.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def delay(self, items):
+        """
+        Wait the latency of a response of items objects.
+        """
+        latency = self.server.latency + self.server.item_latency * items
+        if latency:
+            time.sleep(latency)
+
+    def do_GET(self):
+        server = self.server
+        cluster = server.cluster
+        url = urlparse(self.path)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        parts = [part for part in url.path.split("/") if part]
+
+        # /apis/metrics.k8s.io/v1beta1[/namespaces/<ns>]/pods[/<name>]
+        if parts[:3] == ["apis", "metrics.k8s.io", "v1beta1"]:
+            rest = parts[3:]
+            namespace = rest[1] if rest[:1] == ["namespaces"] else None
+            rest = rest[2:] if namespace else rest
+            server.count("metrics_" + ("get" if len(rest) == 2 else "list"))
+            data = cluster.pod_metrics(namespace)
+            if len(rest) == 2:
+                self.delay(1)
+                matches = [item for item in data["items"] if item["metadata"]["name"] == rest[1]]
+                if not matches:
+                    self.send_json(404, {"kind": "Status", "code": 404, "message": "not found"})
+                    return
+                self.send_json(200, matches[0])
+                return
+            self.delay(len(data["items"]))
+            self.send_json(200, data)
+            return
+
+        # /api/v1[/namespaces/<ns>]/<kind>[/<name>] and /apis/<group>/<version>[/namespaces/<ns>]/<kind>[/<name>]
+        rest = parts[2:] if parts[:1] == ["api"] else parts[3:]
+        namespace = rest[1] if rest[:1] == ["namespaces"] else None
+        rest = rest[2:] if namespace else rest
+        try:
+            objects = cluster.collection(rest[0])
+        except (IndexError, KeyError):
+            self.send_json(404, {"kind": "Status", "code": 404})
+            return
+        kind = rest[0]
+        field_name = None
+        if query.get("fieldSelector", "").startswith("metadata.name="):
+            field_name = query["fieldSelector"].split("=", 1)[1]
+
+        def selected(obj):
+            return (namespace is None or obj["metadata"].get("namespace") == namespace) and field_name in (None, obj["metadata"]["name"])
+
+        if len(rest) == 2:
+            server.count("{}_get".format(kind))
+            self.delay(1)
+            obj = objects.get(rest[1])
+            self.send_json(200 if obj else 404, obj or {"kind": "Status", "code": 404})
+            return
+        if query.get("watch") in ("true", "1"):
+            server.count("{}_watch".format(kind))
+            self.stream_watch(kind, selected, float(query.get("timeoutSeconds", 60)))
+            return
+        server.count("{}_list".format(kind))
+        with cluster.lock:
+            items = [obj for obj in objects.values() if selected(obj)]
+            version = str(cluster.resource_version)
+        self.delay(len(items))
+        self.send_json(200, {"kind": "List", "apiVersion": "v1", "metadata": {"resourceVersion": version}, "items": items})
+
+    def stream_watch(self, kind, selected, timeout):
+        """
+        Stream the changes of a kind of objects as chunked JSON lines until the timeout.
+        """
+        events = queue.Queue()
+        entry = (kind, events)
+        with self.server.cluster.lock:
+            self.server.cluster.watchers.append(entry)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        deadline = time.monotonic() + timeout
+        try:
+            while time.monotonic() < deadline:
+                try:
+                    event = events.get(timeout=min(1.0, max(deadline - time.monotonic(), 0.01)))
+                except queue.Empty:
+                    continue
+                if not selected(event["object"]):
+                    continue
+                line = (json.dumps(event) + "\n").encode()
+                self.wfile.write("{:x}\r\n".format(len(line)).encode() + line + b"\r\n")
+                self.wfile.flush()
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            with self.server.cluster.lock:
+                self.server.cluster.watchers.remove(entry)
+
+
+class MockServer(ThreadingHTTPServer):
+    """
+    The HTTP server of a MockCluster, counting the API calls by kind of object and verb.
+
+    Parameters:
+        address (tuple): The host and port to listen on.
+        cluster (MockCluster): The served cluster.
+        latency (float): The latency of every response, in seconds.
+        item_latency (float): The additional latency per object of a response, in seconds.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, cluster, latency=0, item_latency=0):
+        super().__init__(address, MockHandler)
+        self.cluster = cluster
+        self.latency = latency
+        self.item_latency = item_latency
+        self.calls = Counter()
+        self._calls_lock = threading.Lock()
+
+    def count(self, name):
+        with self._calls_lock:
+            self.calls[name] += 1
+
+    def snapshot(self):
+        """
+        Return a copy of the call counters.
+        """
+        with self._calls_lock:
+            return Counter(self.calls)
+
+
+def start_churn(cluster, period):
+    """
+    Replace a random pod every period seconds, in a daemon thread.
+    """
+    def churn():
+        while True:
+            time.sleep(period)
+            cluster.churn_once()
+
+    thread = threading.Thread(target=churn, name="churn", daemon=True)
+    thread.start()
+    return thread
+
+
+def write_kubeconfig(path, host, port):
+    """
+    Write a kubeconfig file pointing at the mock server, for config.load_kube_config.
+    """
+    with open(path, "w") as f:
+        f.write("""apiVersion: v1
+kind: Config
+clusters:
+- name: mock
+  cluster:
+    server: http://{}:{}
+contexts:
+- name: mock
+  context:
+    cluster: mock
+    user: mock
+current-context: mock
+users:
+- name: mock
+  user:
+    token: mock
+""".format(host, port))
+
+
+def main():
+    """
+    Main function to serve a synthetic cluster to the collectors.
+    """
+    # Define the command-line arguments
+    parser = argparse.ArgumentParser(description="Serve a synthetic cluster to the collectors")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="The address to listen on")
+    parser.add_argument("--port", type=int, default=8081, help="The port to listen on")
+    parser.add_argument("--namespace", type=str, default="default", help="The namespace of the deployments")
+    parser.add_argument("--deployments", type=str, nargs="+", default=["factorial-api"], help="The names of the deployments")
+    parser.add_argument("--replicas", type=int, default=5, help="The replicas of every deployment")
+    parser.add_argument("--on_prem_nodes", type=int, default=2, help="The number of on-prem nodes")
+    parser.add_argument("--burst_nodes", type=int, default=2, help="The number of burst nodes")
+    parser.add_argument("--pods_per_node", type=int, default=110, help="The number of pods placed on a node before the next one")
+    parser.add_argument("--latency", type=float, default=0, help="The latency of every response, in seconds")
+    parser.add_argument("--item_latency", type=float, default=0, help="The additional latency per object of a response, in seconds")
+    parser.add_argument("--churn", type=float, default=0, help="Replace a random pod every this many seconds, 0 for no churn")
+    parser.add_argument("--metrics_delay", type=float, default=0, help="The time before the metrics of a new pod are served, in seconds")
+    parser.add_argument("--kubeconfig", type=str, default="mock_kube_config.yaml", help="The kubeconfig file written for the collectors")
+    args = parser.parse_args()
+
+    cluster = MockCluster(args.namespace, args.deployments, args.replicas, args.on_prem_nodes, args.burst_nodes, args.pods_per_node, metrics_delay=args.metrics_delay)
+    server = MockServer((args.host, args.port), cluster, args.latency, args.item_latency)
+    write_kubeconfig(args.kubeconfig, args.host, args.port)
+    print("Serving {} pods on http://{}:{}, kubeconfig written to {}".format(len(cluster.pods), args.host, args.port, args.kubeconfig))
+    if args.churn:
+        start_churn(cluster, args.churn)
+
+    def report():
+        while True:
+            time.sleep(5)
+            print(dict(server.snapshot()), flush=True)
+
+    threading.Thread(target=report, name="report", daemon=True).start()
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
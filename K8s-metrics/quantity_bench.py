@@ -0,0 +1,74 @@
+import argparse
+import random
+import timeit
+
+from k8s_quantity import cpu_millicores, memory_mib, scaled_quantity, usage_arrays
+
+
+def metrics_items(pods, containers):
+    """
+    Return a pod metrics list like the one of the metrics server, with random usages.
+    """
+    return [{
+        "metadata": {"name": "factorial-api-5d8f7c9b6-{:05d}".format(i), "namespace": "default"},
+        "containers": [{
+            "name": "container{}".format(j),
+            "usage": {"cpu": "{}n".format(random.randint(100000, 900000000)), "memory": "{}Ki".format(random.randint(10000, 200000))},
+        } for j in range(containers)],
+    } for i in range(pods)]
+
+
+def legacy_usage(items):
+    """
+    The hand-written parser the collectors used before k8s_quantity (n CPU, Ki and Mi memory only).
+    """
+    usages = []
+    for pod in items:
+        cpu_usage = 0
+        memory_usage = 0
+        for container in pod["containers"]:
+            cpu_str = container["usage"].get("cpu", 0)
+            if cpu_str.endswith("n"):
+                cpu_usage += float(cpu_str.rstrip("n")) / 1000000
+            memory_str = container["usage"].get("memory", 0)
+            if memory_str.endswith("Ki"):
+                memory_usage += float(memory_str.rstrip("Ki")) / 1000
+            elif memory_str.endswith("Mi"):
+                memory_usage += float(memory_str.rstrip("Mi"))
+        usages.append((cpu_usage, memory_usage))
+    return usages
+
+
+def scalar_usage(items):
+    """
+    Parse the usages pod by pod with the scalar functions.
+    """
+    return [(sum(cpu_millicores(c["usage"]["cpu"]) for c in pod["containers"]), sum(memory_mib(c["usage"]["memory"]) for c in pod["containers"])) for pod in items]
+
+
+def main():
+    """
+    Main function to time the quantity parser on metrics responses.
+    """
+    # Define the command-line arguments
+    parser = argparse.ArgumentParser(description="Time the quantity parser on metrics responses")
+    parser.add_argument("--pods", type=int, nargs="+", default=[10, 50, 200, 1000], help="The numbers of pods of the responses")
+    parser.add_argument("--containers", type=int, default=2, help="The number of containers per pod")
+    parser.add_argument("--repeat", type=int, default=5, help="The number of timing rounds")
+    args = parser.parse_args()
+
+    print("{:>6} {:>14} {:>14} {:>14} {:>14}".format("pods", "legacy (us)", "cold (us)", "cached (us)", "arrays (us)"))
+    for pods in args.pods:
+        items = metrics_items(pods, args.containers)
+        times = [
+            min(timeit.repeat(lambda: legacy_usage(items), repeat=args.repeat, number=1)),
+            # Fresh strings miss the cache, like the CPU usages of every sample
+            min(timeit.repeat(lambda: (scaled_quantity.cache_clear(), scalar_usage(items)), repeat=args.repeat, number=1)),
+            # Repeated strings hit it, like most memory usages
+            min(timeit.repeat(lambda: scalar_usage(items), repeat=args.repeat, number=1)),
+            min(timeit.repeat(lambda: usage_arrays(items), repeat=args.repeat, number=1)),
+        ]
+        print("{:>6} ".format(pods) + " ".join("{:>14.1f}".format(t * 1e6) for t in times))
+
+if __name__ == "__main__":
+    main()
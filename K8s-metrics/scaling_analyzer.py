@@ -0,0 +1,268 @@
+import argparse
+import csv
+import math
+import time
+
+import pandas as pd
+
+from metrics_store import load_metrics
+
+# The CPU request of the factorial-api pods (k8s-www-api-blueprint.yaml), in millicores: the HPA utilization is relative to it
+CPU_REQUEST = 96
+
+# The columns of an episode
+EPISODE_COLUMNS = [
+    "run", "hpa_cpu_threshold", "start", "duration", "complete", "time_to_scale", "time_to_ready", "time_to_burst",
+    "replicas_before", "peak_replicas", "loaded_replicas", "final_replicas", "overshoot", "peak_utilization", "oscillations",
+]
+
+
+class ScalingDetector:
+    """
+    Detect the scale-out episodes of a deployment in its samples, one sample at a time.
+
+    An episode starts when the CPU utilization (the average usage relative to
+    the CPU request, as computed by the HPA) crosses the HPA threshold, and
+    ends when the utilization has been below the threshold and the replicas
+    unchanged for the settle time. For each episode it measures:
+      - time_to_scale: from the crossing to the first increase of the replicas
+      - time_to_ready: from the crossing to the first sample where the pods with metrics reach the scaled replicas
+      - time_to_burst: from the crossing to the first increase of the pods on the burst nodes
+      - overshoot: the peak replicas minus the replicas at the last sample above the threshold (the level the load needed)
+      - oscillations: the number of scale-ups that follow a scale-down (down->up reversals); the
+        scale-down that normally ends a scale-out is not one, so a healthy episode has none
+    The state is kept between samples, so the detector can follow a live collector.
+
+    Parameters:
+        threshold (float): The HPA CPU threshold, in percent.
+        cpu_request (float): The CPU request of the pods, in millicores.
+        settle (float): The quiet time that ends an episode, in seconds.
+        run (str): The run of the samples, copied to the episodes.
+    """
+
+    def __init__(self, threshold, cpu_request=CPU_REQUEST, settle=300, run=None):
+        self.threshold = threshold
+        self.cpu_request = cpu_request
+        self.settle = settle
+        self.run = run
+        self.previous = None
+        self.episode = None
+
+    def update(self, timestamp, cpu_usage, replicas, pods=None, burst_pods=None):
+        """
+        Process the next sample of the deployment.
+
+        Parameters:
+            timestamp (float): The time of the sample, in seconds.
+            cpu_usage (float): The average CPU usage of the pods, in millicores.
+            replicas (int): The replicas of the deployment.
+            pods (int): The number of pods with metrics, None if unknown.
+            burst_pods (int): The number of pods on the burst nodes, None if unknown.
+
+        Returns:
+            dict: The episode ended by the sample, or None.
+        """
+        utilization = cpu_usage / self.cpu_request * 100
+        above = utilization > self.threshold
+        previous = self.previous
+        self.previous = {"timestamp": timestamp, "above": above, "replicas": replicas, "burst_pods": burst_pods}
+        if previous is None:
+            return None
+
+        episode = self.episode
+        if episode is None:
+            if above and not previous["above"]:
+                self.episode = {
+                    "start": timestamp, "replicas_before": previous["replicas"], "burst_before": previous["burst_pods"],
+                    "peak_replicas": replicas, "peak_utilization": utilization, "scale_time": None, "ready_time": None, "burst_time": None,
+                    "direction": 0, "oscillations": 0, "last_change": timestamp, "last_above": timestamp, "loaded_replicas": replicas,
+                }
+                # The replicas may already change in the sample of the crossing
+                self._track(self.episode, timestamp, previous["replicas"], replicas, pods, burst_pods)
+            return None
+
+        episode["peak_utilization"] = max(episode["peak_utilization"], utilization)
+        if above:
+            episode["last_above"] = timestamp
+            episode["loaded_replicas"] = replicas
+        self._track(episode, timestamp, previous["replicas"], replicas, pods, burst_pods)
+        if not above and timestamp - episode["last_above"] >= self.settle and timestamp - episode["last_change"] >= self.settle:
+            return self._close(timestamp, replicas, complete=True)
+        return None
+
+    def _track(self, episode, timestamp, previous_replicas, replicas, pods, burst_pods):
+        """
+        Update the replica changes and the reaction times of an episode with a sample.
+        """
+        episode["peak_replicas"] = max(episode["peak_replicas"], replicas)
+        if replicas != previous_replicas:
+            direction = 1 if replicas > previous_replicas else -1
+            if direction == 1 and episode["direction"] == -1:
+                episode["oscillations"] += 1
+            episode["direction"] = direction
+            episode["last_change"] = timestamp
+        if episode["scale_time"] is None and replicas > episode["replicas_before"]:
+            episode["scale_time"] = timestamp
+        if episode["scale_time"] is not None and episode["ready_time"] is None and pods is not None and pods >= replicas:
+            episode["ready_time"] = timestamp
+        if episode["burst_time"] is None and burst_pods is not None and burst_pods > (episode["burst_before"] or 0):
+            episode["burst_time"] = timestamp
+
+    def _close(self, timestamp, replicas, complete):
+        """
+        End the current episode and return its record.
+        """
+        episode, self.episode = self.episode, None
+
+        def since_start(event_time):
+            return None if event_time is None else event_time - episode["start"]
+
+        return {
+            "run": self.run, "hpa_cpu_threshold": self.threshold, "start": episode["start"], "duration": timestamp - episode["start"], "complete": complete,
+            "time_to_scale": since_start(episode["scale_time"]), "time_to_ready": since_start(episode["ready_time"]), "time_to_burst": since_start(episode["burst_time"]),
+            "replicas_before": episode["replicas_before"], "peak_replicas": episode["peak_replicas"], "loaded_replicas": episode["loaded_replicas"],
+            "final_replicas": replicas, "overshoot": episode["peak_replicas"] - episode["loaded_replicas"], "peak_utilization": episode["peak_utilization"], "oscillations": episode["oscillations"],
+        }
+
+    def finish(self):
+        """
+        End the current episode at the last sample, if any, and return its record (marked as not complete).
+        """
+        if self.episode is None:
+            return None
+        return self._close(self.previous["timestamp"], self.previous["replicas"], complete=False)
+
+
+def sample_values(row, burst_cloud):
+    """
+    Return the arguments of ScalingDetector.update of a deployment metrics row (a dictionary of numbers or strings).
+    """
+    def number(value):
+        if value is None or value == "":
+            return None
+        value = float(value)
+        return None if math.isnan(value) else value
+
+    pods = [number(value) for name, value in row.items() if name.startswith("pods_")]
+    pods = None if not pods else sum(value or 0 for value in pods)
+    return number(row["timestamp"]), number(row["cpu_usage_avg"]), number(row["replicas"]), pods, number(row.get("pods_" + burst_cloud.replace("-", "_")))
+
+
+def analyze(data, cpu_request=CPU_REQUEST, settle=300, burst_cloud="burst"):
+    """
+    Detect the scale-out episodes of every run and HPA threshold of the deployment metrics.
+
+    Parameters:
+        data (DataFrame): The deployment metrics of one deployment, as written by k8s_stats.py.
+        cpu_request (float): The CPU request of the pods, in millicores.
+        settle (float): The quiet time that ends an episode, in seconds.
+        burst_cloud (str): The node type of the burst nodes.
+
+    Returns:
+        DataFrame: One row per episode, with the EPISODE_COLUMNS.
+    """
+    keys = ["run", "hpa_cpu_threshold"] if "run" in data.columns else ["hpa_cpu_threshold"]
+    episodes = []
+    for key, run_data in data.dropna(subset=["timestamp", "cpu_usage_avg", "replicas", "hpa_cpu_threshold"]).sort_values("timestamp").groupby(keys, sort=True):
+        key = key if isinstance(key, tuple) else (key,)
+        detector = ScalingDetector(float(key[-1]), cpu_request, settle, run=key[0] if len(key) > 1 else None)
+        # The same detector as the live mode, fed with the whole history
+        for row in run_data.to_dict("records"):
+            episode = detector.update(*sample_values(row, burst_cloud))
+            if episode is not None:
+                episodes.append(episode)
+        episode = detector.finish()
+        if episode is not None:
+            episodes.append(episode)
+    return pd.DataFrame(episodes, columns=EPISODE_COLUMNS)
+
+
+def follow_rows(filename, poll_time=1.0):
+    """
+    Yield the rows of a CSV file as they are appended to it, like tail -f.
+    """
+    with open(filename, newline="") as f:
+        header = None
+        partial = ""
+        while True:
+            line = f.readline()
+            if not line.endswith("\n"):
+                # Wait for the end of a line still being written
+                partial += line
+                time.sleep(poll_time)
+                continue
+            line, partial = partial + line, ""
+            values = next(csv.reader([line]))
+            if header is None:
+                header = values
+                continue
+            yield dict(zip(header, values))
+
+
+def follow(filename, deployment, cpu_request, settle, burst_cloud, poll_time):
+    """
+    Print the scale-out episodes of a deployment metrics file while k8s_stats.py writes it.
+    """
+    namespace, _, name = deployment.rpartition("/") if deployment else ("", "", None)
+    # HPA threshold -> detector
+    detectors = {}
+    for row in follow_rows(filename, poll_time):
+        if name and row.get("deployment") not in (None, name):
+            continue
+        if namespace and row.get("namespace") not in (None, namespace):
+            continue
+        timestamp, cpu_usage, replicas, pods, burst_pods = sample_values(row, burst_cloud)
+        if None in (timestamp, cpu_usage, replicas) or not row.get("hpa_cpu_threshold"):
+            continue
+        threshold = float(row["hpa_cpu_threshold"])
+        detector = detectors.get(threshold)
+        if detector is None:
+            detector = detectors[threshold] = ScalingDetector(threshold, cpu_request, settle)
+        episode = detector.update(timestamp, cpu_usage, replicas, pods, burst_pods)
+        if episode is not None:
+            print(pd.DataFrame([episode], columns=EPISODE_COLUMNS).to_string(index=False), flush=True)
+
+
+def main():
+    """
+    Main function to measure the scale-out reaction of a deployment.
+    """
+    # Define the command-line arguments
+    parser = argparse.ArgumentParser(description="Measure the scale-out reaction of a deployment")
+    parser.add_argument("--filename", type=str, default="deployment_metrics.csv", help="The deployment metrics file recorded by k8s_stats.py")
+    parser.add_argument("--store", type=str, help="Load the metrics from this metrics store directory instead of the CSV file")
+    parser.add_argument("--run", type=str, nargs="+", help="The runs to load from the metrics store, all of them if not given")
+    parser.add_argument("--deployment", type=str, help="The deployment to analyze, as name or namespace/name, when the file holds several")
+    parser.add_argument("--cpu_request", type=float, default=CPU_REQUEST, help="The CPU request of the pods, in millicores")
+    parser.add_argument("--settle", type=float, default=300, help="The quiet time that ends an episode, in seconds")
+    parser.add_argument("--burst_cloud", type=str, default="burst", help="The node type of the burst nodes")
+    parser.add_argument("--follow", action='store_true', help="Follow the file while k8s_stats.py writes it and print the episodes as they end")
+    parser.add_argument("--poll_time", type=float, default=1, help="The time between two reads of the followed file, in seconds")
+    parser.add_argument("--output", type=str, default="scaling_episodes.csv", help="The output file of the episodes")
+    args = parser.parse_args()
+
+    if args.follow:
+        follow(args.filename, args.deployment, args.cpu_request, args.settle, args.burst_cloud, args.poll_time)
+        return
+
+    if args.store:
+        data = load_metrics(args.store, "deployment_metrics", filters=[("run", "in", args.run)] if args.run else None)
+    else:
+        data = pd.read_csv(args.filename)
+    if args.deployment:
+        namespace, _, name = args.deployment.rpartition("/")
+        data = data[data["deployment"] == name]
+        if namespace:
+            data = data[data["namespace"] == namespace]
+    elif "deployment" in data.columns and data[["namespace", "deployment"]].drop_duplicates().shape[0] > 1:
+        parser.error("The metrics hold several deployments, choose one with --deployment")
+
+    episodes = analyze(data, args.cpu_request, args.settle, args.burst_cloud)
+    episodes.to_csv(args.output, index=False)
+    print(episodes.to_string(index=False))
+    print()
+    print(episodes.groupby("hpa_cpu_threshold")[["time_to_scale", "time_to_ready", "time_to_burst", "overshoot", "oscillations"]].mean().to_string())
+
+
+if __name__ == "__main__":
+    main()
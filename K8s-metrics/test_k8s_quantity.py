@@ -0,0 +1,105 @@
+import numpy as np
+import pytest
+
+from k8s_quantity import QuantityError, cpu_millicores, memory_mib, parse_quantities, parse_quantity, usage_arrays
+
+# Quantity -> value in the base unit (cores or bytes), from the Kubernetes quantity definition
+GOLDEN = [
+    ("0", 0.0),
+    ("1", 1.0),
+    ("250m", 0.25),
+    ("1500m", 1.5),
+    ("100u", 0.0001),
+    ("12345678n", 0.012345678),
+    ("2.5", 2.5),
+    (".5", 0.5),
+    ("5.", 5.0),
+    ("+3", 3.0),
+    ("-2m", -0.002),
+    ("1k", 1000.0),
+    ("1M", 1e6),
+    ("3G", 3e9),
+    ("1T", 1e12),
+    ("1P", 1e15),
+    ("1E", 1e18),
+    ("1Ki", 1024.0),
+    ("123Ki", 125952.0),
+    ("10Mi", 10485760.0),
+    ("0.5Gi", 536870912.0),
+    ("1Ti", 2.0 ** 40),
+    ("1Pi", 2.0 ** 50),
+    ("1Ei", 2.0 ** 60),
+    ("1e3", 1000.0),
+    ("1E3", 1000.0),
+    ("1.5e-3", 0.0015),
+    ("2e+2", 200.0),
+    ("128974848", 128974848.0),
+]
+
+# Strings that are not quantities
+INVALID = ["", "m", "Ki", "1x", "1.2.3", "1e", "1 Ki", "1ki", "1KiB", "--1", "0x10"]
+
+# Values in the units of the collectors
+GOLDEN_UNITS = [
+    (cpu_millicores, "12345678n", 12.345678),
+    (cpu_millicores, "250m", 250.0),
+    (cpu_millicores, "2", 2000.0),
+    (memory_mib, "1024Ki", 1.0),
+    (memory_mib, "81920Ki", 80.0),
+    (memory_mib, "64Mi", 64.0),
+    (memory_mib, "1Gi", 1024.0),
+    (memory_mib, "1048576", 1.0),
+]
+
+
+@pytest.mark.parametrize("quantity, expected", GOLDEN)
+def test_parse_quantity(quantity, expected):
+    assert parse_quantity(quantity) == expected
+
+
+@pytest.mark.parametrize("quantity", INVALID)
+def test_parse_quantity_invalid(quantity):
+    with pytest.raises(QuantityError):
+        parse_quantity(quantity)
+
+
+@pytest.mark.parametrize("function, quantity, expected", GOLDEN_UNITS, ids=lambda value: getattr(value, "__name__", None))
+def test_units(function, quantity, expected):
+    assert function(quantity) == expected
+
+
+def test_parse_quantities_matches_scalar():
+    quantities = [quantity for quantity, _ in GOLDEN]
+    assert parse_quantities(quantities).tolist() == [parse_quantity(quantity) for quantity in quantities]
+    for power10, power2, function in [(-3, 0, cpu_millicores), (0, 20, memory_mib)]:
+        assert parse_quantities(quantities, power10, power2).tolist() == [function(quantity) for quantity in quantities]
+
+
+def test_parse_quantities_uniform():
+    # Digits with one suffix: the form of the metrics server responses
+    quantities = ["12345678n", "900000000n", "1n", "0n"]
+    assert parse_quantities(quantities, -3, 0).tolist() == [cpu_millicores(quantity) for quantity in quantities]
+    assert parse_quantities(["81920Ki", "1024Ki"], 0, 20).tolist() == [80.0, 1.0]
+
+
+def test_parse_quantities_errors():
+    with pytest.raises(QuantityError):
+        parse_quantities(["1Ki", "1x"])
+    errors = []
+    assert parse_quantities(["1Ki", "1x"], errors=errors).tolist() == [1024.0, 0.0]
+    assert len(errors) == 1
+
+
+def test_usage_arrays():
+    items = [
+        {"metadata": {"name": "a", "namespace": "default"}, "containers": [
+            {"name": "c0", "usage": {"cpu": "250000000n", "memory": "1024Ki"}},
+            {"name": "c1", "usage": {"cpu": "250m", "memory": "1Mi"}},
+        ]},
+        {"metadata": {"name": "b", "namespace": "default"}, "containers": [{"name": "c0", "usage": {"cpu": "bad"}}]},
+    ]
+    keys, cpu, memory, errors = usage_arrays(items)
+    assert keys == [("default", "a"), ("default", "b")]
+    np.testing.assert_array_equal(cpu, [500.0, 0.0])
+    np.testing.assert_array_equal(memory, [2.0, 0.0])
+    assert len(errors) == 1
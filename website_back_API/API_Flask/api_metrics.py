@@ -0,0 +1,218 @@
+import bisect
+import os
+import resource
+import threading
+import time
+
+# Latency buckets, in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Upper bounds of the n buckets used as label
+N_BUCKETS = (10, 100, 500, 1000, 2000, 5000, 10000, 100000)
+
+
+def n_bucket(n):
+    """
+    Return the label of the bucket of a factorial argument, e.g. "101-500".
+    """
+    if n is None:
+        return "none"
+    index = bisect.bisect_left(N_BUCKETS, n)
+    if index == len(N_BUCKETS):
+        return ">{}".format(N_BUCKETS[-1])
+    low = N_BUCKETS[index - 1] + 1 if index else 0
+    return "{}-{}".format(low, N_BUCKETS[index])
+
+
+def _format_labels(names, values, extra=""):
+    pairs = ['{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"')) for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """
+    Monotonic counter with labels.
+    """
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = ["# HELP {} {}".format(self.name, self.help), "# TYPE {} counter".format(self.name)]
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append("{}{} {}".format(self.name, _format_labels(self.labels, label_values), _format_value(value)))
+        return lines
+
+
+class Gauge(Counter):
+    """
+    Value that can go up and down, with labels.
+    """
+
+    def dec(self, *label_values, amount=1):
+        self.inc(*label_values, amount=-amount)
+
+    def set(self, *label_values, value):
+        with self._lock:
+            self._values[label_values] = value
+
+    def render(self):
+        lines = super().render()
+        lines[1] = "# TYPE {} gauge".format(self.name)
+        return lines
+
+
+class Histogram:
+    """
+    Histogram of observations with cumulative buckets, with labels.
+    """
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        # label values -> [bucket counts, sum, count]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, *label_values, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(label_values)
+            if entry is None:
+                entry = self._values[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            if index < len(self.buckets):
+                entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self):
+        lines = ["# HELP {} {}".format(self.name, self.help), "# TYPE {} histogram".format(self.name)]
+        with self._lock:
+            for label_values, (counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    lines.append("{}_bucket{} {}".format(self.name, _format_labels(self.labels, label_values, 'le="{}"'.format(bound)), cumulative))
+                lines.append("{}_bucket{} {}".format(self.name, _format_labels(self.labels, label_values, 'le="+Inf"'), count))
+                lines.append("{}_sum{} {}".format(self.name, _format_labels(self.labels, label_values), repr(total)))
+                lines.append("{}_count{} {}".format(self.name, _format_labels(self.labels, label_values), count))
+        return lines
+
+
+REQUESTS = Counter("factorial_requests_total", "Requests handled", ("route", "status", "n_bucket"))
+LATENCY = Histogram("factorial_request_seconds", "Time from the start of the request handling to the start of the response", ("route", "status", "n_bucket"))
+COMPUTE = Histogram("factorial_compute_seconds", "Time spent computing the factorials of a request", ("route", "n_bucket"))
+SERIALIZATION = Histogram("factorial_serialization_seconds", "Time spent printing the response body", ("route", "n_bucket"))
+QUEUEING = Histogram("factorial_queueing_seconds", "Time a request waited before being handled (X-Request-Start) or for an offload slot", ("route", "stage"))
+IN_FLIGHT = Gauge("factorial_requests_in_flight", "Requests being handled")
+CACHE = Gauge("factorial_cache", "Result cache counters (hits, misses, items, bytes) and hit ratios per tier", ("stat",))
+SINGLE_FLIGHT = Gauge("factorial_single_flight", "Single-flight counters", ("stat",))
+PROCESS = Gauge("factorial_process", "Process CPU seconds and resident memory bytes", ("stat",))
+
+METRICS = (REQUESTS, LATENCY, COMPUTE, SERIALIZATION, QUEUEING, IN_FLIGHT, CACHE, SINGLE_FLIGHT, PROCESS)
+
+
+def request_start_delay(header, now=None):
+    """
+    Return the seconds elapsed since a proxy received the request, from its X-Request-Start header.
+
+    The header holds a Unix time in seconds, milliseconds or microseconds, optionally prefixed by "t=".
+
+    Returns:
+        float: The delay, or None if the header is missing or invalid.
+    """
+    if not header:
+        return None
+    try:
+        value = float(header.strip().lstrip("t="))
+    except ValueError:
+        return None
+    # Bring milliseconds and microseconds back to seconds
+    while value > 1e11:
+        value /= 1000
+    delay = (now or time.time()) - value
+    return delay if delay >= 0 else None
+
+
+def timed_chunks(chunks, route, bucket, elapsed=0.0):
+    """
+    Yield the body pieces and record the time spent producing them as serialization time.
+
+    Parameters:
+        chunks (iterator): The body pieces.
+        route (str): The route label.
+        bucket (str): The n bucket label.
+        elapsed (float): Serialization seconds already spent before the first piece.
+    """
+    iterator = iter(chunks)
+    while True:
+        start = time.perf_counter()
+        try:
+            chunk = next(iterator)
+        except StopIteration:
+            break
+        finally:
+            elapsed += time.perf_counter() - start
+        yield chunk
+    SERIALIZATION.observe(route, bucket, value=elapsed)
+
+
+def _process_stats():
+    """
+    Return the CPU seconds and the resident memory of this process.
+    """
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    try:
+        with open("/proc/self/statm") as f:
+            rss = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # ru_maxrss is the peak, in KiB on Linux
+        rss = usage.ru_maxrss * 1024
+    return usage.ru_utime + usage.ru_stime, rss
+
+
+def render(engine_stats, flight_stats):
+    """
+    Return the metrics in the Prometheus text exposition format.
+
+    Every server worker process keeps its own metrics, like it keeps its own cache.
+
+    Parameters:
+        engine_stats (dict): The stats of the FactorialEngine.
+        flight_stats (dict): The stats of the single-flight object.
+
+    Returns:
+        str: The metrics page.
+    """
+    cache_stats = engine_stats["cache"]
+    lookups = cache_stats["hits"] + cache_stats["misses"]
+    CACHE.set("hit_ratio", value=cache_stats["hits"] / lookups if lookups else 0.0)
+    for stat, value in cache_stats.items():
+        if isinstance(value, (int, float)):
+            CACHE.set(stat, value=value)
+    for stat, value in flight_stats.items():
+        SINGLE_FLIGHT.set(stat, value=value)
+    cpu_seconds, rss = _process_stats()
+    PROCESS.set("cpu_seconds", value=cpu_seconds)
+    PROCESS.set("resident_memory_bytes", value=rss)
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
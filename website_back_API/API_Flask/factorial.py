@@ -1,19 +1,124 @@
-from flask import Flask, request, jsonify
+import os
+import time
+from concurrent.futures import TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from flask import Flask, Response, g, request, jsonify, stream_with_context
 from flask_cors import CORS
 
+import api_metrics
+from factorial_engine import engine_from_env, offloader_from_env
+from factorial_requests import RequestError, batch_payload, factorial_payload, parse_batch_request, parse_factorial_request
+from result_cache import cache_from_env
+from singleflight import single_flight_from_env
+
 app = Flask(__name__)
 CORS(app)
 
+# Shared factorial engine (configured by the FACTORIAL_* environment variables)
+engine = engine_from_env()
+
+# Two-tier result cache if FACTORIAL_SHARED_CACHE is set, warmed up with the hottest shared results
+engine.cache = cache_from_env(engine.cache)
+
+# Concurrent requests for the same number share one computation (across workers if FACTORIAL_SHARED_FLIGHT_DIR is set)
+flight = single_flight_from_env()
+
+# Runs the CPU-heavy factorials in a process pool (disabled unless FACTORIAL_POOL_WORKERS > 0)
+offloader = offloader_from_env(engine, flight)
+
+def make_response(chunks, mimetype, streamed):
+    """
+    Build a response from body pieces, sent with chunked transfer encoding if streamed.
+    """
+    if streamed:
+        return Response(stream_with_context(chunks), mimetype=mimetype)
+    return Response("".join(chunks), mimetype=mimetype)
+
+@app.before_request
+def start_request_timer():
+    g.start = time.perf_counter()
+    g.n_bucket = api_metrics.n_bucket(None)
+    api_metrics.IN_FLIGHT.inc()
+    delay = api_metrics.request_start_delay(request.headers.get('X-Request-Start'))
+    if delay is not None:
+        api_metrics.QUEUEING.observe(request.path, "proxy", value=delay)
+
+@app.after_request
+def record_request_metrics(response):
+    route = request.url_rule.rule if request.url_rule else "unknown"
+    status = str(response.status_code)
+    api_metrics.REQUESTS.inc(route, status, g.n_bucket)
+    api_metrics.LATENCY.observe(route, status, g.n_bucket, value=time.perf_counter() - g.start)
+    return response
+
+@app.teardown_request
+def end_request(error):
+    api_metrics.IN_FLIGHT.dec()
+
+def timed_payload(build, route):
+    """
+    Build the body pieces of a response, timing the build and the printing as serialization.
+    """
+    start = time.perf_counter()
+    chunks, mimetype = build()
+    return api_metrics.timed_chunks(chunks, route, g.n_bucket, time.perf_counter() - start), mimetype
+
+def timed_compute(compute, route):
+    """
+    Run a computation and record its duration.
+    """
+    start = time.perf_counter()
+    result = compute()
+    api_metrics.COMPUTE.observe(route, g.n_bucket, value=time.perf_counter() - start)
+    return result
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(api_metrics.render(engine.stats(), flight.stats()), mimetype="text/plain; version=0.0.4")
+
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    return jsonify({'status': 'ok'})
+
+@app.route('/stats', methods=['GET'])
+def stats():
+    return jsonify({'engine': engine.stats(), 'single_flight': flight.stats()})
+
 @app.route('/factorial', methods=['POST'])
 def factorial():
-    data = request.get_json()
-    number = data.get('number')
-    if not number:
-        return jsonify({'error': 'number is required'}), 400
-    result = 1
-    for i in range(1, int(number)+1):
-        result *= i
-    return jsonify({'number': number, 'factorial': result})
+    try:
+        number, n, mode = parse_factorial_request(request.get_json(silent=True), request.args)
+    except RequestError as e:
+        return jsonify({'error': str(e)}), 400
+    g.n_bucket = api_metrics.n_bucket(n)
+    try:
+        result = timed_compute(lambda: offloader.compute(n), '/factorial')
+    except TimeoutError:
+        return jsonify({'error': 'computation timed out'}), 504
+    except BrokenProcessPool:
+        # A pool worker died: the pool is restarted on the next request
+        return jsonify({'error': 'computation worker crashed'}), 503
+    chunks, mimetype = timed_payload(lambda: factorial_payload(number, n, result, mode), '/factorial')
+    return make_response(chunks, mimetype, mode == "stream")
+
+@app.route('/factorial/batch', methods=['POST'])
+def factorial_batch():
+    try:
+        numbers, values, mode, body_format = parse_batch_request(request.get_json(silent=True), request.args)
+    except RequestError as e:
+        return jsonify({'error': str(e)}), 400
+    g.n_bucket = api_metrics.n_bucket(max(values))
+    # Compute every distinct value in one ascending pass, then answer in request order
+    try:
+        results = timed_compute(lambda: offloader.compute_many(values), '/factorial/batch')
+    except TimeoutError:
+        return jsonify({'error': 'computation timed out'}), 504
+    except BrokenProcessPool:
+        # A pool worker died: the pool is restarted on the next request
+        return jsonify({'error': 'computation worker crashed'}), 503
+    chunks, mimetype = timed_payload(lambda: batch_payload(numbers, values, results, mode, body_format), '/factorial/batch')
+    return make_response(chunks, mimetype, mode == "stream" or body_format == "ndjson")
 
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0')
+    app.run(debug=os.environ.get('FLASK_DEBUG') == '1', host='0.0.0.0')
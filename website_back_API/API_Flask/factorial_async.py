@@ -0,0 +1,393 @@
+import asyncio
+import json
+import math
+import os
+import time
+from concurrent.futures.process import BrokenProcessPool
+from urllib.parse import parse_qsl
+
+import api_metrics
+from factorial_engine import engine_from_env, offloader_from_env
+from factorial_requests import RequestError, batch_payload, factorial_payload, parse_batch_request, parse_factorial_request
+from result_cache import TwoTierCache, cache_from_env
+from singleflight import AsyncSingleFlight
+
+# Shared factorial engine (configured by the FACTORIAL_* environment variables)
+engine = engine_from_env()
+
+# Two-tier result cache if FACTORIAL_SHARED_CACHE is set, warmed up with the hottest shared results
+engine.cache = cache_from_env(engine.cache)
+
+# The shared tier of the result cache does blocking disk or socket I/O, so it is only used from the thread pool
+SHARED_CACHE = isinstance(engine.cache, TwoTierCache)
+
+# The async service always offloads to processes, so the pool has at least one worker
+offloader = offloader_from_env(engine)
+offloader.workers = max(offloader.workers, 1)
+
+
+class Overloaded(Exception):
+    """
+    Raised when the admission controller rejects an offloaded computation.
+    """
+
+
+class CostModel:
+    """
+    Estimate how long computing n! takes, from one calibration run scaled by a power law.
+    """
+
+    def __init__(self, engine, calibration_n=2000, exponent=1.6):
+        self.calibration_n = calibration_n
+        self.exponent = exponent
+        start = time.perf_counter()
+        engine.compute_uncached(calibration_n)
+        self.calibration_seconds = max(time.perf_counter() - start, 1e-6)
+
+    def estimate(self, n):
+        """
+        Return the estimated compute time of n!, in seconds.
+        """
+        return self.calibration_seconds * (max(n, 1) / self.calibration_n) ** self.exponent
+
+
+class AdmissionController:
+    """
+    Bound the offloaded computations: at most max_concurrency run at once and at most max_queue wait.
+
+    Requests beyond that are rejected right away with a Retry-After hint
+    instead of queueing without bound.
+    """
+
+    def __init__(self, max_concurrency, max_queue, reject_status=503):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.reject_status = reject_status
+        self.running = 0
+        self.waiting = 0
+        self.rejected = 0
+        # Moving average of the offloaded computation time, in seconds
+        self.average_seconds = 0.1
+        self._semaphore = None
+
+    def admit(self):
+        """
+        Return True if one more computation can run or wait, False if it must be rejected.
+        """
+        if self.running + self.waiting >= self.max_concurrency + self.max_queue:
+            self.rejected += 1
+            return False
+        return True
+
+    def retry_after(self):
+        """
+        Return the seconds a rejected client should wait, from the backlog and the average computation time.
+        """
+        backlog = self.running + self.waiting
+        return max(1, math.ceil(backlog * self.average_seconds / self.max_concurrency))
+
+    async def run(self, future_factory, timeout, route):
+        """
+        Wait for a slot, then run an offloaded computation, or reject it if the queue is full.
+
+        Parameters:
+            future_factory (function): Starts the computation and returns a concurrent.futures.Future.
+            timeout (float): The seconds to wait for the result once started.
+            route (str): The route label of the time spent waiting for a slot.
+
+        Returns:
+            The result of the computation.
+
+        Raises:
+            Overloaded: If the computation is rejected.
+            asyncio.TimeoutError: If the computation does not finish in time.
+            concurrent.futures.process.BrokenProcessPool: If a pool worker died.
+        """
+        if not self.admit():
+            raise Overloaded()
+        if self._semaphore is None:
+            # Created here so that it belongs to the running event loop
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self.waiting += 1
+        queued = time.perf_counter()
+        async with self._semaphore:
+            self.waiting -= 1
+            api_metrics.QUEUEING.observe(route, "offload", value=time.perf_counter() - queued)
+            self.running += 1
+            start = time.perf_counter()
+            try:
+                return await asyncio.wait_for(asyncio.wrap_future(future_factory()), timeout)
+            finally:
+                self.running -= 1
+                self.average_seconds = 0.8 * self.average_seconds + 0.2 * (time.perf_counter() - start)
+
+
+# Computations estimated to take less than this are run inline on the event loop
+INLINE_MAX_SECONDS = float(os.environ.get("ASYNC_INLINE_MAX_SECONDS", 0.002))
+
+admission = AdmissionController(
+    max_concurrency=int(os.environ.get("ASYNC_MAX_CONCURRENCY", offloader.workers)),
+    max_queue=int(os.environ.get("ASYNC_MAX_QUEUE", 16)),
+    reject_status=int(os.environ.get("ASYNC_REJECT_STATUS", 503)),
+)
+
+# The payloads of results with more digits than this are built and printed in the thread pool
+INLINE_MAX_DIGITS = int(os.environ.get("ASYNC_INLINE_MAX_DIGITS", 20000))
+
+# Routes used as metrics labels, any other path is labelled "unknown"
+ROUTES = ("/factorial", "/factorial/batch", "/healthz", "/stats", "/metrics")
+
+# Created at startup, since calibrating takes a few milliseconds of CPU
+cost_model = None
+
+# Concurrent requests for the same number share one computation
+flight = AsyncSingleFlight()
+
+
+async def in_thread(fn, *args):
+    """
+    Run a blocking function in the default thread pool of the event loop.
+    """
+    return await asyncio.get_running_loop().run_in_executor(None, fn, *args)
+
+
+async def cache_get(n):
+    """
+    Return n! from the cache, or None; the shared tier is looked up in the thread pool.
+    """
+    if not SHARED_CACHE:
+        return engine.cache.get(n)
+    result = engine.cache.get_local(n)
+    if result is None:
+        result = await in_thread(engine.cache.get_shared, n)
+    return result
+
+
+async def cache_put(results):
+    """
+    Add results (n -> n!) to the cache; the shared tier is written in the thread pool.
+    """
+    if not SHARED_CACHE:
+        for n, result in results.items():
+            engine.cache.put(n, result)
+        return
+    for n, result in results.items():
+        engine.cache.local.put(n, result)
+    await in_thread(lambda: [engine.cache.put_shared(n, result) for n, result in results.items()])
+
+
+async def compute(n):
+    """
+    Return n!, inline if cached or cheap, otherwise in the process pool.
+    """
+    result = await cache_get(n)
+    if result is not None:
+        return result
+    if cost_model.estimate(n) <= INLINE_MAX_SECONDS:
+        result = engine.compute_uncached(n)
+    else:
+        result = await flight.do(n, lambda: admission.run(lambda: offloader.submit(n), offloader.timeout, "/factorial"))
+    await cache_put({n: result})
+    return result
+
+
+async def compute_many(values):
+    """
+    Return the factorials of many numbers, inline if cheap, otherwise in the process pool.
+    """
+    if cost_model.estimate(max(values)) <= INLINE_MAX_SECONDS:
+        # The engine looks every number up in the cache, shared tier included
+        return await in_thread(engine.compute_many, values) if SHARED_CACHE else engine.compute_many(values)
+    results = await admission.run(lambda: offloader.submit_many(values), offloader.timeout, "/factorial/batch")
+    await cache_put(results)
+    return results
+
+
+def large_payload(results):
+    """
+    Return True if printing results takes long enough to be done in the thread pool, from their sizes in bits.
+    """
+    return sum(result.bit_length() for result in results) * math.log10(2) > INLINE_MAX_DIGITS
+
+
+async def read_body(receive):
+    """
+    Read the whole request body.
+    """
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return body
+
+
+def response_headers(mimetype, extra=None):
+    """
+    Return the ASGI headers of a response, with the CORS header of the Flask app.
+    """
+    headers = [(b"content-type", mimetype.encode()), (b"access-control-allow-origin", b"*")]
+    for name, value in (extra or {}).items():
+        headers.append((name.lower().encode(), str(value).encode()))
+    return headers
+
+
+async def send_json(send, status, data, extra_headers=None):
+    """
+    Send a small JSON response.
+    """
+    await send({"type": "http.response.start", "status": status, "headers": response_headers("application/json", extra_headers)})
+    await send({"type": "http.response.body", "body": json.dumps(data).encode()})
+
+
+async def send_chunks(send, chunks, mimetype, streamed, offload=False):
+    """
+    Send body pieces, one ASGI message per piece if streamed (chunked transfer encoding).
+
+    The pieces are produced in the thread pool if offload is set, since printing a large result would block the event loop.
+    """
+    await send({"type": "http.response.start", "status": 200, "headers": response_headers(mimetype)})
+    if not streamed:
+        body = await in_thread(lambda: "".join(chunks).encode()) if offload else "".join(chunks).encode()
+        await send({"type": "http.response.body", "body": body})
+        return
+    chunks = iter(chunks)
+    while True:
+        chunk = await in_thread(next, chunks, None) if offload else next(chunks, None)
+        if chunk is None:
+            break
+        await send({"type": "http.response.body", "body": chunk.encode(), "more_body": True})
+    await send({"type": "http.response.body", "body": b""})
+
+
+async def lifespan(receive, send):
+    """
+    Calibrate the cost model at startup and stop the process pool at shutdown.
+    """
+    global cost_model
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            cost_model = CostModel(engine)
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            offloader.shutdown()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def timed(awaitable, route, bucket):
+    """
+    Await a computation and record its duration.
+    """
+    start = time.perf_counter()
+    result = await awaitable
+    api_metrics.COMPUTE.observe(route, bucket, value=time.perf_counter() - start)
+    return result
+
+
+def timed_payload(build, route, bucket):
+    """
+    Build the body pieces of a response, timing the build and the printing as serialization.
+    """
+    start = time.perf_counter()
+    chunks, mimetype = build()
+    return api_metrics.timed_chunks(chunks, route, bucket, time.perf_counter() - start), mimetype
+
+
+async def app(scope, receive, send):
+    """
+    ASGI application serving the same routes as the Flask app in factorial.py.
+    """
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+    global cost_model
+    if cost_model is None:
+        cost_model = CostModel(engine)
+
+    route = scope["path"] if scope["path"] in ROUTES else "unknown"
+    start = time.perf_counter()
+    labels = {"n_bucket": api_metrics.n_bucket(None)}
+    headers = dict(scope.get("headers", []))
+    delay = api_metrics.request_start_delay(headers.get(b"x-request-start", b"").decode())
+    if delay is not None:
+        api_metrics.QUEUEING.observe(route, "proxy", value=delay)
+
+    async def send_and_record(message):
+        # The request is counted when its response starts, like in the Flask app
+        if message["type"] == "http.response.start":
+            status = str(message["status"])
+            api_metrics.REQUESTS.inc(route, status, labels["n_bucket"])
+            api_metrics.LATENCY.observe(route, status, labels["n_bucket"], value=time.perf_counter() - start)
+        await send(message)
+
+    api_metrics.IN_FLIGHT.inc()
+    try:
+        await handle(scope, receive, send_and_record, labels)
+    finally:
+        api_metrics.IN_FLIGHT.dec()
+
+
+async def handle(scope, receive, send, labels):
+    """
+    Answer one HTTP request, setting labels["n_bucket"] once the number is known.
+    """
+    method, path = scope["method"], scope["path"]
+    if method == "OPTIONS":
+        # CORS preflight, answered like flask_cors does
+        await send({"type": "http.response.start", "status": 204, "headers": [
+            (b"access-control-allow-origin", b"*"),
+            (b"access-control-allow-methods", b"GET, POST, OPTIONS"),
+            (b"access-control-allow-headers", b"content-type"),
+        ]})
+        await send({"type": "http.response.body", "body": b""})
+        return
+    if path == "/healthz" and method == "GET":
+        await send_json(send, 200, {"status": "ok"})
+        return
+    if path == "/metrics" and method == "GET":
+        await send({"type": "http.response.start", "status": 200, "headers": response_headers("text/plain; version=0.0.4")})
+        await send({"type": "http.response.body", "body": api_metrics.render(engine.stats(), flight.stats()).encode()})
+        return
+    if path == "/stats" and method == "GET":
+        await send_json(send, 200, {"engine": engine.stats(), "single_flight": flight.stats()})
+        return
+    if path not in ("/factorial", "/factorial/batch") or method != "POST":
+        await send_json(send, 404, {"error": "not found"})
+        return
+
+    args = dict(parse_qsl(scope.get("query_string", b"").decode()))
+    try:
+        data = json.loads(await read_body(receive) or b"null")
+    except ValueError:
+        data = None
+    try:
+        if path == "/factorial":
+            number, n, mode = parse_factorial_request(data, args)
+            labels["n_bucket"] = api_metrics.n_bucket(n)
+            result = await timed(compute(n), path, labels["n_bucket"])
+            build = lambda: factorial_payload(number, n, result, mode)
+            offload = large_payload([result])
+            chunks, mimetype = await in_thread(timed_payload, build, path, labels["n_bucket"]) if offload else timed_payload(build, path, labels["n_bucket"])
+            await send_chunks(send, chunks, mimetype, mode == "stream", offload)
+        else:
+            numbers, values, mode, body_format = parse_batch_request(data, args)
+            labels["n_bucket"] = api_metrics.n_bucket(max(values))
+            results = await timed(compute_many(values), path, labels["n_bucket"])
+            build = lambda: batch_payload(numbers, values, results, mode, body_format)
+            offload = large_payload(results[n] for n in values)
+            chunks, mimetype = await in_thread(timed_payload, build, path, labels["n_bucket"]) if offload else timed_payload(build, path, labels["n_bucket"])
+            await send_chunks(send, chunks, mimetype, mode == "stream" or body_format == "ndjson", offload)
+    except RequestError as e:
+        await send_json(send, 400, {"error": str(e)})
+    except Overloaded:
+        # Cheap and cached requests are still served while the offload queue is full
+        await send_json(send, admission.reject_status, {"error": "too many requests"}, {"Retry-After": admission.retry_after()})
+    except asyncio.TimeoutError:
+        await send_json(send, 504, {"error": "computation timed out"})
+    except BrokenProcessPool:
+        # A pool worker died: the pool is restarted on the next offloaded computation
+        await send_json(send, 503, {"error": "computation worker crashed"})
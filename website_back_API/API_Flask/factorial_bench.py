@@ -0,0 +1,74 @@
+import argparse
+import random
+import timeit
+
+from factorial_engine import ENGINES, FactorialEngine
+
+
+def bench_engine(name, n, repeat, number):
+    """
+    Time one uncached factorial engine for a single n.
+
+    Parameters:
+        name (str): The engine name.
+        n (int): The factorial argument.
+        repeat (int): How many timing rounds to run.
+        number (int): How many calls per timing round.
+
+    Returns:
+        float: The best time per call, in microseconds.
+    """
+    range_product = ENGINES[name]
+    times = timeit.repeat(lambda: range_product(1, n), repeat=repeat, number=number)
+    return min(times) / number * 1e6
+
+
+def bench_cached(engine, values):
+    """
+    Time the cached engine on a sequence of values, like the JMeter __Random(0001,1555) bodies.
+
+    Parameters:
+        engine (FactorialEngine): The engine to time (its cache is kept between calls).
+        values (list): The factorial arguments, in request order.
+
+    Returns:
+        float: The mean time per call, in microseconds.
+    """
+    elapsed = timeit.timeit(lambda: [engine.compute(n) for n in values], number=1)
+    return elapsed / len(values) * 1e6
+
+
+def main():
+    """
+    Main function to compare the factorial engines across n.
+    """
+    # Define the command-line arguments
+    parser = argparse.ArgumentParser(description="Compare the factorial engines across n")
+    parser.add_argument("--n", type=int, nargs="+", default=[10, 100, 500, 1000, 1555, 5000, 20000], help="The factorial arguments to time")
+    parser.add_argument("--engines", type=str, nargs="+", default=list(ENGINES), help="The engines to compare")
+    parser.add_argument("--repeat", type=int, default=5, help="The number of timing rounds")
+    parser.add_argument("--number", type=int, default=20, help="The number of calls per timing round")
+    parser.add_argument("--requests", type=int, default=20000, help="The number of random requests for the cached engine run")
+    parser.add_argument("--max_random", type=int, default=1555, help="The upper bound of the random request values")
+    args = parser.parse_args()
+
+    # Time the uncached engines
+    print("{:>8} ".format("n") + " ".join("{:>14}".format(name + " (us)") for name in args.engines))
+    for n in args.n:
+        times = [bench_engine(name, n, args.repeat, args.number) for name in args.engines]
+        print("{:>8} ".format(n) + " ".join("{:>14.1f}".format(t) for t in times))
+
+    # Time the cached engines on a JMeter-like request mix
+    values = [random.randint(1, args.max_random) for _ in range(args.requests)]
+    print()
+    print("{} random requests in [1, {}]:".format(args.requests, args.max_random))
+    for name in args.engines:
+        engine = FactorialEngine(engine=name)
+        mean_time = bench_cached(engine, values)
+        stats = engine.cache.stats()
+        print("  {:>8}: {:8.1f} us/request, cache hits {} misses {} evictions {}".format(
+            name, mean_time, stats["hits"], stats["misses"], stats["evictions"]))
+
+
+if __name__ == "__main__":
+    main()
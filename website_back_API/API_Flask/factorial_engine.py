@@ -0,0 +1,479 @@
+import math
+import multiprocessing
+import os
+import sys
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+
+def naive_range_product(lo, hi):
+    """
+    Multiply the integers in [lo, hi] one at a time (the original algorithm).
+
+    Parameters:
+        lo (int): The first factor.
+        hi (int): The last factor.
+
+    Returns:
+        int: The product lo * (lo+1) * ... * hi, or 1 if the range is empty.
+    """
+    result = 1
+    for i in range(lo, hi + 1):
+        result *= i
+    return result
+
+
+def binary_range_product(lo, hi):
+    """
+    Multiply the integers in [lo, hi] by binary splitting.
+
+    Splitting the range in halves keeps both operands of every multiplication
+    about the same size, which lets CPython use Karatsuba on the big ones.
+
+    Parameters:
+        lo (int): The first factor.
+        hi (int): The last factor.
+
+    Returns:
+        int: The product lo * (lo+1) * ... * hi, or 1 if the range is empty.
+    """
+    if hi < lo:
+        return 1
+    # Small ranges are faster as a plain loop
+    if hi - lo < 8:
+        result = lo
+        for i in range(lo + 1, hi + 1):
+            result *= i
+        return result
+    mid = (lo + hi) // 2
+    return binary_range_product(lo, mid) * binary_range_product(mid + 1, hi)
+
+
+def math_range_product(lo, hi):
+    """
+    Multiply the integers in [lo, hi] using the C implementation of math.perm.
+
+    Parameters:
+        lo (int): The first factor.
+        hi (int): The last factor.
+
+    Returns:
+        int: The product lo * (lo+1) * ... * hi, or 1 if the range is empty.
+    """
+    if hi < lo:
+        return 1
+    if lo <= 1:
+        return math.factorial(hi)
+    # perm(hi, k) = hi! / (hi - k)! = (hi - k + 1) * ... * hi
+    return math.perm(hi, hi - lo + 1)
+
+
+# Available engines, selectable with the FACTORIAL_ENGINE environment variable
+ENGINES = {
+    "naive": naive_range_product,
+    "binary": binary_range_product,
+    "math": math_range_product,
+}
+
+
+def get_engine(name):
+    """
+    Return the range product function of an engine.
+
+    Parameters:
+        name (str): The engine name, one of the keys of ENGINES.
+
+    Returns:
+        function: The range product function of the engine.
+    """
+    try:
+        return ENGINES[name]
+    except KeyError:
+        raise ValueError("Unknown factorial engine: {} (available: {})".format(name, ", ".join(ENGINES)))
+
+
+class LRUCache:
+    """
+    Thread-safe LRU cache of factorial results bounded by an approximate memory cap.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key):
+        """
+        Return the cached value for a key, or None if it is not cached.
+        """
+        with self._lock:
+            value = self._items.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            # Mark the entry as the most recently used
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """
+        Store a value, evicting the least recently used entries to stay under the memory cap.
+        """
+        size = sys.getsizeof(value)
+        # Values larger than the whole cache would only flush it
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.bytes -= sys.getsizeof(old)
+            self._items[key] = value
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self.bytes -= sys.getsizeof(evicted)
+                self.evictions += 1
+
+    def stats(self):
+        """
+        Return the cache counters as a dictionary.
+        """
+        return {
+            "items": len(self._items),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class FactorialEngine:
+    """
+    Compute factorials with a pluggable range product, an LRU result cache and precomputed checkpoints.
+
+    n! is built from the nearest checkpoint k! below n as k! * (k+1) * ... * n,
+    so at most checkpoint_step - 1 factors are multiplied on a cache miss.
+    """
+
+    def __init__(self, engine="math", cache_bytes=8 * 1024 * 1024, checkpoint_step=64, checkpoint_max=2048):
+        self.engine = engine
+        self.range_product = get_engine(engine)
+        self.cache = LRUCache(cache_bytes)
+        self.checkpoint_step = checkpoint_step
+        self.checkpoint_max = checkpoint_max
+        self.checkpoints = self._build_checkpoints()
+
+    def _build_checkpoints(self):
+        """
+        Precompute k! for every multiple k of checkpoint_step up to checkpoint_max.
+        """
+        checkpoints = [1]
+        if self.checkpoint_step <= 0:
+            return checkpoints
+        for k in range(self.checkpoint_step, self.checkpoint_max + 1, self.checkpoint_step):
+            checkpoints.append(checkpoints[-1] * self.range_product(k - self.checkpoint_step + 1, k))
+        return checkpoints
+
+    def nearest_checkpoint(self, n):
+        """
+        Return the largest checkpoint k <= n and its factorial.
+        """
+        if self.checkpoint_step <= 0:
+            return 0, 1
+        index = min(n // self.checkpoint_step, len(self.checkpoints) - 1)
+        return index * self.checkpoint_step, self.checkpoints[index]
+
+    def compute(self, n):
+        """
+        Return n!, from the cache when possible.
+
+        Parameters:
+            n (int): A non-negative integer.
+
+        Returns:
+            int: The factorial of n.
+        """
+        result = self.cache.get(n)
+        if result is not None:
+            return result
+        result = self.compute_uncached(n)
+        self.cache.put(n, result)
+        return result
+
+    def compute_uncached(self, n):
+        """
+        Return n! from the nearest checkpoint, without looking at or filling the cache.
+        """
+        k, k_factorial = self.nearest_checkpoint(n)
+        return k_factorial * self.range_product(k + 1, n)
+
+    def compute_many(self, numbers):
+        """
+        Return the factorials of many numbers in one incremental pass.
+
+        The distinct numbers are visited in ascending order and each k! is
+        built from the previous result (or a closer checkpoint), so the whole
+        batch costs about as much as its largest factorial.
+
+        Parameters:
+            numbers (list): Non-negative integers, in any order and with duplicates.
+
+        Returns:
+            dict: The factorial of every distinct number, keyed by number.
+        """
+        results = {}
+        base_n, base_value = 0, 1
+        for n in sorted(set(numbers)):
+            result = self.cache.get(n)
+            if result is None:
+                # Start from a checkpoint if it is closer than the previous result
+                k, k_factorial = self.nearest_checkpoint(n)
+                if k > base_n:
+                    base_n, base_value = k, k_factorial
+                result = base_value * self.range_product(base_n + 1, n)
+                self.cache.put(n, result)
+            results[n] = result
+            base_n, base_value = n, result
+        return results
+
+    def stats(self):
+        """
+        Return the engine configuration and cache counters as a dictionary.
+        """
+        return {
+            "engine": self.engine,
+            "checkpoint_step": self.checkpoint_step,
+            "checkpoint_max": self.checkpoint_max,
+            "cache": self.cache.stats(),
+        }
+
+
+def engine_from_env(cache_bytes=None):
+    """
+    Create a FactorialEngine configured by the FACTORIAL_* environment variables.
+
+    Parameters:
+        cache_bytes (int): Overrides FACTORIAL_CACHE_BYTES if given.
+    """
+    if cache_bytes is None:
+        cache_bytes = int(os.environ.get("FACTORIAL_CACHE_BYTES", 8 * 1024 * 1024))
+    return FactorialEngine(
+        engine=os.environ.get("FACTORIAL_ENGINE", "math"),
+        cache_bytes=cache_bytes,
+        checkpoint_step=int(os.environ.get("FACTORIAL_CHECKPOINT_STEP", 64)),
+        checkpoint_max=int(os.environ.get("FACTORIAL_CHECKPOINT_MAX", 2048)),
+    )
+
+
+# Engine of a process pool worker, created by _init_pool_worker
+_pool_engine = None
+
+
+def _init_pool_worker():
+    """
+    Create the engine of a process pool worker (the parent process keeps the result cache).
+    """
+    global _pool_engine
+    _pool_engine = engine_from_env(cache_bytes=0)
+
+
+def _pool_compute(n):
+    """
+    Compute n! in a process pool worker.
+    """
+    return _pool_engine.compute_uncached(n)
+
+
+def _pool_compute_many(numbers):
+    """
+    Compute many factorials in a process pool worker.
+    """
+    return _pool_engine.compute_many(numbers)
+
+
+class ProcessPoolOffloader:
+    """
+    Run CPU-heavy factorials in a pool of processes so that the GIL of the serving process does not serialize them.
+
+    The pool is started on first use, so that it is created inside each server
+    worker after the fork and never inherited from the master process. If a pool
+    worker dies (e.g. killed for using too much memory), the calls in flight fail
+    with BrokenProcessPool and the next call starts a new pool.
+    Cache misses go through an optional single-flight object (see singleflight.py)
+    so that concurrent requests for the same n share one computation.
+    """
+
+    def __init__(self, engine, workers, min_number, timeout, flight=None):
+        self.engine = engine
+        self.workers = workers
+        self.min_number = min_number
+        self.timeout = timeout
+        self.flight = flight
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def get_pool(self):
+        """
+        Return the process pool, starting it on first use.
+        """
+        with self._lock:
+            if self._pool is None:
+                # Spawned workers do not inherit the threads and locks of the server
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_pool_worker,
+                )
+            return self._pool
+
+    def _discard_pool(self, pool):
+        """
+        Forget a broken process pool, so that the next call starts a new one.
+        """
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def _submit(self, fn, *args):
+        """
+        Submit a call to the process pool, discarding the pool if it is or becomes broken.
+        """
+        pool = self.get_pool()
+        try:
+            future = pool.submit(fn, *args)
+        except BrokenProcessPool:
+            self._discard_pool(pool)
+            raise
+
+        def check_broken(future):
+            if not future.cancelled() and isinstance(future.exception(), BrokenProcessPool):
+                self._discard_pool(pool)
+
+        future.add_done_callback(check_broken)
+        return future
+
+    def shutdown(self):
+        """
+        Stop the process pool, if it was started.
+        """
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(cancel_futures=True)
+                self._pool = None
+
+    def compute(self, n):
+        """
+        Return n!, from the cache, inline for small n, or from the process pool.
+
+        Raises:
+            concurrent.futures.TimeoutError: If the pool does not answer within the timeout.
+            concurrent.futures.process.BrokenProcessPool: If a pool worker died.
+        """
+        result = self.engine.cache.get(n)
+        if result is None:
+            if self.flight is not None:
+                result = self.flight.do(n, lambda: self.compute_uncached(n))
+            else:
+                result = self.compute_uncached(n)
+            self.engine.cache.put(n, result)
+        return result
+
+    def compute_uncached(self, n):
+        """
+        Return n!, inline for small n or from the process pool, without looking at or filling the cache.
+        """
+        if self.workers <= 0 or n < self.min_number:
+            return self.engine.compute_uncached(n)
+        return self.submit(n).result(timeout=self.timeout)
+
+    def submit(self, n):
+        """
+        Start computing n! in the process pool.
+
+        Returns:
+            concurrent.futures.Future: The future result (not added to the cache).
+        """
+        return self._submit(_pool_compute, n)
+
+    def submit_many(self, numbers):
+        """
+        Start computing many factorials in the process pool.
+
+        Returns:
+            concurrent.futures.Future: The future dictionary of results (not added to the cache).
+        """
+        return self._submit(_pool_compute_many, numbers)
+
+    def compute_many(self, numbers):
+        """
+        Return the factorials of many numbers, in the process pool if the largest one is CPU heavy.
+
+        Raises:
+            concurrent.futures.TimeoutError: If the pool does not answer within the timeout.
+            concurrent.futures.process.BrokenProcessPool: If a pool worker died.
+        """
+        if self.workers <= 0 or max(numbers) < self.min_number:
+            return self.engine.compute_many(numbers)
+        results = self.submit_many(numbers).result(timeout=self.timeout)
+        for n, result in results.items():
+            self.engine.cache.put(n, result)
+        return results
+
+
+def offloader_from_env(engine, flight=None):
+    """
+    Create a ProcessPoolOffloader configured by the FACTORIAL_POOL_* environment variables.
+
+    Parameters:
+        engine (FactorialEngine): The engine used inline and whose cache is filled.
+        flight (SingleFlight): Deduplicates concurrent cache misses, if given.
+    """
+    return ProcessPoolOffloader(
+        engine,
+        workers=int(os.environ.get("FACTORIAL_POOL_WORKERS", 0)),
+        min_number=int(os.environ.get("FACTORIAL_POOL_MIN_NUMBER", 5000)),
+        timeout=float(os.environ.get("FACTORIAL_REQUEST_TIMEOUT", 30)),
+        flight=flight,
+    )
+
+
+def parse_number(value, max_number):
+    """
+    Validate the number sent by a client.
+
+    Parameters:
+        value: The raw value of the "number" field (int or numeric string).
+        max_number (int): The largest accepted number.
+
+    Returns:
+        int: The validated number.
+
+    Raises:
+        ValueError: If the value is not an integer in [0, max_number].
+    """
+    if isinstance(value, bool):
+        raise ValueError("number must be an integer")
+    try:
+        number = int(value)
+    except (TypeError, ValueError, OverflowError):
+        # OverflowError: an infinite float (Infinity or 1e400 in the JSON body)
+        raise ValueError("number must be an integer")
+    if isinstance(value, float) and value != number:
+        raise ValueError("number must be an integer")
+    if number < 0:
+        raise ValueError("number must not be negative")
+    if number > max_number:
+        raise ValueError("number must not be greater than {}".format(max_number))
+    return number
@@ -0,0 +1,143 @@
+import json
+import os
+
+from factorial_engine import parse_number
+from factorial_serialize import compact_summary, iter_batch_json, iter_batch_ndjson, iter_factorial_json
+
+# Largest number accepted by the API
+MAX_NUMBER = int(os.environ.get("FACTORIAL_MAX_NUMBER", 100000))
+
+# Largest number of values accepted by the batch endpoint
+MAX_BATCH = int(os.environ.get("FACTORIAL_MAX_BATCH", 1000))
+
+# Response modes: the whole body at once, the digits streamed in chunks, or only a summary of the digits
+RESPONSE_MODES = ("full", "stream", "compact")
+
+# Body formats of the batch endpoint: one JSON document, or one JSON line per result
+BODY_FORMATS = ("json", "ndjson")
+
+# Maximum number of digits per chunk of a streamed response
+STREAM_CHUNK_DIGITS = int(os.environ.get("FACTORIAL_STREAM_CHUNK_DIGITS", 65536))
+
+
+class RequestError(ValueError):
+    """
+    Raised when a request body is invalid (answered with 400).
+    """
+
+
+def parse_mode(data, args):
+    """
+    Return the response mode from the request body or the query string.
+    """
+    mode = data.get("mode") or args.get("mode", "full")
+    if mode not in RESPONSE_MODES:
+        raise RequestError("mode must be one of: {}".format(", ".join(RESPONSE_MODES)))
+    return mode
+
+
+def parse_factorial_request(data, args):
+    """
+    Validate a POST /factorial request.
+
+    Parameters:
+        data (dict): The JSON body.
+        args (dict): The query string arguments.
+
+    Returns:
+        tuple: The number as sent, the validated number and the response mode.
+
+    Raises:
+        RequestError: If the request is invalid.
+    """
+    if not isinstance(data, dict):
+        raise RequestError("a JSON object is required")
+    number = data.get("number")
+    if not number:
+        raise RequestError("number is required")
+    try:
+        n = parse_number(number, MAX_NUMBER)
+    except ValueError as e:
+        raise RequestError(str(e))
+    return number, n, parse_mode(data, args)
+
+
+def parse_batch_request(data, args):
+    """
+    Validate a POST /factorial/batch request.
+
+    Parameters:
+        data (dict): The JSON body.
+        args (dict): The query string arguments.
+
+    Returns:
+        tuple: The numbers as sent, the validated numbers, the response mode and the body format ("json" or "ndjson").
+
+    Raises:
+        RequestError: If the request is invalid.
+    """
+    if not isinstance(data, dict):
+        raise RequestError("a JSON object is required")
+    numbers = data.get("numbers")
+    if not isinstance(numbers, list) or not numbers:
+        raise RequestError("numbers must be a non-empty list")
+    if len(numbers) > MAX_BATCH:
+        raise RequestError("numbers must not contain more than {} values".format(MAX_BATCH))
+    try:
+        values = [parse_number(number, MAX_NUMBER) for number in numbers]
+    except ValueError as e:
+        raise RequestError(str(e))
+    body_format = data.get("format") or args.get("format", "json")
+    if body_format not in BODY_FORMATS:
+        raise RequestError("format must be one of: {}".format(", ".join(BODY_FORMATS)))
+    return numbers, values, parse_mode(data, args), body_format
+
+
+def factorial_payload(number, n, result, mode):
+    """
+    Build the body of a factorial response in the requested mode.
+
+    Parameters:
+        number: The number as sent by the client.
+        n (int): The validated number.
+        result (int): The factorial of n.
+        mode (str): One of RESPONSE_MODES.
+
+    Returns:
+        tuple: The body pieces (an iterator, consumed lazily in stream mode) and the mimetype.
+    """
+    if mode == "compact":
+        summary = compact_summary(n, result)
+        summary["number"] = number
+        return iter([json.dumps(summary)]), "application/json"
+    # str(int) is quadratic and limited to a few thousand digits, so the digits are always printed by the serializer
+    return iter_factorial_json(number, result, STREAM_CHUNK_DIGITS), "application/json"
+
+
+def batch_payload(numbers, values, results, mode, body_format):
+    """
+    Build the body of a batch response, in request order.
+
+    Parameters:
+        numbers (list): The numbers as sent by the client.
+        values (list): The validated numbers.
+        results (dict): The factorial of every distinct value.
+        mode (str): One of RESPONSE_MODES.
+        body_format (str): "json" or "ndjson".
+
+    Returns:
+        tuple: The body pieces and the mimetype.
+    """
+    if mode == "compact":
+        summaries = []
+        for number, n in zip(numbers, values):
+            summary = compact_summary(n, results[n])
+            summary["number"] = number
+            summaries.append(summary)
+        if body_format == "ndjson":
+            return iter([json.dumps(summary) + "\n" for summary in summaries]), "application/x-ndjson"
+        return iter([json.dumps({"results": summaries})]), "application/json"
+    items = [(number, results[n]) for number, n in zip(numbers, values)]
+    if body_format == "ndjson":
+        return iter_batch_ndjson(items, STREAM_CHUNK_DIGITS), "application/x-ndjson"
+    return iter_batch_json(items, STREAM_CHUNK_DIGITS), "application/json"
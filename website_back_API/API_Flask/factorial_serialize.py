@@ -0,0 +1,196 @@
+import decimal
+import json
+
+# Integers up to this many bits are converted to Decimal directly
+_BITS_LIMIT = 1024
+
+# Decimal value of 2**(2**k), cached by k
+_pow2_cache = {}
+
+# Context large enough to hold every integer exactly
+_context = decimal.Context(prec=decimal.MAX_PREC, Emax=decimal.MAX_EMAX, Emin=decimal.MIN_EMIN, traps=[decimal.Inexact])
+
+
+def _pow2(k):
+    """
+    Return 2**(2**k) as a Decimal, computed once per k.
+    """
+    value = _pow2_cache.get(k)
+    if value is None:
+        if k == 0:
+            value = decimal.Decimal(2)
+        else:
+            half = _pow2(k - 1)
+            value = _context.multiply(half, half)
+        _pow2_cache[k] = value
+    return value
+
+
+def _to_decimal(value, bits):
+    """
+    Convert a non-negative int of at most `bits` bits to Decimal by splitting it on powers of two.
+    """
+    if bits <= _BITS_LIMIT:
+        return decimal.Decimal(value)
+    # Split at the largest power of two below the width so that every split width hits the cache
+    k = (bits - 1).bit_length() - 1
+    low_bits = 1 << k
+    high = value >> low_bits
+    low = value - (high << low_bits)
+    high = _to_decimal(high, bits - low_bits)
+    return _context.add(_context.multiply(high, _pow2(k)), _to_decimal(low, low_bits))
+
+
+def int_to_decimal(value):
+    """
+    Convert an int to Decimal in subquadratic time.
+
+    str(int) is quadratic in CPython and refuses ints with more than
+    sys.get_int_max_str_digits() digits, while libmpdec multiplies big numbers
+    in subquadratic time and prints them in linear time.
+
+    Parameters:
+        value (int): The integer to convert.
+
+    Returns:
+        Decimal: The same integer as an exact Decimal.
+    """
+    if value < 0:
+        return _context.minus(_to_decimal(-value, (-value).bit_length()))
+    return _to_decimal(value, value.bit_length())
+
+
+def digit_count(value):
+    """
+    Return the number of decimal digits of a non-negative int.
+    """
+    if value == 0:
+        return 1
+    return int_to_decimal(value).adjusted() + 1
+
+
+def _iter_digits(value, width, chunk_digits):
+    """
+    Yield the digits of a non-negative integer Decimal, zero padded to width, in chunks.
+    """
+    if width <= chunk_digits:
+        yield "{:f}".format(value).zfill(width)
+        return
+    # Dividing by a power of ten is a cheap shift in decimal arithmetic
+    low_width = width // 2
+    high, low = _context.divmod(value, decimal.Decimal(1).scaleb(low_width, _context))
+    yield from _iter_digits(high, width - low_width, chunk_digits)
+    yield from _iter_digits(low, low_width, chunk_digits)
+
+
+def iter_decimal_chunks(value, chunk_digits=65536):
+    """
+    Yield the decimal representation of an int in chunks of at most chunk_digits digits.
+
+    Parameters:
+        value (int): The integer to print.
+        chunk_digits (int): The maximum number of digits per chunk.
+
+    Returns:
+        generator: The digit strings, most significant first.
+    """
+    if value < 0:
+        yield "-"
+        value = -value
+    if value == 0:
+        yield "0"
+        return
+    converted = int_to_decimal(value)
+    yield from _iter_digits(converted, converted.adjusted() + 1, chunk_digits)
+
+
+def iter_factorial_json(number, value, chunk_digits=65536):
+    """
+    Yield the JSON body {"number": ..., "factorial": ...} in chunks.
+
+    Parameters:
+        number: The number as sent by the client.
+        value (int): Its factorial.
+        chunk_digits (int): The maximum number of digits per chunk.
+
+    Returns:
+        generator: The JSON body pieces.
+    """
+    yield '{"number": ' + json.dumps(number) + ', "factorial": '
+    yield from iter_decimal_chunks(value, chunk_digits)
+    yield "}"
+
+
+def iter_batch_json(items, chunk_digits=65536):
+    """
+    Yield the JSON body {"results": [{"number": ..., "factorial": ...}, ...]} in chunks.
+
+    Parameters:
+        items (list): (number, factorial) pairs, in response order.
+        chunk_digits (int): The maximum number of digits per chunk.
+
+    Returns:
+        generator: The JSON body pieces.
+    """
+    yield '{"results": ['
+    for i, (number, value) in enumerate(items):
+        if i:
+            yield ", "
+        yield from iter_factorial_json(number, value, chunk_digits)
+    yield "]}"
+
+
+def iter_batch_ndjson(items, chunk_digits=65536):
+    """
+    Yield one JSON object per line (NDJSON) for every (number, factorial) pair.
+
+    Parameters:
+        items (iterable): (number, factorial) pairs, in response order.
+        chunk_digits (int): The maximum number of digits per chunk.
+
+    Returns:
+        generator: The NDJSON body pieces.
+    """
+    for number, value in items:
+        yield from iter_factorial_json(number, value, chunk_digits)
+        yield "\n"
+
+
+def factorial_trailing_zeros(n):
+    """
+    Return the number of trailing zeros of n! (Legendre's formula).
+    """
+    zeros = 0
+    power = 5
+    while power <= n:
+        zeros += n // power
+        power *= 5
+    return zeros
+
+
+def compact_summary(n, value, leading=20):
+    """
+    Summarize n! without printing all of its digits.
+
+    Parameters:
+        n (int): The factorial argument.
+        value (int): n!.
+        leading (int): The number of leading digits to return.
+
+    Returns:
+        dict: The digit count, the trailing zeros and the leading digits.
+    """
+    # Only the top bits are needed for the leading digits
+    shift = max(value.bit_length() - 4 * (leading + 20), 0)
+    top = decimal.Decimal(value >> shift)
+    if shift:
+        # A few guard digits make the truncation exact but for carries on long runs of 9s
+        local = decimal.Context(prec=leading + 30, Emax=decimal.MAX_EMAX, Emin=decimal.MIN_EMIN)
+        top = local.multiply(top, local.power(2, shift))
+    digits = top.adjusted() + 1
+    leading_digits = "{:f}".format(top.scaleb(min(leading, digits) - digits).to_integral_value(decimal.ROUND_FLOOR))
+    return {
+        "digits": digits,
+        "trailing_zeros": factorial_trailing_zeros(n),
+        "leading_digits": leading_digits,
+    }
@@ -0,0 +1,468 @@
+import argparse
+import os
+import socket
+import socketserver
+import sys
+import threading
+import time
+
+
+def encode_int(value):
+    """
+    Encode a non-negative int as little-endian bytes.
+    """
+    return value.to_bytes((value.bit_length() + 7) // 8, "little")
+
+
+def decode_int(data):
+    """
+    Decode the bytes written by encode_int.
+    """
+    return int.from_bytes(data, "little")
+
+
+def choose_victims(entries, bytes_to_free, now):
+    """
+    Choose the entries to evict, preferring big entries that have not been used for a long time.
+
+    A big result costs as much memory as many small ones, so entries are
+    evicted by decreasing size * idle time rather than by idle time alone.
+
+    Parameters:
+        entries (list): (key, size, last_access) tuples.
+        bytes_to_free (int): The number of bytes to free.
+        now (float): The current time, in the unit of last_access.
+
+    Returns:
+        list: The keys to evict.
+    """
+    victims = []
+    for key, size, last_access in sorted(entries, key=lambda entry: entry[1] * (now - entry[2] + 1), reverse=True):
+        if bytes_to_free <= 0:
+            break
+        victims.append(key)
+        bytes_to_free -= size
+    return victims
+
+
+class CacheBackend:
+    """
+    Interface of the shared tier of the result cache.
+
+    Implementations must never raise on I/O problems: a failing shared store
+    only turns into cache misses.
+    """
+
+    def get(self, key):
+        """
+        Return the value stored for an int key, or None.
+        """
+        raise NotImplementedError
+
+    def set(self, key, value):
+        """
+        Store a non-negative int value for an int key.
+        """
+        raise NotImplementedError
+
+    def hot_keys(self, limit):
+        """
+        Return up to limit keys, most recently used first.
+        """
+        raise NotImplementedError
+
+
+class MemoryBackend(CacheBackend):
+    """
+    In-memory store with size-aware eviction, used by the cache server.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.evictions = 0
+        # key -> [encoded value, last access]
+        self._items = {}
+        self._lock = threading.Lock()
+
+    def get_bytes(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            item[1] = time.monotonic()
+            return item[0]
+
+    def set_bytes(self, key, data):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.bytes -= len(old[0])
+            self._items[key] = [data, time.monotonic()]
+            self.bytes += len(data)
+            if self.bytes > self.max_bytes:
+                entries = [(k, len(item[0]), item[1]) for k, item in self._items.items()]
+                for victim in choose_victims(entries, self.bytes - self.max_bytes, time.monotonic()):
+                    self.bytes -= len(self._items.pop(victim)[0])
+                    self.evictions += 1
+
+    def get(self, key):
+        data = self.get_bytes(key)
+        return None if data is None else decode_int(data)
+
+    def set(self, key, value):
+        self.set_bytes(key, encode_int(value))
+
+    def hot_keys(self, limit):
+        with self._lock:
+            ordered = sorted(self._items.items(), key=lambda item: item[1][1], reverse=True)
+        return [key for key, _ in ordered[:limit]]
+
+
+class FileBackend(CacheBackend):
+    """
+    Store shared by the processes that can see a directory (e.g. the workers of a pod, or pods sharing a volume).
+
+    Every value is a file written atomically; the access time of an entry is
+    its modification time, refreshed on reads.
+
+    The size of the directory is kept as a running total of the writes of this
+    process, re-synced from a scan of the directory every resync_seconds (the
+    other processes write too). Only when it goes above max_bytes is the
+    directory scanned and evicted, down to low_water times max_bytes so that
+    the next scans are some writes away.
+    """
+
+    def __init__(self, directory, max_bytes, resync_seconds=10, low_water=0.9):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.resync_seconds = resync_seconds
+        self.low_water = low_water
+        self.evictions = 0
+        self._size = None
+        self._synced = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, "{}.bin".format(key))
+
+    def get(self, key):
+        try:
+            with open(self._path(key), "rb") as f:
+                data = f.read()
+            os.utime(self._path(key))
+        except OSError:
+            return None
+        return decode_int(data)
+
+    def set(self, key, value):
+        data = encode_int(value)
+        if len(data) > self.max_bytes:
+            return
+        temp_path = self._path(key) + ".{}.{}.tmp".format(os.getpid(), threading.get_ident())
+        try:
+            with open(temp_path, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, self._path(key))
+            self._added(len(data))
+        except OSError as e:
+            print("Could not write to the shared cache: {}".format(e))
+
+    def _entries(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".bin"):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((entry.name[:-len(".bin")], stat.st_size, stat.st_mtime))
+        return entries
+
+    def _added(self, size):
+        """
+        Count a written entry in the running size of the directory, and evict entries if it is above max_bytes.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self._size is not None and now - self._synced < self.resync_seconds:
+                # A replaced entry is counted twice until the next scan, which only makes the next scan earlier
+                self._size += size
+                if self._size <= self.max_bytes:
+                    return
+            entries = self._entries()
+            self._size = sum(entry_size for _, entry_size, _ in entries)
+            self._synced = now
+            if self._size > self.max_bytes:
+                self._evict(entries)
+
+    def _evict(self, entries):
+        sizes = {key: size for key, size, _ in entries}
+        for victim in choose_victims(entries, self._size - self.low_water * self.max_bytes, time.time()):
+            try:
+                os.remove(self._path(victim))
+                self.evictions += 1
+            except FileNotFoundError:
+                pass
+            self._size -= sizes[victim]
+
+    def hot_keys(self, limit):
+        try:
+            entries = self._entries()
+        except OSError:
+            return []
+        entries.sort(key=lambda entry: entry[2], reverse=True)
+        return [int(key) for key, _, _ in entries[:limit]]
+
+
+class SocketBackend(CacheBackend):
+    """
+    Client of a cache server (see serve_cache), shared by every pod that can reach it.
+
+    The protocol is line based: "GET <key>", "SET <key> <length>" followed by
+    the value bytes, and "HOT <limit>". Each thread keeps one connection open.
+    """
+
+    def __init__(self, host, port, timeout=0.5):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+            connection = (sock, sock.makefile("rb"))
+            self._local.connection = connection
+        return connection
+
+    def _close(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            connection[1].close()
+            connection[0].close()
+            self._local.connection = None
+
+    def _request(self, line, payload=b""):
+        """
+        Send one command and return the reader positioned after it, or None if the server is unreachable.
+        """
+        try:
+            sock, reader = self._connection()
+            sock.sendall(line.encode() + b"\n" + payload)
+            return reader
+        except OSError:
+            self._close()
+            return None
+
+    def get(self, key):
+        reader = self._request("GET {}".format(key))
+        if reader is None:
+            return None
+        try:
+            header = reader.readline().split()
+            if not header or header[0] != b"VALUE":
+                return None
+            return decode_int(reader.read(int(header[1])))
+        except (OSError, ValueError, IndexError):
+            self._close()
+            return None
+
+    def set(self, key, value):
+        data = encode_int(value)
+        reader = self._request("SET {} {}".format(key, len(data)), data)
+        if reader is None:
+            return
+        try:
+            reader.readline()
+        except OSError:
+            self._close()
+
+    def hot_keys(self, limit):
+        reader = self._request("HOT {}".format(limit))
+        if reader is None:
+            return []
+        try:
+            return [int(key) for key in reader.readline().split()[1:]]
+        except (OSError, ValueError):
+            self._close()
+            return []
+
+
+class TwoTierCache:
+    """
+    Result cache with an in-process LRU in front of a shared backend.
+
+    It has the interface of factorial_engine.LRUCache, so it can replace the cache of a FactorialEngine.
+    """
+
+    def __init__(self, local, shared, max_shared_item_bytes):
+        self.local = local
+        self.shared = shared
+        self.max_shared_item_bytes = max_shared_item_bytes
+        self.local_hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.local)
+
+    def get(self, key):
+        value = self.get_local(key)
+        if value is None:
+            value = self.get_shared(key)
+        return value
+
+    def get_local(self, key):
+        """
+        Look a key up in the local tier only.
+        """
+        value = self.local.get(key)
+        if value is not None:
+            self.local_hits += 1
+        return value
+
+    def get_shared(self, key):
+        """
+        Look a key up in the shared tier only (blocking I/O), and copy a hit into the local tier.
+        """
+        value = self.shared.get(key)
+        if value is not None:
+            self.shared_hits += 1
+            self.local.put(key, value)
+            return value
+        self.misses += 1
+        return None
+
+    def put(self, key, value):
+        self.local.put(key, value)
+        self.put_shared(key, value)
+
+    def put_shared(self, key, value):
+        """
+        Store a value in the shared tier only (blocking I/O).
+        """
+        # Very big results are cheaper to recompute than to move through the shared store
+        if sys.getsizeof(value) <= self.max_shared_item_bytes:
+            self.shared.set(key, value)
+
+    def preload(self, limit):
+        """
+        Copy the hottest keys of the shared store into the local tier (warm start).
+
+        Returns:
+            int: The number of preloaded keys.
+        """
+        loaded = 0
+        for key in self.shared.hot_keys(limit):
+            value = self.shared.get(key)
+            if value is not None:
+                self.local.put(key, value)
+                loaded += 1
+        return loaded
+
+    def stats(self):
+        lookups = self.local_hits + self.shared_hits + self.misses
+        stats = self.local.stats()
+        stats.update({
+            "local_hits": self.local_hits,
+            "shared_hits": self.shared_hits,
+            "shared_misses": self.misses,
+            "local_hit_ratio": self.local_hits / lookups if lookups else 0.0,
+            "shared_hit_ratio": self.shared_hits / (self.shared_hits + self.misses) if self.shared_hits + self.misses else 0.0,
+        })
+        return stats
+
+
+def backend_from_url(url, max_bytes):
+    """
+    Create a shared backend from a URL: "file:<directory>" or "socket:<host>:<port>".
+    """
+    scheme, _, location = url.partition(":")
+    if scheme == "file":
+        return FileBackend(location, max_bytes)
+    if scheme == "socket":
+        host, _, port = location.rpartition(":")
+        return SocketBackend(host, int(port))
+    raise ValueError("Unknown shared cache URL: {}".format(url))
+
+
+def cache_from_env(local):
+    """
+    Put the shared tier configured by FACTORIAL_SHARED_CACHE in front of a local cache, and warm it up.
+
+    Parameters:
+        local (LRUCache): The in-process cache.
+
+    Returns:
+        The local cache if no shared cache is configured, otherwise a TwoTierCache.
+    """
+    url = os.environ.get("FACTORIAL_SHARED_CACHE")
+    if not url:
+        return local
+    shared = backend_from_url(url, int(os.environ.get("FACTORIAL_SHARED_CACHE_BYTES", 256 * 1024 * 1024)))
+    cache = TwoTierCache(local, shared, int(os.environ.get("FACTORIAL_SHARED_MAX_ITEM_BYTES", 1024 * 1024)))
+    loaded = cache.preload(int(os.environ.get("FACTORIAL_WARM_KEYS", 2048)))
+    print("Preloaded {} results from the shared cache {}".format(loaded, url), flush=True)
+    return cache
+
+
+class _CacheRequestHandler(socketserver.StreamRequestHandler):
+    """
+    Serve the SocketBackend protocol on one connection.
+    """
+
+    def handle(self):
+        backend = self.server.backend
+        for line in self.rfile:
+            command = line.split()
+            try:
+                if command[0] == b"GET":
+                    data = backend.get_bytes(int(command[1]))
+                    if data is None:
+                        self.wfile.write(b"MISS\n")
+                    else:
+                        self.wfile.write("VALUE {}\n".format(len(data)).encode() + data)
+                elif command[0] == b"SET":
+                    backend.set_bytes(int(command[1]), self.rfile.read(int(command[2])))
+                    self.wfile.write(b"OK\n")
+                elif command[0] == b"HOT":
+                    keys = backend.hot_keys(int(command[1]))
+                    self.wfile.write(("KEYS " + " ".join(str(key) for key in keys) + "\n").encode())
+                else:
+                    self.wfile.write(b"ERROR\n")
+            except (IndexError, ValueError):
+                self.wfile.write(b"ERROR\n")
+
+
+class CacheServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, backend):
+        super().__init__(address, _CacheRequestHandler)
+        self.backend = backend
+
+
+def main():
+    """
+    Main function to run a shared factorial result cache server.
+    """
+    # Define the command-line arguments
+    parser = argparse.ArgumentParser(description="Run a shared factorial result cache server")
+    parser.add_argument("--host", type=str, default="0.0.0.0", help="The address to bind")
+    parser.add_argument("--port", type=int, default=7379, help="The port to bind")
+    parser.add_argument("--max_bytes", type=int, default=256 * 1024 * 1024, help="The memory cap of the cache")
+    args = parser.parse_args()
+
+    server = CacheServer((args.host, args.port), MemoryBackend(args.max_bytes))
+    print("Serving the factorial result cache on {}:{}".format(args.host, args.port), flush=True)
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+import argparse
+import math
+import os
+import socket
+
+
+def cpu_request_cores():
+    """
+    Return the CPU cores available to the container.
+
+    The CPU request is read from CPU_REQUEST_MILLICORES (set by the Kubernetes
+    downward API), then from the cgroup CPU quota, then from the CPU count.
+
+    Returns:
+        float: The number of cores.
+    """
+    millicores = os.environ.get("CPU_REQUEST_MILLICORES")
+    if millicores:
+        return int(millicores) / 1000
+    try:
+        # cgroup v2: "<quota> <period>" or "max <period>"
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            return int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+    return os.cpu_count() or 1
+
+
+def worker_count(cores, workers_per_core):
+    """
+    Return the number of server worker processes for the available cores.
+
+    Parameters:
+        cores (float): The CPU cores available to the container.
+        workers_per_core (float): How many workers to run per core.
+
+    Returns:
+        int: The number of workers, at least 1.
+    """
+    if os.environ.get("WEB_CONCURRENCY"):
+        return int(os.environ["WEB_CONCURRENCY"])
+    return max(1, math.ceil(cores * workers_per_core))
+
+
+def listen_socket(host, port):
+    """
+    Bind the listening socket of the async server, with TCP_NODELAY, for uvicorn to serve on (--fd).
+
+    When uvicorn runs several workers it binds their socket itself, without
+    TCP_NODELAY on the connections. The body of a small response then waits
+    for the ACK of its headers (Nagle's algorithm against the delayed ACK of
+    the client): about 40 ms per request on a keep-alive connection. The
+    accepted connections inherit TCP_NODELAY from this socket, as with gunicorn.
+
+    Returns:
+        socket.socket: The bound socket, inherited by the server.
+    """
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM, socket.IPPROTO_TCP)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.bind((host, port))
+    sock.set_inheritable(True)
+    return sock
+
+
+def server_command(mode, host, port, fd=None):
+    """
+    Build the command line of the server for a serving mode.
+
+    Parameters:
+        mode (str): "dev" for the Flask development server, "prefork" for gunicorn, "async" for the asyncio service on uvicorn.
+        host (str): The address to bind.
+        port (int): The port to bind.
+        fd (int): The file descriptor of a bound socket to serve on instead (async mode only).
+
+    Returns:
+        list: The command and its arguments.
+    """
+    if mode == "dev":
+        return ["flask", "--app", "factorial", "run", "--host={}".format(host), "--port={}".format(port)]
+    if mode == "prefork":
+        workers = worker_count(cpu_request_cores(), float(os.environ.get("WORKERS_PER_CORE", 2)))
+        return [
+            "gunicorn",
+            "--bind={}:{}".format(host, port),
+            "--workers={}".format(workers),
+            # Threaded workers keep connections alive between requests
+            "--worker-class=gthread",
+            "--threads={}".format(os.environ.get("GUNICORN_THREADS", 4)),
+            "--keep-alive={}".format(os.environ.get("KEEPALIVE", 5)),
+            # Workers that stop answering for longer than this are restarted
+            "--timeout={}".format(os.environ.get("FACTORIAL_REQUEST_TIMEOUT", 30)),
+            "--graceful-timeout=10",
+            "factorial:app",
+        ]
+    if mode == "async":
+        workers = worker_count(cpu_request_cores(), float(os.environ.get("WORKERS_PER_CORE", 2)))
+        address = ["--fd={}".format(fd)] if fd is not None else ["--host={}".format(host), "--port={}".format(port)]
+        return ["uvicorn"] + address + [
+            "--workers={}".format(workers),
+            "--timeout-keep-alive={}".format(os.environ.get("KEEPALIVE", 5)),
+            "factorial_async:app",
+        ]
+    raise ValueError("Unknown server mode: {}".format(mode))
+
+
+def main():
+    """
+    Main function to start the factorial API in the selected serving mode.
+    """
+    # Define the command-line arguments
+    parser = argparse.ArgumentParser(description="Start the factorial API")
+    parser.add_argument("--mode", type=str, default=os.environ.get("SERVER_MODE", "prefork"), choices=["dev", "prefork", "async"], help="The serving mode")
+    parser.add_argument("--host", type=str, default="0.0.0.0", help="The address to bind")
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", 5000)), help="The port to bind")
+    args = parser.parse_args()
+
+    # The async server serves on a socket bound here, so that its workers answer without the Nagle delay
+    sock = listen_socket(args.host, args.port) if args.mode == "async" else None
+    command = server_command(args.mode, args.host, args.port, sock.fileno() if sock else None)
+    print("Starting the factorial API: {}".format(" ".join(command)), flush=True)
+    # Replace this process so that the server receives the container signals
+    os.execvp(command[0], command)
+
+
+if __name__ == "__main__":
+    main()
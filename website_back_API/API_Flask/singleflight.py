@@ -0,0 +1,257 @@
+import asyncio
+import fcntl
+import os
+import threading
+import time
+
+
+class _Call:
+    """
+    An in-flight computation that followers wait on.
+    """
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Deduplicate concurrent computations of the same key across the threads of a process.
+
+    The first caller of a key (the leader) runs the computation, the callers
+    that arrive while it runs (the followers) wait for it and share its result.
+    An optional SharedFlightTable extends the deduplication to other processes.
+    """
+
+    def __init__(self, shared=None):
+        self.shared = shared
+        self.leaders = 0
+        self.merged = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        """
+        Return fn(), computed once for all the concurrent callers with the same key.
+
+        Parameters:
+            key: The key of the computation (an int if a shared table is used).
+            fn (function): The computation.
+
+        Returns:
+            The result of fn().
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+                self.leaders += 1
+            else:
+                self.merged += 1
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            if self.shared is not None:
+                call.result = self.shared.do(key, fn)
+            else:
+                call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+    def stats(self):
+        """
+        Return the deduplication counters as a dictionary.
+        """
+        stats = {"leaders": self.leaders, "merged": self.merged, "in_flight": len(self._calls)}
+        if self.shared is not None:
+            stats.update(self.shared.stats())
+        return stats
+
+
+class AsyncSingleFlight:
+    """
+    Deduplicate concurrent computations of the same key across the tasks of an event loop.
+    """
+
+    def __init__(self):
+        self.leaders = 0
+        self.merged = 0
+        self._calls = {}
+
+    async def do(self, key, coroutine_factory):
+        """
+        Return the result of coroutine_factory(), awaited once for all the concurrent callers with the same key.
+
+        The coroutine runs in its own task, so cancelling any caller, the first one
+        included, does not cancel it for the others.
+        """
+        task = self._calls.get(key)
+        if task is not None:
+            self.merged += 1
+        else:
+            self.leaders += 1
+            task = asyncio.ensure_future(coroutine_factory())
+            self._calls[key] = task
+            task.add_done_callback(lambda task: self._done(key, task))
+        return await asyncio.shield(task)
+
+    def _done(self, key, task):
+        del self._calls[key]
+        if not task.cancelled():
+            # Mark the exception as retrieved when every caller was cancelled
+            task.exception()
+
+    def stats(self):
+        """
+        Return the deduplication counters as a dictionary.
+        """
+        return {"leaders": self.leaders, "merged": self.merged, "in_flight": len(self._calls)}
+
+
+class SharedFlightTable:
+    """
+    Deduplicate computations of the same integer key across the processes of a pod.
+
+    The table lives in a shared memory directory (/dev/shm by default): byte n
+    of a lock file is locked by the process computing key n, and the result is
+    published as a file that the waiting processes read once the lock is
+    released. fcntl locks are released by the kernel if the leader dies.
+
+    Like the file cache, the number of published results is a running count of
+    the writes of this process, re-synced from a scan of the directory every
+    resync_seconds; the oldest results are dropped, down to low_water times
+    max_entries, only when it goes above max_entries.
+    """
+
+    def __init__(self, directory, max_entries=2048, timeout=30, poll_interval=0.002, resync_seconds=10, low_water=0.9):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.resync_seconds = resync_seconds
+        self.low_water = low_water
+        self.shared_hits = 0
+        self.shared_merged = 0
+        self._entries = None
+        self._synced = 0
+        self._count_lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._lock_fd = os.open(os.path.join(directory, "table.lock"), os.O_RDWR | os.O_CREAT, 0o600)
+
+    def _path(self, key):
+        return os.path.join(self.directory, "{}.bin".format(key))
+
+    def _read(self, key):
+        """
+        Return the published result of a key, or None.
+        """
+        try:
+            with open(self._path(key), "rb") as f:
+                return int.from_bytes(f.read(), "little")
+        except FileNotFoundError:
+            return None
+
+    def _write(self, key, value):
+        """
+        Publish the result of a key atomically and drop the oldest results if there are more than max_entries.
+        """
+        temp_path = self._path(key) + ".{}.tmp".format(os.getpid())
+        with open(temp_path, "wb") as f:
+            f.write(value.to_bytes((value.bit_length() + 7) // 8, "little"))
+        os.replace(temp_path, self._path(key))
+        with self._count_lock:
+            now = time.monotonic()
+            if self._entries is not None and now - self._synced < self.resync_seconds:
+                self._entries += 1
+                if self._entries <= self.max_entries:
+                    return
+            entries = []
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith(".bin"):
+                    try:
+                        entries.append((entry.stat().st_mtime, entry.path))
+                    except FileNotFoundError:
+                        continue
+            self._entries = len(entries)
+            self._synced = now
+            if self._entries <= self.max_entries:
+                return
+            entries.sort()
+            for _, path in entries[:self._entries - int(self.low_water * self.max_entries)]:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                self._entries -= 1
+
+    def do(self, key, fn):
+        """
+        Return fn(), computed by one process for all the processes asking for the same key at the same time.
+
+        Parameters:
+            key (int): A non-negative integer key.
+            fn (function): The computation, returning a non-negative int.
+
+        Returns:
+            int: The result of fn().
+        """
+        result = self._read(key)
+        if result is not None:
+            self.shared_hits += 1
+            return result
+        try:
+            fcntl.lockf(self._lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB, 1, key)
+        except OSError:
+            # Another process is computing this key: wait for its lock, then read its result
+            self.shared_merged += 1
+            deadline = time.monotonic() + self.timeout
+            while time.monotonic() < deadline:
+                try:
+                    fcntl.lockf(self._lock_fd, fcntl.LOCK_SH | fcntl.LOCK_NB, 1, key)
+                except OSError:
+                    time.sleep(self.poll_interval)
+                    continue
+                fcntl.lockf(self._lock_fd, fcntl.LOCK_UN, 1, key)
+                result = self._read(key)
+                if result is not None:
+                    return result
+                break
+            # The other process failed or is too slow: compute locally
+            return fn()
+        try:
+            # The result may have been published between the read and the lock
+            result = self._read(key)
+            if result is None:
+                result = fn()
+                self._write(key, result)
+            return result
+        finally:
+            fcntl.lockf(self._lock_fd, fcntl.LOCK_UN, 1, key)
+
+    def stats(self):
+        """
+        Return the cross-process counters as a dictionary.
+        """
+        return {"shared_hits": self.shared_hits, "shared_merged": self.shared_merged}
+
+
+def single_flight_from_env():
+    """
+    Create a SingleFlight, shared across processes if FACTORIAL_SHARED_FLIGHT_DIR is set.
+    """
+    directory = os.environ.get("FACTORIAL_SHARED_FLIGHT_DIR")
+    shared = SharedFlightTable(directory) if directory else None
+    return SingleFlight(shared)
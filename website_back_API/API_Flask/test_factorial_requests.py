@@ -0,0 +1,49 @@
+import json
+import math
+
+import pytest
+
+from factorial_requests import RequestError, batch_payload, parse_batch_request
+
+
+def batch(data, args=None):
+    """
+    Validate a batch request and return its body and mimetype.
+    """
+    numbers, values, mode, body_format = parse_batch_request(data, args or {})
+    results = {n: math.factorial(n) for n in values}
+    chunks, mimetype = batch_payload(numbers, values, results, mode, body_format)
+    return "".join(chunks), mimetype
+
+
+def test_batch_json():
+    body, mimetype = batch({"numbers": [5, 3, 5]})
+    assert mimetype == "application/json"
+    assert json.loads(body) == {"results": [{"number": 5, "factorial": 120}, {"number": 3, "factorial": 6}, {"number": 5, "factorial": 120}]}
+
+
+def test_batch_ndjson():
+    body, mimetype = batch({"numbers": [5, 3]}, {"format": "ndjson"})
+    assert mimetype == "application/x-ndjson"
+    assert [json.loads(line) for line in body.splitlines()] == [{"number": 5, "factorial": 120}, {"number": 3, "factorial": 6}]
+
+
+def test_batch_compact_ndjson():
+    body, mimetype = batch({"numbers": [30, 10], "mode": "compact", "format": "ndjson"})
+    assert mimetype == "application/x-ndjson"
+    assert body.endswith("\n")
+    lines = [json.loads(line) for line in body.splitlines()]
+    assert [line["number"] for line in lines] == [30, 10]
+    assert lines == json.loads(batch({"numbers": [30, 10], "mode": "compact"})[0])["results"]
+
+
+@pytest.mark.parametrize("data", [
+    {"numbers": [1], "format": "xml"},
+    {"numbers": []},
+    {"numbers": [float("inf")]},
+    {"numbers": [-1]},
+    {"numbers": [1], "mode": "summary"},
+])
+def test_batch_invalid(data):
+    with pytest.raises(RequestError):
+        parse_batch_request(data, {})
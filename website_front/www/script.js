@@ -6,17 +6,27 @@ input.addEventListener("keyup", function(event) {
   }
 });
 
-function calculate() {
-  var number = document.getElementById("number").value;
-  var result = document.getElementById("result");
+// Requests made within this window are coalesced into one batch request
+const BATCH_WINDOW_MS = 20;
+var pendingRequests = [];
+var batchTimer = null;
 
-  // Make an AJAX call to the backend API
-  fetch(`${window.location.origin.replace(/:\d+$/, "")}:30500/factorial`, {
+function apiUrl(path) {
+  return `${window.location.origin.replace(/:\d+$/, "")}:30500${path}`;
+}
+
+// Send every pending number in one POST /factorial/batch call
+function flushBatch() {
+  var batch = pendingRequests;
+  pendingRequests = [];
+  batchTimer = null;
+
+  fetch(apiUrl("/factorial/batch"), {
     method: 'POST',
     headers: {
       'Content-Type': 'application/json'
     },
-    body: JSON.stringify({ number: number })
+    body: JSON.stringify({ numbers: batch.map(request => request.number) })
   })
     .then(response => {
       if (response.ok) {
@@ -25,8 +35,28 @@ function calculate() {
         throw new Error(response.statusText)
       }
     })
-    .then(data => {
-      var factorial = data.factorial;
+    // Results come back in request order
+    .then(data => data.results.forEach((item, i) => batch[i].resolve(item.factorial)))
+    .catch(error => batch.forEach(request => request.reject(error)))
+}
+
+// Queue a number and resolve with its factorial once the batch is answered
+function requestFactorial(number) {
+  return new Promise((resolve, reject) => {
+    pendingRequests.push({ number: number, resolve: resolve, reject: reject });
+    if (batchTimer === null) {
+      batchTimer = setTimeout(flushBatch, BATCH_WINDOW_MS);
+    }
+  });
+}
+
+function calculate() {
+  var number = document.getElementById("number").value;
+  var result = document.getElementById("result");
+
+  // Make an AJAX call to the backend API
+  requestFactorial(number)
+    .then(factorial => {
       result.innerHTML = "The factorial of " + number + " is " + factorial;
     })
     .catch(error => console.log(error))